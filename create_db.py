@@ -7,7 +7,11 @@ import sys
 import arrow
 import docker
 
+from concurrent.futures import ProcessPoolExecutor
 from time import sleep
+from iyp.download import cache as download_cache
+from iyp.metrics import metrics
+from iyp.scheduler import Scheduler, prefetch, run_crawler
 
 NEO4J_VERSION = '5.1.0'
 
@@ -36,65 +40,181 @@ logging.warning("Started: %s" % sys.argv)
 with open('config.json', 'r') as fp:
     conf = json.load(fp)
 
-# Start a new neo4j container
+# Node IDs are cached in a sqlite file shared by all crawlers and worker
+# processes of the build
+node_cache_path = f'{root}neo4j/node_cache/{date}.sqlite'
+if os.path.exists(node_cache_path):
+    os.remove(node_cache_path)
+os.environ['IYP_NODE_CACHE'] = node_cache_path
+
+# Build the database with neo4j-admin import instead of live transactions
+bulk_import = conf['iyp'].get('bulk_import', False)
+staging_dir = f'{root}neo4j/staging/{date}/'
+
+# Update the database of the previous build with the differences between
+# each crawler's spool and its previously loaded spool, instead of building a
+# new database
+incremental = conf['iyp'].get('incremental', False) and not bulk_import
+if incremental:
+    tmp_dir = f'{root}neo4j/incremental/'
+    os.makedirs(tmp_dir, exist_ok=True)
+# Date of the spool of each crawler that is in the incremental database
+spool_dates_fname = f'{root}neo4j/incremental.json'
+
+# Crawlers write spool files loaded into neo4j by another process, so that
+# loading overlaps with the next crawlers' downloads
+spool = (conf['iyp'].get('spool', False) or incremental) and not bulk_import
+spool_root = f'{root}neo4j/spool/'
+
 client = docker.from_env()
 
+def start_container():
+    """Start a new neo4j container on tmp_dir and wait for it to be ready."""
+
+    logging.warning('Starting new container...')
+    container = client.containers.run(
+            'neo4j:'+NEO4J_VERSION, 
+            name = f'iyp-{date}',
+            ports = {
+                7474: 7474,
+                7687: 7687
+                },
+            volumes = {
+                tmp_dir: {'bind': '/data', 'mode': 'rw'}, 
+                },
+            environment = {
+                'NEO4J_AUTH': 'neo4j/password',
+                'NEO4J_server_memory_heap_initial__size': '16G',
+                'NEO4J_server_memory_heap_max__size': '16G',
+                },
+            remove = True,
+            detach=True
+        )
+
+    # Wait for the container to be ready
+    timeout = 120
+    stop_time = 3
+    elapsed_time = 0
+
+    # FIXME: this is not working?
+    while container.status != 'running' and elapsed_time < timeout:
+        sleep(stop_time)
+        elapsed_time += stop_time
+        #container.reload()
+        continue
+
+    return container
+
+
 ########## Start a new docker image ##########
 
-logging.warning('Starting new container...')
-container = client.containers.run(
-        'neo4j:'+NEO4J_VERSION, 
-        name = f'iyp-{date}',
-        ports = {
-            7474: 7474,
-            7687: 7687
-            },
-        volumes = {
-            tmp_dir: {'bind': '/data', 'mode': 'rw'}, 
-            },
-        environment = {
-            'NEO4J_AUTH': 'neo4j/password',
-            'NEO4J_server_memory_heap_initial__size': '16G',
-            'NEO4J_server_memory_heap_max__size': '16G',
-            },
-        remove = True,
-        detach=True
-    )
+if bulk_import:
+    # Crawlers write CSV files instead of connecting to neo4j
+    os.makedirs(staging_dir, exist_ok=True)
+    os.environ['IYP_STAGING_DIR'] = staging_dir
+else:
+    # The new database has no Dataset node, unchanged inputs are skipped
+    # (see BaseCrawler.skip_unchanged) only with spool or incremental builds,
+    # whose state is kept in spool files
+    container = start_container()
+
+    # Constraints are added (and duplicate nodes merged) once, before
+    # crawlers run concurrently
+    from iyp import IYP
+    IYP().close()
 
-# Wait for the container to be ready
-timeout = 120
-stop_time = 3
-elapsed_time = 0
+if spool:
+    from iyp.spool import spool_path, update
+    os.environ['IYP_SPOOL_DIR'] = spool_root
+    # A single loader, transactions are run in parallel by IYP
+    loader = ProcessPoolExecutor(max_workers=1)
+    loads = {}
 
-# FIXME: this is not working?
-while container.status != 'running' and elapsed_time < timeout:
-    sleep(stop_time)
-    elapsed_time += stop_time
-    #container.reload()
-    continue
+    spool_dates = {}
+    if incremental and os.path.exists(spool_dates_fname):
+        with open(spool_dates_fname) as fp:
+            spool_dates = json.load(fp)
 
 
 ########## Fetch data and feed to neo4j ##########
 
+# Downloads of all crawlers overlap, crawlers then read local files
+logging.warning('Prefetching data...')
+download_cache.prune()
+prefetch(conf['iyp']['crawlers'], conf['iyp'].get('fetch_workers', 16))
+
 logging.warning('Fetching data...')
 status = {}
 no_error = True
-for module_name in conf['iyp']['crawlers']:
-    module = importlib.import_module(module_name)
 
-    try:
-        logging.warning(f'start {module}')
-        name = module_name.replace('iyp.crawlers.', '')
-        crawler = module.Crawler(module.ORG, module.URL, name)
-        crawler.run()
-        crawler.close()
-        status[module_name] = "OK"
-        logging.warning(f'end {module}')
+def crawler_done(module_name, result):
+    """Record the status and metrics of a crawler that ended in the pool."""
 
-    except Exception as e:
+    global no_error
+
+    name = module_name.replace('iyp.crawlers.', '')
+    if isinstance(result, Exception):
+        status[module_name] = result
+        metrics.merge(name, {'status': repr(result), 'time': {}, 'counters': {}})
+    else:
+        status[module_name], crawler_metrics = result
+        metrics.merge(name, crawler_metrics)
+
+    if status[module_name] != 'OK':
         no_error = False
-        logging.exception('crawler crashed!!')
-        status[module_name] = e
+    elif spool:
+        previous = None
+        if incremental and name in spool_dates:
+            previous = spool_path(spool_root, name, spool_dates[name])
+        loads[module_name] = loader.submit(update, spool_path(spool_root, name, date), previous)
+
+# Independent crawlers run concurrently, crawlers listed in dependencies wait
+# for the crawlers they depend on
+scheduler = Scheduler(conf['iyp'].get('dependencies', {}), conf['iyp'].get('parallelism', 1),
+                      failed=lambda result: isinstance(result, Exception) or result[0] != 'OK')
+scheduler.run(conf['iyp']['crawlers'], run_crawler, crawler_done)
+
+if spool:
+    logging.warning('Waiting for spool loader...')
+    del os.environ['IYP_SPOOL_DIR']
+    for module_name, future in loads.items():
+        try:
+            future.result()
+            spool_dates[module_name.replace('iyp.crawlers.', '')] = date
+        except Exception as e:
+            no_error = False
+            logging.error(f'cannot load spool for {module_name}: {e}')
+            status[module_name] = e
+    loader.shutdown()
+
+    if incremental:
+        with open(spool_dates_fname, 'w') as fp:
+            json.dump(spool_dates, fp, indent=4)
+
+########## Import staged data ##########
+
+if bulk_import:
+    logging.warning('Importing staged data...')
+    del os.environ['IYP_STAGING_DIR']
+
+    from iyp.staging import finalize
+    import_args = finalize(staging_dir)
+
+    client.containers.run(
+        'neo4j/neo4j-admin:'+NEO4J_VERSION,
+        command = 'neo4j-admin database import full --overwrite-destination '
+                  '--multiline-fields=true --verbose '+' '.join(import_args)+' neo4j',
+        working_dir = '/import',
+        tty = True,
+        stdin_open = True,
+        remove = True,
+        volumes = {
+            tmp_dir: {'bind': '/data', 'mode': 'rw'}, 
+            staging_dir: {'bind': '/import', 'mode': 'ro'}, 
+            }
+    )
+
+    container = start_container()
 
 
 ########## Post processing scripts ##########
@@ -103,11 +223,13 @@ logging.warning('Post-processing...')
 for module_name in conf['iyp']['post']:
     module = importlib.import_module(module_name)
 
+    metrics.start(module_name)
     try:
         logging.warning(f'start {module}')
-        post = module.PostProcess()
-        post.run()
-        post.close()
+        with metrics.phase('post'):
+            post = module.PostProcess()
+            post.run()
+            post.close()
         status[module_name] = "OK"
         logging.warning(f'end {module}')
 
@@ -118,6 +240,8 @@ for module_name in conf['iyp']['post']:
         logging.error('\n')
         status[module_name] = e
 
+    metrics.end(module_name, status[module_name])
+
 
 ########## Stop container and dump DB ##########
 
@@ -146,6 +270,10 @@ container = client.containers.run(
 # rename dump
 os.rename(f'{dump_dir}/neo4j.dump', f'{dump_dir}/iyp-{date}.dump')
 
+# Write build metrics next to the dump
+metrics.write_json(f'{dump_dir}/iyp-{date}-metrics.json')
+metrics.write_prometheus(f'{dump_dir}/iyp-{date}.prom')
+
 final_words = ''
 if not no_error:
     # TODO send an email
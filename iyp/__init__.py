@@ -2,9 +2,18 @@ import glob
 import logging
 import os
 import sys
+import threading
+import timeit
+from collections import defaultdict
 from datetime import datetime, time, timezone
+from urllib.parse import urlparse
+from time import sleep
 from neo4j import GraphDatabase
-from neo4j.exceptions import ConstraintError
+from neo4j.exceptions import ConstraintError, DriverError, Neo4jError
+from iyp.checkpoints import Checkpoints, fingerprint
+from iyp.metrics import metrics, timed
+from iyp.nodeids import NodeIDMap
+from iyp.trace import Tracer
 
 # Usual constraints on nodes' properties
 NODE_CONSTRAINTS = {
@@ -33,17 +42,100 @@ NODE_CONSTRAINTS = {
         'Organization': {
                 'name': set(['NOT NULL'])
                 },
+
+        # Nodes created concurrently by several crawlers (with upserts)
+        'Name': {
+                'name': set(['UNIQUE', 'NOT NULL'])
+                },
+
+        'URL': {
+                'url': set(['UNIQUE', 'NOT NULL'])
+                },
+
+        'Tag': {
+                'label': set(['UNIQUE', 'NOT NULL'])
+                },
+
+        'OpaqueID': {
+                'id': set(['UNIQUE', 'NOT NULL'])
+                },
+
+        'PeeringdbOrgID': {
+                'id': set(['UNIQUE', 'NOT NULL'])
+                },
+
+        'PeeringdbFacID': {
+                'id': set(['UNIQUE', 'NOT NULL'])
+                },
+
+        'PeeringdbIXID': {
+                'id': set(['UNIQUE', 'NOT NULL'])
+                },
+
+        'PeeringdbNetID': {
+                'id': set(['UNIQUE', 'NOT NULL'])
+                },
+
+        # Marker of the data written by each crawler, see
+        # BaseCrawler.skip_unchanged
+        'Dataset': {
+                'name': set(['UNIQUE', 'NOT NULL'])
+                },
     }
 
 # Properties that may be frequently queried and that are not constraints
 NODE_INDEXES = {
-        'PeeringdbOrgID': [ 'id' ]
         }
 
+# Indexes of previous versions replaced by constraints, a constraint cannot be
+# created while an index exists on the same property
+DROPPED_INDEXES = ['PeeringdbOrgID_INDEX_id']
+
 # Set of node labels with constrains (ease search for node merging)
 NODE_CONSTRAINTS_LABELS = set(NODE_CONSTRAINTS.keys())
 
+# Initial number of items per transaction, then adapted to reach
+# TARGET_COMMIT_TIME
 BATCH_SIZE = 50000
+MIN_BATCH_SIZE = 100
+MAX_BATCH_SIZE = 1000000
+# Targeted duration (in seconds) for a batch transaction
+TARGET_COMMIT_TIME = 10
+# Maximum estimated size (in bytes) of the parameters sent in one transaction
+MAX_BATCH_PAYLOAD = 256*1024*1024
+# Errors raised by neo4j when a transaction exceeds memory limits, these
+# batches are split in two
+MEMORY_ERRORS = set([
+    'Neo.TransientError.General.MemoryPoolOutOfMemoryError',
+    'Neo.TransientError.General.TransactionMemoryLimit',
+    'Neo.TransientError.General.OutOfMemoryError',
+    ])
+
+# Number of records fetched at a time when reading query results
+FETCH_SIZE = 10000
+
+# Number of sessions (and threads) used to push links concurrently
+LINK_WORKERS = 4
+# Maximum time (in seconds) spent retrying a batch that failed with a transient
+# error (e.g. deadlock)
+RETRY_TIME = 300
+
+def format_value(prop_name, value):
+    """Format a single property value the same way format_properties does."""
+
+    # asn is stored as an int
+    if prop_name == 'asn':
+        return int(value)
+
+    # ipv6 is stored in lowercase
+    if prop_name == 'ip' or prop_name == 'prefix':
+        return value.lower()
+
+    # country code is kept in capital letter
+    if prop_name == 'country_code':
+        return value.upper()
+
+    return value
 
 def format_properties(prop):
     """Make sure certain properties are always formatted the same way.
@@ -52,21 +144,171 @@ def format_properties(prop):
 
     prop = dict(prop)
 
-    # asn is stored as an int
-    if 'asn' in prop:
-        prop['asn'] = int(prop['asn'])
+    for prop_name in ['asn', 'ip', 'prefix', 'country_code']:
+        if prop_name in prop:
+            prop[prop_name] = format_value(prop_name, prop[prop_name])
 
-    # ipv6 is stored in lowercase
-    if 'ip' in prop:
-        prop['ip'] = prop['ip'].lower()
-    if 'prefix' in prop:
-        prop['prefix'] = prop['prefix'].lower()
+    return prop
 
-    # country code is kept in capital letter
-    if 'country_code' in prop:
-        prop['country_code'] = prop['country_code'].upper()
 
-    return prop
+class BatchTooLarge(Exception):
+    """Raised when a batch exceeds neo4j memory limits."""
+    pass
+
+
+def db_identity(session):
+    """Return a string identifying the database of the given (synchronous)
+    session, it changes when the database is recreated."""
+
+    info = session.run('CALL db.info() YIELD id, creationDate RETURN id, creationDate').single()
+
+    return f'{info["id"]} {info["creationDate"]}'
+
+
+def init_schema(session, neo4j_enterprise):
+    """Add constraints and indexes with the given (synchronous) session.
+    Duplicate nodes are merged before adding a UNIQUE constraint that does
+    not exist yet (see merge_duplicates), so that databases built before the
+    constraint was defined can be migrated."""
+
+    existing = set( record['name'] for record in session.run('SHOW CONSTRAINTS YIELD name') )
+    for label, prop_constraints in NODE_CONSTRAINTS.items():
+        for prop_name, constraints in prop_constraints.items():
+            if 'UNIQUE' in constraints and f'{label}_UNIQUE_{prop_name}' not in existing:
+                merge_duplicates(session, label, prop_name)
+
+    for query in IYP._db_init_queries(neo4j_enterprise):
+        session.run(query)
+
+
+def merge_duplicates(session, label, prop_name):
+    """Merge nodes of the given label that have the same value for prop_name.
+    Links, labels and properties of the duplicates are moved to the node with
+    the lowest ID (whose properties are kept) and duplicates are deleted,
+    each group of duplicates in its own transaction."""
+
+    groups = [ sorted(record['ids']) for record in session.run(f"""MATCH (n:{label})
+        WHERE n.{prop_name} IS NOT NULL
+        WITH n.{prop_name} AS value, collect(ID(n)) AS ids
+        WHERE size(ids) > 1
+        RETURN ids""") ]
+
+    if len(groups) == 0:
+        return
+
+    logging.warning(f'IYP: merging {len(groups)} groups of duplicate {label} nodes '
+                    f'before adding a UNIQUE constraint on {prop_name}')
+
+    for ids in groups:
+        keep, duplicates = ids[0], ids[1:]
+        with session.begin_transaction() as tx:
+            links = list(tx.run("""MATCH (d)-[r]->(m) WHERE ID(d) IN $duplicates
+                RETURN type(r) AS type, ID(m) AS other, properties(r) AS props, true AS outgoing
+                UNION ALL
+                MATCH (m)-[r]->(d) WHERE ID(d) IN $duplicates AND NOT ID(m) IN $duplicates
+                RETURN type(r) AS type, ID(m) AS other, properties(r) AS props, false AS outgoing""",
+                duplicates=duplicates))
+
+            for link in links:
+                other = keep if link['other'] in duplicates else link['other']
+                pattern = '(k)-[r:{}]->(m)' if link['outgoing'] else '(m)-[r:{}]->(k)'
+                tx.run(f"""MATCH (k) WHERE ID(k) = $keep
+                    MATCH (m) WHERE ID(m) = $other
+                    CREATE {pattern.format(link['type'])}
+                    SET r = $props""", keep=keep, other=other, props=link['props'])
+
+            labels = set()
+            for record in tx.run("MATCH (d) WHERE ID(d) IN $duplicates RETURN labels(d) AS labels",
+                                 duplicates=duplicates):
+                labels.update(record['labels'])
+            for dup_label in labels:
+                tx.run(f"MATCH (k) WHERE ID(k) = $keep SET k:{dup_label}", keep=keep)
+
+            tx.run("""MATCH (k) WHERE ID(k) = $keep
+                WITH k, properties(k) AS kept
+                MATCH (d) WHERE ID(d) IN $duplicates
+                SET k += properties(d)
+                WITH k, kept
+                SET k += kept
+                WITH DISTINCT k
+                MATCH (d) WHERE ID(d) IN $duplicates
+                DETACH DELETE d""", keep=keep, duplicates=duplicates)
+
+            tx.commit()
+
+
+def write_batch(session, work, batch, metadata=None):
+    """Run work(tx, batch) in a write transaction and return its result, as
+    session.execute_write does. Memory errors, including the ones raised when
+    committing, are raised as BatchTooLarge instead of being retried with the
+    same batch. Other transient errors are retried for RETRY_TIME seconds."""
+
+    deadline = timeit.default_timer() + RETRY_TIME
+    delay = 1
+    while True:
+        tx = session.begin_transaction(metadata=metadata)
+        try:
+            records = work(tx, batch)
+            tx.commit()
+            return records
+
+        except Neo4jError as error:
+            if error.code in MEMORY_ERRORS:
+                raise BatchTooLarge(error)
+            if not error.is_retryable() or timeit.default_timer() + delay > deadline:
+                raise
+            logging.warning(f'IYP: transaction failed ({error.code}), retrying in {delay}s')
+
+        except DriverError as error:
+            if not error.is_retryable() or timeit.default_timer() + delay > deadline:
+                raise
+            logging.warning(f'IYP: transaction failed ({error}), retrying in {delay}s')
+
+        finally:
+            if not tx.closed():
+                tx.close()
+
+        sleep(delay)
+        delay *= 2
+
+
+class BatchSizer(object):
+    """Adapt the number of items per transaction to the time taken by previous
+    transactions and to the size of their parameters."""
+
+    def __init__(self, size=BATCH_SIZE):
+        self.size = size
+        self.lock = threading.Lock()
+
+    def update(self, nb_items, elapsed, payload):
+        """Update the batch size after a transaction of nb_items items with
+        parameters of payload bytes was committed in elapsed seconds."""
+
+        with self.lock:
+            # Move half way to the size expected to last TARGET_COMMIT_TIME,
+            # at most doubling the current size
+            target = nb_items * TARGET_COMMIT_TIME / max(elapsed, 0.001)
+            target = min(target, nb_items * MAX_BATCH_PAYLOAD / max(payload, 1))
+            size = min((self.size + target) / 2, self.size * 2)
+
+            self.size = int(min(max(size, MIN_BATCH_SIZE), MAX_BATCH_SIZE))
+
+    def shrink(self, nb_items):
+        """Update the batch size after a transaction of nb_items items
+        failed."""
+
+        with self.lock:
+            self.size = max(min(self.size, nb_items // 2), 1)
+
+
+def payload_size(batch):
+    """Estimate the size of the parameters sent for the given batch by
+    looking at a few items."""
+
+    step = max(len(batch) // 16, 1)
+    sample = batch[::step]
+
+    return len(str(sample)) * len(batch) / len(sample)
 
 
 def dict2str(d, eq=':', pfx=''):
@@ -85,13 +327,29 @@ def dict2str(d, eq=':', pfx=''):
     return '{'+','.join(data)+'}'
 
 
+def params2str(keys, param):
+    """Cypher map matching the given keys to the same keys of the map param
+    (a parameter or variable), e.g. {asn: $prop.asn}. The query text depends
+    only on the keys, hence the query plan can be reused for other values."""
+
+    return '{'+', '.join([ f'{key}: {param}.{key}' for key in sorted(keys) ])+'}'
+
+
 class IYP(object):
 
-    def __init__(self):
+    def __init__(self, name=None):
+        """Connect to the database. name is the name of the crawler using this
+        client, if given link pushes are checkpointed (see Checkpoints)."""
 
         logging.debug('IYP: Enter initialization')
+
+        # batch size for each query
+        self.batch_sizers = defaultdict(BatchSizer)
         self.neo4j_enterprise = False
 
+        # number of executions of each query text
+        self.query_counts = defaultdict(int)
+
         # TODO: get config from configuration file
         self.server = 'localhost'
         self.port = 7687
@@ -105,14 +363,39 @@ class IYP(object):
         if self.db is None:
             sys.exit('Could not connect to the Neo4j database!')
         else:
-            self.session = self.db.session()
+            self.session = self.db.session(fetch_size=FETCH_SIZE)
+
+        # Statements statistics, see Tracer
+        self.tracer = None
+        if os.environ.get('IYP_TRACE'):
+            self.tracer = Tracer(name)
 
         self._db_init()
-        self.tx = self.session.begin_transaction()
+        self.tx = self._begin()
+
+        # Node IDs cache shared with other clients
+        from iyp.cache import get_node_cache
+        self.node_cache = get_node_cache()
+        if self.node_cache is not None:
+            self.node_cache.check(self._db_identity())
+
+        # Committed link batches, to resume failed crawlers
+        self.checkpoints = None
+        if name is not None:
+            self.checkpoints = Checkpoints(name, self._db_identity())
 
 
     def _db_init(self):
-        """Add constraints and indexes."""
+        """Add constraints and indexes, see init_schema."""
+
+        init_schema(self.session, self.neo4j_enterprise)
+
+    @staticmethod
+    def _db_init_queries(neo4j_enterprise):
+        """Queries adding constraints and indexes."""
+
+        for index in DROPPED_INDEXES:
+            yield f"DROP INDEX {index} IF EXISTS"
 
         # Create constraints (implicitly add corresponding indexes)
         for label, prop_constraints in NODE_CONSTRAINTS.items():
@@ -120,11 +403,11 @@ class IYP(object):
 
                 for constraint in constraints:
                     # neo4j-community only implements the UNIQUE constraint
-                    if not self.neo4j_enterprise and constraint != 'UNIQUE':
+                    if not neo4j_enterprise and constraint != 'UNIQUE':
                         continue
 
                     constraint_formated = constraint.replace(' ', '')
-                    self.session.run(
+                    yield (
                         f" CREATE CONSTRAINT {label}_{constraint_formated}_{property} IF NOT EXISTS "
                         f" FOR (n:{label}) "
                         f" REQUIRE n.{property} IS {constraint} ")
@@ -132,68 +415,208 @@ class IYP(object):
         # Create indexes
         for label, indexes in NODE_INDEXES.items():
             for index in indexes:
-                self.session.run(
+                yield (
                     f" CREATE INDEX {label}_INDEX_{index} IF NOT EXISTS "
                     f" FOR (n:{label}) "
                     f" ON (n.{index}) ")
 
+    def _db_identity(self):
+        """Return a string identifying the database, see db_identity."""
+
+        return db_identity(self.session)
+
+    def _begin(self):
+        """Begin a new transaction, tagged with metadata if traced."""
+
+        if self.tracer is None:
+            return self.session.begin_transaction()
+
+        self.tx_number = self.tracer.next_tx()
+        return self.session.begin_transaction(metadata=self.tracer.metadata(tx=self.tx_number))
+
+    def _run(self, query, **params):
+        """Run a parameterized query in the current transaction."""
+
+        self.query_counts[query] += 1
+
+        if self.tracer is not None:
+            return self.tracer.run(self.tx, query, params, f'tx {self.tx_number}')
+
+        return self.tx.run(query, **params)
+
+    def plan_cache_stats(self):
+        """Return the number of queries run, the number of distinct query
+        texts and the rate of queries whose text was seen before. Neo4j caches
+        query plans by query text, so the later estimates the plan cache hit
+        rate."""
+
+        nb_queries = sum(self.query_counts.values())
+        nb_distinct = len(self.query_counts)
+        hit_rate = (nb_queries - nb_distinct) / nb_queries if nb_queries else 0
+
+        return nb_queries, nb_distinct, hit_rate
+
     def commit(self):
         """Commit all pending queries (node/link creation) and start a new
         transaction."""
 
+        start = timeit.default_timer()
         self.tx.commit()
-        self.tx = self.session.begin_transaction()
+        if self.tracer is not None:
+            self.tracer.record('COMMIT', {}, 0, timeit.default_timer()-start, tag=f'tx {self.tx_number}')
+
+        self.tx = self._begin()
+        metrics.count('transactions')
 
     def rollback(self):
         """Rollback all pending queries (node/link creation) and start a new
         transaction."""
 
         self.tx.rollback()
-        self.tx = self.session.begin_transaction()
+        self.tx = self._begin()
 
-    def batch_get_nodes(self, type, prop_name, prop_set=set(), all=True):
+    @timed('nodes')
+    def batch_get_nodes(self, type, prop_name, prop_set=set(), all=True, upsert=False):
         """Find the ID of all nodes in the graph for the given type (label)
         and check that a node exists for each value in prop_set for the property
-        prop. Create these nodes if they don't exist.
+        prop. Create these nodes if they don't exist. Results are streamed into
+        a NodeIDMap, a compact mapping from property values to node IDs.
 
         Notice: this is a costly operation if there is a lot of nodes for the
         given type. To return only the nodes corresponding to prop_set values 
         set all=False.
+        With upsert=True nodes for prop_set values are found and created at
+        once with MERGE (all is ignored). This is safe with concurrent crawlers
+        if prop_name has a UNIQUE constraint.
         This method commit changes to neo4j.
        """
 
-        if all:
-            existing_nodes = self.tx.run(f"MATCH (n:{type}) RETURN n.{prop_name} AS {prop_name}, ID(n) AS _id")
+        if upsert:
+            return self._upsert_nodes(type, prop_name, prop_set)
+
+        match_query, create_query = self._nodes_queries(type, prop_name, all)
+
+        if all and self.node_cache is not None:
+            ids = self._get_cached_nodes(type, prop_name)
+
+            # Nodes committed concurrently may be missing from the cache.
+            # Values not found in the cache are looked up by value before
+            # being created.
+            unknown = [val for val in prop_set if val not in ids]
+            if len(unknown):
+                lookup_query, _ = self._nodes_queries(type, prop_name, all=False)
+                for node in self._run(lookup_query, list_prop=unknown):
+                    ids[node[prop_name]] = node['_id']
         else:
-            list_prop = list(prop_set)
-            existing_nodes = self.tx.run(f"""
-            WITH $list_prop AS list_prop
-            MATCH (n:{type}) 
-            WHERE n.{prop_name} IN list_prop
-            RETURN n.{prop_name} AS {prop_name}, ID(n) AS _id""", list_prop=list_prop)
+            existing_nodes = self._run(match_query, list_prop=list(prop_set))
+            ids = NodeIDMap.from_items( (node[prop_name], node['_id']) for node in existing_nodes )
 
-        ids = {node[prop_name]: node['_id'] for node in existing_nodes }
-        existing_nodes_set = set(ids.keys())
-        missing_props = prop_set.difference(existing_nodes_set)
+        missing_props = [val for val in prop_set if val not in ids]
         missing_nodes = [{prop_name: val} for val in missing_props]
         
         # Create missing nodes
-        for i in range(0, len(missing_nodes), BATCH_SIZE):
-            batch = missing_nodes[i:i+BATCH_SIZE]
-
-            create_query = f"""WITH $batch AS batch 
-            UNWIND batch AS item CREATE (n:{type}) 
-            SET n += item RETURN n.{prop_name} AS {prop_name}, ID(n) AS _id"""
-
-            new_nodes = self.tx.run(create_query, batch=batch)
-
+        def add_ids(new_nodes):
             for node in new_nodes:
                 ids[node[prop_name]] = node['_id']
 
-            self.commit()
+        self._push_batches(create_query, missing_nodes, add_ids)
 
         return ids 
 
+    def _upsert_nodes(self, type, prop_name, prop_set):
+        """Merge nodes for all values in prop_set and return their IDs."""
+
+        upsert_query = self._upsert_query(type, prop_name)
+
+        ids = NodeIDMap()
+        def add_ids(nodes):
+            for node in nodes:
+                ids.append(node[prop_name], node['_id'])
+
+        self._push_batches(upsert_query, self._sorted_values(prop_set), add_ids)
+        ids.finish()
+
+        return ids
+
+    @staticmethod
+    def _upsert_query(type, prop_name):
+        """Return the query used by batch_get_nodes in upsert mode."""
+
+        if 'UNIQUE' not in NODE_CONSTRAINTS.get(type, {}).get(prop_name, set()):
+            logging.warning(f'No UNIQUE constraint on {type}.{prop_name}, '
+                            'upserts are slow and may create duplicate nodes')
+
+        return f"""UNWIND $batch AS val
+        MERGE (n:{type} {{{prop_name}: val}})
+        RETURN n.{prop_name} AS {prop_name}, ID(n) AS _id"""
+
+    @staticmethod
+    def _sorted_values(prop_set):
+        """Return values of prop_set in a list, sorted if possible so that
+        concurrent transactions lock index entries in the same order."""
+
+        try:
+            return sorted(prop_set)
+        except TypeError:
+            return list(prop_set)
+
+    def _get_cached_nodes(self, type, prop_name):
+        """Return a copy of the IDs of all nodes for the given label from the
+        node cache. Only nodes added to the database since the last call
+        (with a larger ID) are fetched. If the number of nodes seen then
+        differs from the number of nodes in the database, because nodes were
+        committed with a lower ID or deleted, the whole label is fetched
+        again. Nodes committed concurrently may still be missing, callers
+        should look up values they do not find."""
+
+        _, max_id, count = self.node_cache.get(type, prop_name)
+        total = self._run(f"MATCH (n:{type}) RETURN count(n) AS count").single()['count']
+
+        new_ids, max_id, count = self._fetch_nodes_after(type, prop_name, max_id, count)
+        if count != total:
+            logging.warning(f'Node cache: {count} {type} nodes cached, {total} in database, refreshing')
+            self.node_cache.reset(type, prop_name)
+            new_ids, max_id, count = self._fetch_nodes_after(type, prop_name, -1, 0)
+
+        return self.node_cache.update(type, prop_name, new_ids, max_id, count).copy()
+
+    def _fetch_nodes_after(self, type, prop_name, max_id, count):
+        """Return the IDs of nodes of the given label with an ID larger than
+        max_id, and the largest ID and number of nodes seen."""
+
+        new_nodes = self._run(f"""MATCH (n:{type}) WHERE ID(n) > $max_id
+            RETURN n.{prop_name} AS {prop_name}, ID(n) AS _id""", max_id=max_id)
+
+        new_ids = NodeIDMap()
+        for node in new_nodes:
+            new_ids.append(node[prop_name], node['_id'])
+            max_id = max(max_id, node['_id'])
+            count += 1
+        new_ids.finish()
+
+        return new_ids, max_id, count
+
+    @staticmethod
+    def _nodes_queries(type, prop_name, all):
+        """Return the queries used by batch_get_nodes to find existing nodes
+        and to create missing ones."""
+
+        if all:
+            match_query = f"MATCH (n:{type}) RETURN n.{prop_name} AS {prop_name}, ID(n) AS _id"
+        else:
+            match_query = f"""
+            WITH $list_prop AS list_prop
+            MATCH (n:{type}) 
+            WHERE n.{prop_name} IN list_prop
+            RETURN n.{prop_name} AS {prop_name}, ID(n) AS _id"""
+
+        create_query = f"""WITH $batch AS batch 
+        UNWIND batch AS item CREATE (n:{type}) 
+        SET n += item RETURN n.{prop_name} AS {prop_name}, ID(n) AS _id"""
+
+        return match_query, create_query
+
+    @timed('nodes')
     def get_node(self, type, prop, create=False):
         """Find the ID of a node in the graph  with the possibility to create it
         if it is not in the graph. 
@@ -203,7 +626,38 @@ class IYP(object):
         create: if the node doesn't exist, the node can be added to the database
         by setting create=True.
 
-        Return the node ID or None if the node does not exist and create=False."""
+        Return the node ID or None if the node does not exist and create=False.
+        Nodes are merged in their own transaction, committed at once, so that
+        concurrent crawlers merging the same node do not wait for each other's
+        transaction."""
+
+        query, fallback_query, params = self._get_node_queries(type, prop, create)
+
+        if not create:
+            result = self._run(query, **params).single()
+        else:
+            # Locks held by the current transaction would block the merge
+            self.commit()
+            try:
+                with self.db.session() as session:
+                    records = write_batch(session, lambda tx, _: list(tx.run(query, **params)), None)
+                result = records[0] if records else None
+                self.query_counts[query] += 1
+            except ConstraintError:
+                sys.stderr.write(f'cannot merge {prop}')
+                result = self._run(fallback_query, **params).single()
+
+        if result is not None:
+            return result[0]
+        else:
+            return None
+
+    @staticmethod
+    def _get_node_queries(type, prop, create):
+        """Return the query used by get_node, the query used if the first
+        one fails with a constraint error, and their parameters. Values are
+        given as parameters so the query text is the same for all nodes with
+        the same labels and property keys."""
 
         prop = format_properties(prop)
 
@@ -219,44 +673,30 @@ class IYP(object):
             if len( has_constraints ):
                 ### MERGE node with constraints
                 ### Search on the constraints and set other values
-                label = has_constraints.pop()
+                label = sorted(has_constraints)[0]
                 constraint_prop = dict([ (c, prop[c]) for c in NODE_CONSTRAINTS[label].keys() ]) 
-                #values = ', '.join([ f"a.{p} = {val}" for p, val in prop.items() ])
-                labels = ', '.join([ f"a:{l}" for l in type])
 
                 # TODO: fix this. Not working as expected. e.g. getting prefix
                 # with a descr in prop
-                try:
-                    result = self.tx.run(
-                    f"""MERGE (a:{label} {dict2str(constraint_prop)}) 
-                        ON MATCH
-                            SET {dict2str(prop, eq='=', pfx='a.')[1:-1]}, {labels}
-                        ON CREATE
-                            SET {dict2str(prop, eq='=', pfx='a.')[1:-1]}, {labels}
-                        RETURN ID(a)"""
-                        ).single()
-                except ConstraintError:
-                    sys.stderr.write(f'cannot merge {prop}')
-                    result = self.tx.run(
-                    f"""MATCH (a:{label} {dict2str(constraint_prop)}) RETURN ID(a)""").single()
+                return (f"""MERGE (a:{label} {params2str(constraint_prop, '$key')}) 
+                        SET a += $prop, a:{type_str}
+                        RETURN ID(a)""",
+                        f"""MATCH (a:{label} {params2str(constraint_prop, '$key')}) RETURN ID(a)""",
+                        {'key': constraint_prop, 'prop': prop})
 
             else:
                 ### MERGE node without constraints
-                result = self.tx.run(f"MERGE (a:{type_str} {dict2str(prop)}) RETURN ID(a)").single()
+                return f"MERGE (a:{type_str} {params2str(prop, '$prop')}) RETURN ID(a)", None, {'prop': prop}
         else:
             ### MATCH node
-            result = self.tx.run(f"MATCH (a:{type_str} {dict2str(prop)}) RETURN ID(a)").single()
-
-        if result is not None:
-            return result[0]
-        else:
-            return None
+            return f"MATCH (a:{type_str} {params2str(prop, '$prop')}) RETURN ID(a)", None, {'prop': prop}
 
+    @timed('nodes')
     def batch_get_node_extid(self, id_type):
         """Find all nodes in the graph which have an EXTERNAL_ID relationship with
         the given id_type. Return None if the node does not exist."""
 
-        result = self.tx.run(f"MATCH (a)-[:EXTERNAL_ID]->(i:{id_type}) RETURN i.id AS extid, ID(a) AS nodeid")
+        result = self._run(f"MATCH (a)-[:EXTERNAL_ID]->(i:{id_type}) RETURN i.id AS extid, ID(a) AS nodeid")
 
         ids = {}
         for node in result:
@@ -266,56 +706,354 @@ class IYP(object):
         return ids
 
 
+    @timed('nodes')
     def get_node_extid(self, id_type, id):
         """Find a node in the graph which has an EXTERNAL_ID relationship with
         the given ID. Return None if the node does not exist."""
 
-        result = self.tx.run(f"MATCH (a)-[:EXTERNAL_ID]->(:{id_type} {{id:{id}}}) RETURN ID(a)").single()
+        result = self._run(f"MATCH (a)-[:EXTERNAL_ID]->(:{id_type} {{id: $id}}) RETURN ID(a)", id=id).single()
 
         if result is not None:
             return result[0]
         else:
             return None
 
-    def batch_add_links(self, type, links, action='create'):
+    @timed('nodes')
+    def batch_get_ranked_nodes(self, type, prop_name, max_rank):
+        """Return the IDs of nodes of the given type with a RANK link to a
+        Ranking node with a rank lower than max_rank, indexed by the given
+        property."""
+
+        result = self._run(f"""MATCH (n:{type})-[r:RANK]->(:Ranking) WHERE r.rank < $max_rank
+            RETURN DISTINCT n.{prop_name} AS {prop_name}, ID(n) AS _id""", max_rank=max_rank)
+
+        return { node[prop_name]: node['_id'] for node in result }
+
+    def get_dataset(self, name):
+        """Return the properties of the Dataset node of the given crawler or
+        None if there is no such node."""
+
+        result = self._run("MATCH (d:Dataset {name: $name}) RETURN properties(d)", name=name).single()
+
+        if result is not None:
+            return result[0]
+        else:
+            return None
+
+    def set_dataset(self, props):
+        """Create or update the Dataset node of a crawler."""
+
+        self.get_node('Dataset', props, create=True)
+
+    def reuse_dataset(self, name):
+        """Keep the data of a crawler whose input did not change (see
+        BaseCrawler.skip_unchanged), it is already in the database."""
+
+        pass
+
+    @timed('links')
+    def batch_add_links(self, type, links, action='create', reference=None):
         """Create links of the given type in batches (this is faster than add_links).
         The links parameter is a list of {"src_id":int, "dst_id":int, "props":[dict].
         The dictionary prop_dict should at least contain a 'source', 'point in time', 
         and 'reference URL'. Keys in this dictionary should contain no space.
-        To merge links with existing ones set action='merge'
+        To merge links with existing ones set action='merge', or
+        action='upsert' to update links identified by their source, destination,
+        type and reference_name (this is much faster than 'merge').
+        Properties common to all links (e.g. self.reference) can be given once
+        with the reference parameter instead of in each link's props. Leading
+        dictionaries in props that are the same object for all links are also
+        sent only once per batch.
 
         Notice: this method commit changes to neo4j """
 
 
+        create_query = self._links_query(type, action)
+        ref, links = self._split_shared_props(links, reference)
+        links = self._prepare_links(links, action, ref, 'src_id', 'dst_id')
+
         # Create links in batches
-        for i in range(0, len(links), BATCH_SIZE):
-            batch = links[i:i+BATCH_SIZE]
-
-            create_query = f"""WITH $batch AS batch 
-            UNWIND batch AS link 
-                MATCH (x), (y)
-                WHERE ID(x) = link.src_id AND ID(y) = link.dst_id
-                CREATE (x)-[l:{type}]->(y) 
+        self._push_batches(create_query, links, params={'ref': ref})
+
+    @staticmethod
+    def _links_query(type, action, src_kind=None, dst_kind=None, src='link.src_id', dst='link.dst_id'):
+        """Return the query creating (or merging if action='merge' or
+        'upsert') a batch of links. Ends are given by node IDs or constrained properties, see
+        batch_add_links_by_key."""
+
+        if action == 'upsert':
+            # Rows are sorted by source, so the source node of consecutive rows
+            # is found (or merged) only once per batch
+            return f"""WITH $batch AS batch
+            UNWIND batch AS link
+            WITH {src} AS src, collect(link) AS links
+                {IYP._endpoint_clause('x', src_kind, 'src')}
+                WITH x, links
+                UNWIND links AS link
+                {IYP._endpoint_clause('y', dst_kind, dst)}
+                MERGE (x)-[l:{type} {{reference_name: coalesce($ref.reference_name, link.reference_name)}}]->(y)
+                SET l += $ref
                 WITH l, link
-                UNWIND link.props AS prop 
+                UNWIND link.props AS prop
                     SET l += prop """
 
-            if action == 'merge':
-                create_query = f"""WITH $batch AS batch 
-                UNWIND batch AS link 
-                    MATCH (x), (y)
-                    WHERE ID(x) = link.src_id AND ID(y) = link.dst_id
-                    MERGE (x)-[l:{type}]-(y) 
-                    WITH l,  link
-                    UNWIND link.props AS prop 
-                        SET l += prop """
+        if action == 'merge':
+            create = f'MERGE (x)-[l:{type}]-(y)'
+        else:
+            create = f'CREATE (x)-[l:{type}]->(y)'
+
+        return f"""WITH $batch AS batch 
+        UNWIND batch AS link 
+            {IYP._endpoint_clause('x', src_kind, src)}
+            WITH x, link
+            {IYP._endpoint_clause('y', dst_kind, dst)}
+            {create}
+            SET l += $ref
+            WITH l, link
+            UNWIND link.props AS prop 
+                SET l += prop """
+
+    @staticmethod
+    def _split_shared_props(links, reference=None):
+        """Find properties shared by all links, that is reference and leading
+        dictionaries in props that are the same object in all links (usually
+        the crawler's reference). Return the shared properties in a single
+        dictionary and the links with only their own properties."""
+
+        shared = dict(reference) if reference is not None else {}
+        if len(links) == 0:
+            return shared, links
 
+        first = links[0]['props']
+        nb_shared = 0
+        while nb_shared < len(first) and all(
+                len(link['props']) > nb_shared and link['props'][nb_shared] is first[nb_shared]
+                for link in links):
+            nb_shared += 1
 
-            res = self.tx.run(create_query, batch=batch)
-            res.consume()
-            self.commit()
+        if nb_shared == 0:
+            return shared, links
+
+        for prop in first[:nb_shared]:
+            shared.update(prop)
+
+        links = [dict(link, props=link['props'][nb_shared:]) for link in links]
+
+        return shared, links
+
+    @staticmethod
+    def _prepare_links(links, action, ref, src, dst):
+        """Sort links for the given action. For upserts links are sorted by
+        source and the reference_name identifying each link is added to links
+        if it is not a shared property."""
+
+        if action != 'upsert':
+            return IYP._sort_links(links, src, dst)
 
+        if 'reference_name' not in ref:
+            named_links = []
+            for link in links:
+                names = [prop['reference_name'] for prop in link['props'] if 'reference_name' in prop]
+                if len(names) == 0:
+                    raise ValueError('reference_name is required to upsert links')
+                named_links.append(dict(link, reference_name=names[-1]))
+            links = named_links
 
+        return sorted(links, key=lambda link: (link[src], link[dst]))
+
+    @staticmethod
+    def _sort_links(links, src, dst):
+        """Sort links by their end with the less distinct nodes (e.g. Country
+        or Ranking nodes) so that links to the same node are pushed by the same
+        batches, which limits lock contention between concurrent batches."""
+
+        if len(set(link[src] for link in links)) <= len(set(link[dst] for link in links)):
+            key = lambda link: (link[src], link[dst])
+        else:
+            key = lambda link: (link[dst], link[src])
+
+        return sorted(links, key=key)
+
+    def _push_batches(self, query, items, on_records=None, workers=LINK_WORKERS, params=None):
+        """Run the query for consecutive batches of items, each batch in its own
+        transaction. Batches are pushed by a pool of threads, each with its own
+        session. Batches failing with a transient error (e.g. deadlock) are
+        retried by write_batch, batches exceeding memory limits are split in
+        two.
+
+        The batch size is adapted to reach TARGET_COMMIT_TIME for each
+        transaction. If on_records is given it is called with the records
+        returned by each batch. params are additional query parameters sent
+        with every batch."""
+
+        if len(items) == 0:
+            return
+
+        if params is None:
+            params = {}
+
+        # Changes made in the current transaction should be visible to other
+        # sessions
+        self.commit()
+
+        sizer = self.batch_sizers[query]
+        lock = threading.Lock()
+        errors = []
+
+        # Ranges of items to push
+        push_id = None
+        segments = [(0, len(items))]
+        if self.checkpoints is not None and on_records is None:
+            push_id, segments = self.checkpoints.start(
+                    fingerprint(query+repr(params), items), len(items))
+        segment = 0
+        position = 0
+
+        def next_batch():
+            """Return the range of items for the next batch or None."""
+
+            nonlocal segment, position
+            while segment < len(segments):
+                start, end = segments[segment]
+                position = max(position, start)
+                if position < end:
+                    stop = min(position+sizer.size, end)
+                    start, position = position, stop
+                    return start, stop
+                segment += 1
+
+            return None
+
+        def run(tx, batch, tag=None):
+            try:
+                if self.tracer is not None:
+                    records = self.tracer.run(tx, query, dict(params, batch=batch), tag)
+                else:
+                    records = list(tx.run(query, batch=batch, **params))
+            except Neo4jError as error:
+                if error.code in MEMORY_ERRORS:
+                    raise BatchTooLarge(error)
+                raise
+
+            return records
+
+        def push(session, first, last):
+            batch = items[first:last]
+            work = run
+            metadata = None
+            if self.tracer is not None:
+                # Tag the transaction with the batch number
+                tag = f'batch {self.tracer.next_tx()}'
+                metadata = self.tracer.metadata(batch=tag, first_item=first)
+                work = lambda tx, batch: run(tx, batch, tag)
+
+            start = timeit.default_timer()
+            try:
+                records = write_batch(session, work, batch, metadata)
+            except BatchTooLarge:
+                if len(batch) == 1:
+                    raise
+
+                logging.warning(f'IYP: batch of {len(batch)} items is too large, splitting it')
+                sizer.shrink(len(batch))
+                middle = first + len(batch)//2
+                push(session, first, middle)
+                push(session, middle, last)
+                return
+
+            sizer.update(len(batch), timeit.default_timer()-start, payload_size(batch))
+            with lock:
+                self.query_counts[query] += 1
+                if on_records is not None:
+                    on_records(records)
+            metrics.count('transactions')
+            metrics.count('rows', len(batch))
+            if push_id is not None:
+                self.checkpoints.done(push_id, first, last)
+
+        def worker():
+            try:
+                with self.db.session() as session:
+                    while not errors:
+                        with lock:
+                            batch_range = next_batch()
+
+                        if batch_range is None:
+                            return
+
+                        push(session, *batch_range)
+
+            except Exception as error:
+                errors.append(error)
+
+        threads = [threading.Thread(target=worker) for _ in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        if errors:
+            raise errors[0]
+
+    @timed('links')
+    def batch_add_links_by_key(self, type, links, action='create', reference=None):
+        """Create links of the given type in batches without fetching node IDs
+        beforehand. The links parameter is a list of {"src":endpoint,
+        "dst":endpoint, "props":[dict]} where an endpoint is either a node ID or
+        a (label, property, value) tuple, for example ('AS', 'asn', 2497).
+        Endpoints given as tuples are resolved, or created if they don't exist,
+        in the same query using the unique constraints defined in
+        NODE_CONSTRAINTS, hence the property must have a UNIQUE constraint.
+        To merge links with existing ones set action='merge' or 'upsert' (see
+        batch_add_links). Shared properties are handled as in batch_add_links.
+
+        Notice: this method commit changes to neo4j """
+
+        for (src_kind, dst_kind), group in self._group_links_by_key(links).items():
+            create_query = self._links_query(type, action, src_kind, dst_kind, 'link.src', 'link.dst')
+            ref, group = self._split_shared_props(group, reference)
+            group = self._prepare_links(group, action, ref, 'src', 'dst')
+            self._push_batches(create_query, group, params={'ref': ref})
+
+    @staticmethod
+    def _group_links_by_key(links):
+        """The endpoints' label and property are part of the query text, so
+        links given to batch_add_links_by_key are grouped by endpoint kinds."""
+
+        groups = defaultdict(list)
+        for link in links:
+            src_kind, src_val = IYP._link_endpoint(link['src'])
+            dst_kind, dst_val = IYP._link_endpoint(link['dst'])
+            groups[(src_kind, dst_kind)].append(
+                    {'src': src_val, 'dst': dst_val, 'props': link['props']} )
+
+        return groups
+
+    @staticmethod
+    def _link_endpoint(endpoint):
+        """Split a link endpoint into its kind (None for node IDs, otherwise
+        the (label, property) pair) and its formatted value."""
+
+        if isinstance(endpoint, int):
+            return None, endpoint
+
+        label, prop_name, value = endpoint
+        if 'UNIQUE' not in NODE_CONSTRAINTS.get(label, {}).get(prop_name, set()):
+            raise ValueError(f'{label}.{prop_name} has no UNIQUE constraint, use node IDs instead')
+
+        return (label, prop_name), format_value(prop_name, value)
+
+    @staticmethod
+    def _endpoint_clause(var, kind, value):
+        """Cypher clause binding var to the node given by value."""
+
+        if kind is None:
+            return f'MATCH ({var}) WHERE ID({var}) = {value}'
+
+        label, prop_name = kind
+        return f'MERGE ({var}:{label} {{{prop_name}: {value}}})'
+
+    @timed('links')
     def add_links(self, src_node, links):
         """Create links from src_node to the destination nodes given in parameter
         links. This parameter is a list of [link_type, dst_node_id, prop_dict].
@@ -328,11 +1066,10 @@ class IYP(object):
         if len(links) == 0:
             return 
 
-        matches = ' MATCH (x)' 
-        where = f" WHERE ID(x) = {src_node}"
-        merges = ''
-        
-        for i, (type, dst_node, prop) in enumerate(links):
+        # One query per link type and set of property keys, values are
+        # given as parameters
+        groups = defaultdict(list)
+        for (type, dst_node, prop) in links:
 
             assert 'reference_org' in prop
             assert 'reference_url' in prop
@@ -340,17 +1077,29 @@ class IYP(object):
             assert 'reference_time' in prop
 
             prop = format_properties(prop)
+            groups[(type, tuple(sorted(prop.keys())))].append({'dst_id': dst_node, 'prop': prop})
 
-            matches += f", (x{i})"
-            where += f" AND ID(x{i}) = {dst_node}"
-            merges += f" MERGE (x)-[:{type}  {dict2str(prop)}]->(x{i}) "
-
-        self.tx.run( matches+where+merges).consume()
+        metrics.count('rows', len(links))
+        for (type, keys), group in groups.items():
+            self._run(f"""MATCH (x) WHERE ID(x) = $src_id
+                UNWIND $links AS link
+                MATCH (y) WHERE ID(y) = link.dst_id
+                MERGE (x)-[:{type} {params2str(keys, 'link.prop')}]->(y)""",
+                src_id=src_node, links=group).consume()
 
 
     def close(self):
         """Commit pending queries and close IYP"""
+
+        nb_queries, nb_distinct, hit_rate = self.plan_cache_stats()
+        logging.info(f'IYP: {nb_queries} queries, {nb_distinct} distinct, '
+                     f'plan cache hit rate {hit_rate:.1%}')
+
         self.tx.commit()
+        if self.checkpoints is not None:
+            self.checkpoints.clear()
+        if self.tracer is not None:
+            self.tracer.report()
         self.session.close()
         self.db.close()
 
@@ -375,6 +1124,10 @@ class BasePostProcess(object):
 
 
 class BaseCrawler(object):
+    # fetch() only downloads data and can be called before any crawler runs
+    # (see iyp.scheduler.prefetch)
+    prefetch = True
+
     def __init__(self, organization, url, name):
         """IYP and references initialization. The crawler name should be unique."""
 
@@ -389,8 +1142,59 @@ class BaseCrawler(object):
             'reference_time': datetime.combine(datetime.utcnow(), time.min, timezone.utc)
             }
 
-        # connection to IYP database
-        self.iyp = IYP()
+        # connection to IYP database and buffered get_node/add_links (see
+        # LinkBuffer), both opened on first use so that fetch() runs without
+        # database
+        self._iyp = None
+        self._buffer = None
+
+        # properties of the Dataset node written on close, see skip_unchanged
+        self.dataset = None
+
+    @property
+    def iyp(self):
+        if self._iyp is None:
+            self._iyp = self.connect()
+
+        return self._iyp
+
+    @property
+    def sync_iyp(self):
+        """Synchronous client used by the buffer and the Dataset marker."""
+
+        return self.iyp
+
+    @property
+    def buffer(self):
+        if self._buffer is None:
+            from iyp.buffer import LinkBuffer
+            self._buffer = LinkBuffer(self.sync_iyp)
+
+        return self._buffer
+
+    def connect(self):
+        """Return the IYP client used by this crawler. This is a connection to
+        the neo4j database, or staging files for neo4j-admin import if the
+        IYP_STAGING_DIR environment variable is set, or spool files loaded
+        later into neo4j (see iyp.spool) if IYP_SPOOL_DIR is set. With
+        IYP_BACKEND=memory the graph is kept in memory (see iyp.memory), e.g.
+        to profile crawlers without a database."""
+
+        staging_dir = os.environ.get('IYP_STAGING_DIR')
+        if staging_dir:
+            from iyp.staging import StagingIYP
+            return StagingIYP(staging_dir, self.name)
+
+        spool_dir = os.environ.get('IYP_SPOOL_DIR')
+        if spool_dir:
+            from iyp.spool import SpoolIYP
+            return SpoolIYP(spool_dir, self.name)
+
+        if os.environ.get('IYP_BACKEND') == 'memory':
+            from iyp.memory import MemoryIYP
+            return MemoryIYP(self.name)
+
+        return IYP(self.name)
 
     def create_tmp_dir(self, root='./tmp/'):
         """Create a temporary directory for this crawler. If the directory 
@@ -419,13 +1223,63 @@ class BaseCrawler(object):
         return  f'{root}/{self.name}/'
 
     def fetch(self):
-        """Large datasets may be pre-fetched using this method. Currently the 
-        BaseCrawler does nothing for this method. Note that all crawlers may
-        fetch data at the same time, hence it may cause API rate limiting issues."""
+        """Download data with fetch_url so that run() reads only local files.
+        create_db.py calls fetch() for all crawlers concurrently before running
+        them, requests to the same host are limited by iyp.download. The
+        BaseCrawler does nothing for this method."""
 
         pass
-    
+
+    def fetch_url(self, url, fname=None, **kwargs):
+        """Download url to the temporary directory of this crawler and return
+        the local path. Files go through the download cache (see
+        iyp.download), they are not downloaded again if they were fetched
+        recently (e.g. by fetch()) or have not changed. Other parameters are
+        passed to iyp.download.fetch_url."""
+
+        from iyp.download import fetch_url
+
+        if fname is None:
+            fname = urlparse(url).path.rpartition('/')[2]
+
+        return fetch_url(url, self.get_tmp_dir()+fname, **kwargs)
+
+    def skip_unchanged(self, fingerprint):
+        """Return True if the input of the crawler (e.g. the digest of the
+        downloaded file or the upstream timestamp) has the same fingerprint
+        as when the crawler last wrote its data to IYP, in which case the
+        crawler does not need to process it again.
+
+        The fingerprint is stored with set_dataset() when the crawler is
+        closed: in the Dataset node of the database, or in the state file of
+        the spool. When spooling, the previous spool of a skipped crawler is
+        reused (see SpoolIYP.reuse_dataset). Crawlers writing staging files
+        never skip their input, as they build a new database. Likewise, a
+        build in a new, empty database (the default in create_db.py) has no
+        Dataset node, inputs are skipped only in spool or incremental builds
+        or when crawlers run again on the same database."""
+
+        dataset = self.sync_iyp.get_dataset(self.name)
+        self.dataset = {
+                'name': self.name,
+                'last_checked': datetime.now(timezone.utc)
+                }
+
+        if dataset is not None and dataset.get('fingerprint') == fingerprint:
+            logging.warning(f'{self.name}: input unchanged since {dataset.get("reference_time")}, skipping')
+            self.sync_iyp.reuse_dataset(self.name)
+            self.dataset.update(fingerprint=fingerprint, reference_time=dataset.get('reference_time'))
+            return True
+
+        self.dataset.update(fingerprint=fingerprint, reference_time=self.reference['reference_time'])
+        return False
+
     def close(self):
         # Commit changes to IYP
-        self.iyp.close()
+        if self._buffer is not None:
+            self._buffer.flush()
+        if self.dataset is not None:
+            self.sync_iyp.set_dataset(self.dataset)
+        if self._iyp is not None:
+            self._iyp.close()
 
@@ -0,0 +1,469 @@
+import asyncio
+import logging
+import os
+import timeit
+from collections import defaultdict
+from neo4j import AsyncGraphDatabase, GraphDatabase
+from neo4j.exceptions import ConstraintError, DriverError, Neo4jError
+from iyp import (IYP, BaseCrawler, BatchSizer, BatchTooLarge, FETCH_SIZE,
+                 LINK_WORKERS, MEMORY_ERRORS, RETRY_TIME, db_identity, init_schema, payload_size)
+from iyp.checkpoints import Checkpoints, fingerprint
+from iyp.metrics import metrics, timed
+from iyp.nodeids import NodeIDMap
+from iyp.trace import Tracer
+
+
+async def write_batch(session, work, batch, metadata=None):
+    """Same as iyp.write_batch for async sessions."""
+
+    deadline = timeit.default_timer() + RETRY_TIME
+    delay = 1
+    while True:
+        tx = await session.begin_transaction(metadata=metadata)
+        try:
+            records = await work(tx, batch)
+            await tx.commit()
+            return records
+
+        except Neo4jError as error:
+            if error.code in MEMORY_ERRORS:
+                raise BatchTooLarge(error)
+            if not error.is_retryable() or timeit.default_timer() + delay > deadline:
+                raise
+            logging.warning(f'AsyncIYP: transaction failed ({error.code}), retrying in {delay}s')
+
+        except DriverError as error:
+            if not error.is_retryable() or timeit.default_timer() + delay > deadline:
+                raise
+            logging.warning(f'AsyncIYP: transaction failed ({error}), retrying in {delay}s')
+
+        finally:
+            if not tx.closed():
+                await tx.close()
+
+        await asyncio.sleep(delay)
+        delay *= 2
+
+
+class AsyncIYP(object):
+    """Asyncio counterpart of IYP built on the async neo4j driver. Methods
+    querying the database are coroutines. The connection is opened by the first
+    query, hence an AsyncIYP object can be created outside of the event
+    loop.
+
+    name is the name of the crawler using this client, if given link pushes
+    are checkpointed as with IYP. Statements are traced if IYP_TRACE is
+    set (see Tracer)."""
+
+    def __init__(self, name=None):
+
+        logging.debug('AsyncIYP: Enter initialization')
+        self.name = name
+        self.neo4j_enterprise = False
+
+        # TODO: get config from configuration file
+        self.server = 'localhost'
+        self.port = 7687
+        self.login = "neo4j"
+        self.password = "password"
+
+        # batch size for each query
+        self.batch_sizers = defaultdict(BatchSizer)
+
+        self.db = None
+        self.session = None
+        self.tx = None
+
+        # Statements statistics, see Tracer
+        self.tracer = None
+        if os.environ.get('IYP_TRACE'):
+            self.tracer = Tracer(name)
+
+        # Committed link batches, set once connected
+        self.checkpoints = None
+
+    async def _begin(self):
+        """Connect to the database if needed and return the current
+        transaction."""
+
+        if self.db is None:
+            uri = f"neo4j://{self.server}:{self.port}"
+            self.db = AsyncGraphDatabase.driver(uri, auth=(self.login, self.password))
+            self.session = self.db.session(fetch_size=FETCH_SIZE)
+
+            # Duplicates are merged with a synchronous session, see
+            # init_schema
+            def init():
+                with GraphDatabase.driver(uri, auth=(self.login, self.password)) as db:
+                    with db.session() as session:
+                        init_schema(session, self.neo4j_enterprise)
+                        return db_identity(session)
+
+            db_id = await asyncio.to_thread(init)
+            if self.name is not None:
+                self.checkpoints = Checkpoints(self.name, db_id)
+
+        if self.tx is None:
+            metadata = None
+            if self.tracer is not None:
+                self.tx_number = self.tracer.next_tx()
+                metadata = self.tracer.metadata(tx=self.tx_number)
+            self.tx = await self.session.begin_transaction(metadata=metadata)
+
+        return self.tx
+
+    async def _run(self, query, **params):
+        """Run a parameterized query in the current transaction and return
+        its records."""
+
+        tx = await self._begin()
+        if self.tracer is None:
+            return [ record async for record in await tx.run(query, **params) ]
+
+        return await self._traced_run(tx, query, params, f'tx {self.tx_number}')
+
+    async def _traced_run(self, tx, query, params, tag):
+        """Same as Tracer.run for async transactions, statements are not
+        profiled."""
+
+        start = timeit.default_timer()
+        records = [ record async for record in await tx.run(query, **params) ]
+        self.tracer.record(query, params, len(records), timeit.default_timer()-start, tag=tag)
+
+        return records
+
+    async def commit(self):
+        """Commit all pending queries (node/link creation)."""
+
+        if self.tx is not None:
+            await self.tx.commit()
+            self.tx = None
+            metrics.count('transactions')
+
+    async def rollback(self):
+        """Rollback all pending queries (node/link creation)."""
+
+        if self.tx is not None:
+            await self.tx.rollback()
+            self.tx = None
+
+    @timed('nodes')
+    async def batch_get_nodes(self, type, prop_name, prop_set=set(), all=True, upsert=False):
+        """Same as IYP.batch_get_nodes."""
+
+        if upsert:
+            ids = NodeIDMap()
+            def add_ids(nodes):
+                for node in nodes:
+                    ids.append(node[prop_name], node['_id'])
+
+            await self._push_batches(IYP._upsert_query(type, prop_name),
+                                     IYP._sorted_values(prop_set), add_ids)
+            ids.finish()
+
+            return ids
+
+        match_query, create_query = IYP._nodes_queries(type, prop_name, all)
+        existing_nodes = await self._run(match_query, list_prop=list(prop_set))
+
+        ids = NodeIDMap()
+        for node in existing_nodes:
+            ids.append(node[prop_name], node['_id'])
+        ids.finish()
+
+        missing_props = [val for val in prop_set if val not in ids]
+        missing_nodes = [{prop_name: val} for val in missing_props]
+
+        # Create missing nodes
+        def add_ids(new_nodes):
+            for node in new_nodes:
+                ids[node[prop_name]] = node['_id']
+
+        await self._push_batches(create_query, missing_nodes, add_ids)
+
+        return ids
+
+    @timed('nodes')
+    async def get_node(self, type, prop, create=False):
+        """Same as IYP.get_node, nodes are merged in their own transaction."""
+
+        query, fallback_query, params = IYP._get_node_queries(type, prop, create)
+
+        try:
+            if not create:
+                records = await self._run(query, **params)
+            else:
+                # Locks held by the current transaction would block the merge
+                await self._begin()
+                await self.commit()
+
+                async def work(tx, _):
+                    return [ record async for record in await tx.run(query, **params) ]
+                async with self.db.session() as session:
+                    records = await write_batch(session, work, None)
+        except ConstraintError:
+            logging.error(f'cannot merge {prop}')
+            records = await self._run(fallback_query, **params)
+
+        if len(records):
+            return records[0][0]
+        else:
+            return None
+
+    @timed('nodes')
+    async def batch_get_node_extid(self, id_type):
+        """Same as IYP.batch_get_node_extid."""
+
+        result = await self._run(f"MATCH (a)-[:EXTERNAL_ID]->(i:{id_type}) RETURN i.id AS extid, ID(a) AS nodeid")
+
+        ids = {}
+        for node in result:
+            ids[node['extid']] = node['nodeid']
+
+        return ids
+
+    @timed('links')
+    async def batch_add_links(self, type, links, action='create', reference=None):
+        """Same as IYP.batch_add_links."""
+
+        create_query = IYP._links_query(type, action)
+        ref, links = IYP._split_shared_props(links, reference)
+        links = IYP._prepare_links(links, action, ref, 'src_id', 'dst_id')
+        await self._push_batches(create_query, links, params={'ref': ref})
+
+    @timed('links')
+    async def batch_add_links_by_key(self, type, links, action='create', reference=None):
+        """Same as IYP.batch_add_links_by_key."""
+
+        for (src_kind, dst_kind), group in IYP._group_links_by_key(links).items():
+            create_query = IYP._links_query(type, action, src_kind, dst_kind, 'link.src', 'link.dst')
+            ref, group = IYP._split_shared_props(group, reference)
+            group = IYP._prepare_links(group, action, ref, 'src', 'dst')
+            await self._push_batches(create_query, group, params={'ref': ref})
+
+    async def _push_batches(self, query, items, on_records=None, workers=LINK_WORKERS, params=None):
+        """Same as IYP._push_batches with concurrent tasks instead of
+        threads. If a task fails the other tasks are cancelled."""
+
+        if len(items) == 0:
+            return
+
+        if params is None:
+            params = {}
+
+        # Changes made in the current transaction should be visible to other
+        # sessions
+        await self._begin()
+        await self.commit()
+
+        sizer = self.batch_sizers[query]
+
+        # Ranges of items to push
+        push_id = None
+        segments = [(0, len(items))]
+        if self.checkpoints is not None and on_records is None:
+            push_id, segments = self.checkpoints.start(
+                    fingerprint(query+repr(params), items), len(items))
+        segment = 0
+        position = 0
+
+        def next_batch():
+            """Return the range of items for the next batch or None."""
+
+            nonlocal segment, position
+            while segment < len(segments):
+                start, end = segments[segment]
+                position = max(position, start)
+                if position < end:
+                    stop = min(position+sizer.size, end)
+                    start, position = position, stop
+                    return start, stop
+                segment += 1
+
+            return None
+
+        async def run(tx, batch, tag=None):
+            try:
+                if self.tracer is not None:
+                    records = await self._traced_run(tx, query, dict(params, batch=batch), tag)
+                else:
+                    result = await tx.run(query, batch=batch, **params)
+                    records = [record async for record in result]
+            except Neo4jError as error:
+                if error.code in MEMORY_ERRORS:
+                    raise BatchTooLarge(error)
+                raise
+
+            return records
+
+        async def push(session, first, last):
+            batch = items[first:last]
+            work = run
+            metadata = None
+            if self.tracer is not None:
+                # Tag the transaction with the batch number
+                tag = f'batch {self.tracer.next_tx()}'
+                metadata = self.tracer.metadata(batch=tag, first_item=first)
+                work = lambda tx, batch: run(tx, batch, tag)
+
+            start = timeit.default_timer()
+            try:
+                records = await write_batch(session, work, batch, metadata)
+            except BatchTooLarge:
+                if len(batch) == 1:
+                    raise
+
+                logging.warning(f'AsyncIYP: batch of {len(batch)} items is too large, splitting it')
+                sizer.shrink(len(batch))
+                middle = first + len(batch)//2
+                await push(session, first, middle)
+                await push(session, middle, last)
+                return
+
+            sizer.update(len(batch), timeit.default_timer()-start, payload_size(batch))
+            metrics.count('transactions')
+            metrics.count('rows', len(batch))
+            if on_records is not None:
+                on_records(records)
+            if push_id is not None:
+                self.checkpoints.done(push_id, first, last)
+
+        async def worker():
+            async with self.db.session() as session:
+                while True:
+                    batch_range = next_batch()
+                    if batch_range is None:
+                        return
+
+                    await push(session, *batch_range)
+
+        tasks = [ asyncio.ensure_future(worker()) for _ in range(workers) ]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            # Stop the other workers before raising, their sessions are
+            # closed as they are cancelled
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+    async def close(self):
+        """Commit pending queries and close IYP"""
+
+        if self.db is None:
+            return
+
+        await self.commit()
+        if self.checkpoints is not None:
+            self.checkpoints.clear()
+        if self.tracer is not None:
+            self.tracer.report()
+        await self.disconnect()
+
+    async def disconnect(self):
+        """Close the connection without committing pending queries, e.g. when
+        the crawler failed. Checkpoints are kept to resume the crawler."""
+
+        if self.db is None:
+            return
+
+        if self.tx is not None:
+            await self.tx.close()
+            self.tx = None
+        await self.session.close()
+        await self.db.close()
+        self.db = None
+
+
+class AsyncWrapper(object):
+    """Expose the methods of a synchronous IYP client (e.g. StagingIYP) as
+    coroutines."""
+
+    def __init__(self, iyp):
+        self.iyp = iyp
+
+    def __getattr__(self, name):
+        method = getattr(self.iyp, name)
+
+        async def wrapper(*args, **kwargs):
+            return method(*args, **kwargs)
+
+        return wrapper
+
+
+class AsyncBaseCrawler(BaseCrawler):
+    """BaseCrawler for crawlers written with asyncio. Crawlers implement the
+    coroutine arun() instead of run() and self.iyp is an AsyncIYP, so that
+    downloads can overlap with writes to the database (see background()).
+    run() and close() can be called as for any other crawler."""
+
+    def __init__(self, organization, url, name):
+        super().__init__(organization, url, name)
+
+        # synchronous client, see sync_iyp
+        self._sync_iyp = None
+
+    def connect(self):
+        """Return an AsyncIYP client, or the client given by
+        BaseCrawler.connect() wrapped in AsyncWrapper in staging, spool or
+        memory mode."""
+
+        if (os.environ.get('IYP_STAGING_DIR') or os.environ.get('IYP_SPOOL_DIR')
+                or os.environ.get('IYP_BACKEND') == 'memory'):
+            self._sync_iyp = super().connect()
+            return AsyncWrapper(self._sync_iyp)
+
+        # The crawler name is used by sync_iyp for its own checkpoints and
+        # trace report
+        return AsyncIYP(f'{self.name}-async')
+
+    @property
+    def sync_iyp(self):
+        """Synchronous client used by the buffer and the Dataset marker: the
+        client wrapped by self.iyp, or a separate connection to IYP."""
+
+        if self._sync_iyp is None and not isinstance(self.iyp, AsyncWrapper):
+            self._sync_iyp = IYP(self.name)
+
+        return self._sync_iyp
+
+    def background(self, func, *args):
+        """Start running the blocking function func (e.g. a download) in a
+        thread and return a task giving its result."""
+
+        return asyncio.ensure_future(asyncio.to_thread(func, *args))
+
+    async def arun(self):
+        """Fetch data and push to IYP."""
+
+        raise NotImplementedError()
+
+    def run(self):
+        """Run arun() in a new event loop, the AsyncIYP connection is closed
+        at the end of the loop. If arun() fails pending queries are discarded
+        and checkpoints are kept. Wrapped clients are closed by close()."""
+
+        async def main():
+            try:
+                await self.arun()
+            except BaseException:
+                if isinstance(self._iyp, AsyncIYP):
+                    await self._iyp.disconnect()
+                raise
+
+            if isinstance(self._iyp, AsyncIYP):
+                await self._iyp.close()
+
+        asyncio.run(main())
+
+    def close(self):
+        """Same as BaseCrawler.close with the synchronous client, changes made
+        with AsyncIYP are committed at the end of run()."""
+
+        if self._buffer is not None:
+            self._buffer.flush()
+        if self.dataset is not None:
+            self.sync_iyp.set_dataset(self.dataset)
+        if self._sync_iyp is not None:
+            self._sync_iyp.close()
@@ -0,0 +1,292 @@
+import argparse
+import json
+import logging
+import os
+import random
+import subprocess
+import sys
+import timeit
+from datetime import datetime, timezone
+from time import sleep
+import docker
+from neo4j import GraphDatabase
+from iyp import IYP
+from iyp.cache import set_node_cache
+from iyp.memory import MemoryIYP
+from iyp.trace import Tracer
+
+NEO4J_VERSION = '5.1.0'
+CONTAINER_NAME = 'iyp-bench'
+
+# Default number of links generated
+SCALES = [10000, 100000]
+
+# Number of calls for primitives adding one node or link per call
+MAX_SINGLE_CALLS = 2000
+
+# Skew of the degree distribution of hub nodes (Country, Ranking)
+ZIPF_EXPONENT = 1.2
+
+REFERENCE = {
+        'reference_name': 'bench',
+        'reference_org': 'IYP',
+        'reference_url': 'https://example.com/bench',
+        'reference_time': datetime.combine(datetime.now(timezone.utc), datetime.min.time(), timezone.utc)
+        }
+
+
+def skewed(rnd, population, k):
+    """Draw k elements of population with a Zipf-like distribution (the
+    first elements are the most popular)."""
+
+    weights = [1/(rank+1)**ZIPF_EXPONENT for rank in range(len(population))]
+
+    return rnd.choices(population, weights=weights, k=k)
+
+
+def generate(scale, seed=0):
+    """Generate a synthetic dataset with about scale links between AS,
+    Prefix, IP, DomainName, Country and Ranking nodes. Links to Country and
+    Ranking nodes follow a skewed degree distribution."""
+
+    rnd = random.Random(seed)
+
+    nb_as = max(scale // 10, 10)
+    nb_prefix = max(scale // 5, 10)
+    nb_domain = max(scale // 5, 10)
+
+    asns = rnd.sample(range(1, 2**32), nb_as)
+    prefixes = [f'{i >> 16}.{(i >> 8) & 255}.{i & 255}.0/24' for i in rnd.sample(range(1, 2**24), nb_prefix)]
+    ips = [prefix.replace('.0/24', f'.{rnd.randint(1, 254)}') for prefix in prefixes]
+    domains = [f'domain{i}.example' for i in range(nb_domain)]
+    countries = [f'{chr(65+i//26)}{chr(65+i%26)}' for i in range(250)]
+    rankings = [f'Ranking {i}' for i in range(10)]
+
+    # Share of links of each type
+    nb_links = {
+            'ORIGINATE': scale * 3 // 10,
+            'COUNTRY': scale // 10,
+            'RANK': scale * 3 // 10,
+            'RESOLVES_TO': scale // 10,
+            'PART_OF': scale // 5,
+            }
+
+    links = {
+            'ORIGINATE': list(zip(rnd.choices(asns, k=nb_links['ORIGINATE']), rnd.choices(prefixes, k=nb_links['ORIGINATE']))),
+            'COUNTRY': list(zip(rnd.choices(asns, k=nb_links['COUNTRY']), skewed(rnd, countries, nb_links['COUNTRY']))),
+            'RANK': list(zip(rnd.choices(domains, k=nb_links['RANK']), skewed(rnd, rankings, nb_links['RANK']))),
+            'RESOLVES_TO': list(zip(rnd.choices(domains, k=nb_links['RESOLVES_TO']), rnd.choices(ips, k=nb_links['RESOLVES_TO']))),
+            'PART_OF': list(zip(rnd.choices(ips, k=nb_links['PART_OF']), rnd.choices(prefixes, k=nb_links['PART_OF']))),
+            }
+
+    nodes = {
+            ('AS', 'asn'): asns,
+            ('Prefix', 'prefix'): prefixes,
+            ('IP', 'ip'): ips,
+            ('DomainName', 'name'): domains,
+            ('Country', 'country_code'): countries,
+            ('Ranking', 'name'): rankings,
+            }
+
+    return nodes, links
+
+
+# Labels of link ends
+LINK_ENDS = {
+        'ORIGINATE': (('AS', 'asn'), ('Prefix', 'prefix')),
+        'COUNTRY': (('AS', 'asn'), ('Country', 'country_code')),
+        'RANK': (('DomainName', 'name'), ('Ranking', 'name')),
+        'RESOLVES_TO': (('DomainName', 'name'), ('IP', 'ip')),
+        'PART_OF': (('IP', 'ip'), ('Prefix', 'prefix')),
+        }
+
+
+def percentiles(times):
+    """Latency percentiles in milliseconds."""
+
+    if len(times) == 0:
+        return {}
+
+    times = sorted(times)
+    return { f'p{p}': 1000*times[min(int(len(times)*p/100), len(times)-1)] for p in [50, 90, 99] } | {'max': 1000*times[-1]}
+
+
+def heap_usage(iyp):
+    """Heap used by the neo4j server in bytes."""
+
+    try:
+        result = iyp.session.run("CALL dbms.queryJmx('java.lang:type=Memory') YIELD attributes "
+                                 "RETURN attributes.HeapMemoryUsage AS heap").single()
+        return result['heap']['value']['properties']['used']
+    except Exception as error:
+        logging.error(f'Bench: cannot get heap usage: {error}')
+        return None
+
+
+def measure(name, nb_items, func, backend=IYP):
+    """Run func with a new client of the given backend (traced if it is IYP)
+    and return its results."""
+
+    iyp = backend()
+    times = []
+    if isinstance(iyp, IYP):
+        # Trace the statements of a new transaction
+        iyp.tx.rollback()
+        iyp.tracer = Tracer('bench', keep_times=True)
+        iyp.tx = iyp._begin()
+        times = iyp.tracer.times
+
+    start = timeit.default_timer()
+    func(iyp)
+    iyp.commit()
+    elapsed = timeit.default_timer() - start
+
+    result = {
+            'primitive': name,
+            'items': nb_items,
+            'time': elapsed,
+            'throughput': nb_items / elapsed if elapsed else None,
+            'statements': len(times),
+            'latency_ms': percentiles(times),
+            'heap_used': heap_usage(iyp) if isinstance(iyp, IYP) else None,
+            }
+    iyp.close()
+
+    logging.warning(f'Bench: {name}: {nb_items} items in {elapsed:.2f}s')
+
+    return result
+
+
+def run(scale, seed=0, backend=IYP):
+    """Benchmark IYP write primitives on a synthetic dataset and return the
+    results."""
+
+    # Keep the graph between measures with the in-memory backend
+    if backend is MemoryIYP:
+        graph = MemoryIYP('bench')
+        backend = lambda: graph
+
+    nodes, links = generate(scale, seed)
+    results = []
+    ids = {}
+
+    # Nodes, one at a time then in batches
+    domains = nodes[('DomainName', 'name')][:MAX_SINGLE_CALLS]
+    results.append(measure('get_node', len(domains), lambda iyp: [
+        iyp.get_node('DomainName', {'name': domain}, create=True) for domain in domains ], backend))
+
+    def get_nodes(iyp, upsert):
+        for (label, prop), values in nodes.items():
+            ids[label] = iyp.batch_get_nodes(label, prop, set(values), all=False, upsert=upsert)
+
+    nb_nodes = sum(len(values) for values in nodes.values())
+    results.append(measure('batch_get_nodes', nb_nodes, lambda iyp: get_nodes(iyp, False), backend))
+    results.append(measure('batch_get_nodes_upsert', nb_nodes, lambda iyp: get_nodes(iyp, True), backend))
+
+    # Links by node IDs
+    def add_links(iyp, type, pairs, action):
+        (src_label, _), (dst_label, _) = LINK_ENDS[type]
+        iyp.batch_add_links(type, [
+            {'src_id': ids[src_label][src], 'dst_id': ids[dst_label][dst], 'props': [REFERENCE]}
+            for src, dst in pairs ], action=action)
+
+    for type, pairs in links.items():
+        results.append(measure(f'batch_add_links {type}', len(pairs), lambda iyp: add_links(iyp, type, pairs, 'create'), backend))
+    results.append(measure('batch_add_links upsert RANK', len(links['RANK']),
+                           lambda iyp: add_links(iyp, 'RANK', links['RANK'], 'upsert'), backend))
+
+    # Links by node keys
+    for type in ['ORIGINATE', 'COUNTRY']:
+        (src_label, src_prop), (dst_label, dst_prop) = LINK_ENDS[type]
+        by_key = [
+                {'src': (src_label, src_prop, src), 'dst': (dst_label, dst_prop, dst), 'props': [REFERENCE]}
+                for src, dst in links[type] ]
+        results.append(measure(f'batch_add_links_by_key {type}', len(by_key),
+                               lambda iyp: iyp.batch_add_links_by_key(f'{type}_BY_KEY', by_key), backend))
+
+    # Links one at a time
+    pairs = links['COUNTRY'][:MAX_SINGLE_CALLS]
+    results.append(measure('add_links', len(pairs), lambda iyp: [
+        iyp.add_links(ids['AS'][asn], [['COUNTRY_SINGLE', ids['Country'][cc], REFERENCE]])
+        for asn, cc in pairs ], backend))
+
+    return results
+
+
+def start_container(client):
+    """Start a throwaway neo4j container and wait until it accepts
+    connections."""
+
+    logging.warning('Bench: starting neo4j container...')
+    container = client.containers.run(
+            'neo4j:'+NEO4J_VERSION,
+            name=CONTAINER_NAME,
+            ports={7474: 7474, 7687: 7687},
+            environment={'NEO4J_AUTH': 'neo4j/password'},
+            remove=True,
+            detach=True
+            )
+
+    driver = GraphDatabase.driver('neo4j://localhost:7687', auth=('neo4j', 'password'))
+    for _ in range(60):
+        try:
+            driver.verify_connectivity()
+            break
+        except Exception:
+            sleep(2)
+    driver.close()
+
+    return container
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], text=True).strip()
+    except Exception:
+        return None
+
+
+# Run benchmarks and write results to a JSON file
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description='Benchmark IYP write primitives on synthetic data.')
+    parser.add_argument('--scale', type=int, action='append', help='number of links (repeat for several scales)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='./tmp/bench/', help='directory for JSON results')
+    parser.add_argument('--memory', action='store_true',
+                        help='use the in-memory backend (iyp.memory) instead of neo4j')
+    parser.add_argument('--no-container', action='store_true',
+                        help='use the database running on localhost instead of a throwaway container')
+    args = parser.parse_args()
+
+    FORMAT = '%(asctime)s %(processName)s %(message)s'
+    logging.basicConfig(format=FORMAT, level=logging.WARNING, datefmt='%Y-%m-%d %H:%M:%S')
+
+    # Measure the cost of queries, not of the node cache
+    set_node_cache(None)
+
+    output = {
+            'date': datetime.now(timezone.utc).isoformat(),
+            'revision': git_revision(),
+            'backend': 'memory' if args.memory else 'neo4j',
+            'neo4j': None if args.memory else NEO4J_VERSION,
+            'seed': args.seed,
+            'runs': [],
+            }
+
+    for scale in args.scale or SCALES:
+        container = None
+        if not args.memory and not args.no_container:
+            container = start_container(docker.from_env())
+        try:
+            output['runs'].append({'scale': scale, 'results': run(scale, args.seed, MemoryIYP if args.memory else IYP)})
+        finally:
+            if container is not None:
+                container.stop()
+
+    os.makedirs(args.output, exist_ok=True)
+    fname = os.path.join(args.output, f"bench-{output['date'][:19].replace(':', '')}.json")
+    with open(fname, 'w') as fp:
+        json.dump(output, fp, indent=4)
+
+    print(f'Results written to {fname}', file=sys.stderr)
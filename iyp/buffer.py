@@ -0,0 +1,140 @@
+import logging
+import timeit
+from collections import defaultdict
+from iyp import NODE_CONSTRAINTS, format_properties
+
+# Number of buffered links triggering a flush
+BUFFER_SIZE = 50000
+
+# Maximum time (in seconds) links are kept in the buffer
+BUFFER_TIME = 60
+
+
+class NodeHandle(object):
+    """Placeholder for a node that is not resolved yet. The node ID is set
+    when the buffer is flushed."""
+
+    __slots__ = ['id']
+
+    def __init__(self):
+        self.id = None
+
+
+class LinkBuffer(object):
+    """Buffer for crawlers adding nodes and links one at a time with get_node
+    and add_links. Calls are the same as IYP's but nodes are resolved in bulk
+    and links are pushed with batch_add_links when the buffer holds
+    BUFFER_SIZE links, after BUFFER_TIME seconds, or when flush() is called
+    (BaseCrawler.close() flushes the buffer).
+
+    get_node returns a NodeHandle for nodes identified by a property with a
+    UNIQUE constraint (e.g. AS, Country, DomainName), these handles can only be
+    given to add_links. Other nodes are resolved immediately.
+
+    Links are created, as upserting them on their reference_name (or merging
+    them on their type) would collapse parallel links with different
+    properties. Like IYP.add_links, which merges links on all their
+    properties, identical links are pushed only once, also across flushes."""
+
+    def __init__(self, iyp, action='create'):
+        self.iyp = iyp
+        self.action = action
+        # keys of links already pushed
+        self.pushed = set()
+
+        # (label, property) -> value -> NodeHandle
+        self.handles = defaultdict(dict)
+        # nodes resolved immediately
+        self.nodes = {}
+
+        self.links = defaultdict(dict)
+        self.nb_links = 0
+        self.last_flush = timeit.default_timer()
+
+    def get_node(self, type, prop, create=False):
+        """Same as IYP.get_node, but nodes created are resolved on flush."""
+
+        prop = format_properties(prop)
+
+        if create and isinstance(type, str) and len(prop) == 1:
+            prop_name, value = next(iter(prop.items()))
+            if 'UNIQUE' in NODE_CONSTRAINTS.get(type, {}).get(prop_name, set()):
+                handle = self.handles[(type, prop_name)].get(value)
+                if handle is None:
+                    handle = NodeHandle()
+                    self.handles[(type, prop_name)][value] = handle
+
+                return handle
+
+        if not create:
+            return self.iyp.get_node(type, prop, create)
+
+        key = (str(type), repr(sorted(prop.items())))
+        if key not in self.nodes:
+            self.nodes[key] = self.iyp.get_node(type, prop, create)
+
+        return self.nodes[key]
+
+    def add_links(self, src_node, links):
+        """Same as IYP.add_links, nodes can be given as handles. Identical
+        links are added only once."""
+
+        for (type, dst_node, prop) in links:
+
+            assert 'reference_org' in prop
+            assert 'reference_url' in prop
+            assert 'reference_name' in prop
+            assert 'reference_time' in prop
+
+            key = (src_node, dst_node, repr(sorted(prop.items())))
+            if key not in self.links[type] and (type, key) not in self.pushed:
+                self.links[type][key] = prop
+                self.nb_links += 1
+
+        if (self.nb_links >= BUFFER_SIZE
+                or timeit.default_timer() - self.last_flush > BUFFER_TIME):
+            self.flush()
+
+    def _resolve(self):
+        """Find or create all nodes referenced by unresolved handles."""
+
+        for (type, prop_name), handles in self.handles.items():
+            missing = [value for value, handle in handles.items() if handle.id is None]
+            if len(missing) == 0:
+                continue
+
+            ids = self.iyp.batch_get_nodes(type, prop_name, missing, upsert=True)
+            for value in missing:
+                handles[value].id = ids[value]
+
+    @staticmethod
+    def _node_id(node):
+        if isinstance(node, NodeHandle):
+            return node.id
+
+        return node
+
+    def flush(self):
+        """Resolve nodes and push all buffered links."""
+
+        self.last_flush = timeit.default_timer()
+        if self.nb_links == 0:
+            return
+
+        logging.info(f'LinkBuffer: pushing {self.nb_links} links')
+        self._resolve()
+
+        for type, links in self.links.items():
+            self.iyp.batch_add_links(type, [
+                {
+                    'src_id': self._node_id(src_node),
+                    'dst_id': self._node_id(dst_node),
+                    'props': [prop]
+                }
+                for (src_node, dst_node, _), prop in links.items() ],
+                action=self.action
+                )
+            self.pushed.update( (type, key) for key in links )
+
+        self.links = defaultdict(dict)
+        self.nb_links = 0
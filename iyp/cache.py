@@ -0,0 +1,193 @@
+import fcntl
+import logging
+import os
+import sqlite3
+from contextlib import contextmanager
+from iyp.nodeids import NodeIDMap
+
+# Version of the sqlite schema, files with another version are emptied
+SCHEMA_VERSION = 2
+
+
+class MemoryNodeCache(object):
+    """Cache of node IDs shared by all IYP clients of the process. Node IDs
+    are cached by (label, property) together with the largest node ID seen
+    and the number of nodes seen, hence nodes added afterwards (by any
+    client) can be fetched with 'WHERE ID(n) > max_id'. Node IDs are not
+    allocated in commit order and IDs of deleted nodes are reused, so the
+    number of nodes seen is compared with the number of nodes in the database
+    and the whole label is fetched again if they differ (see
+    IYP._get_cached_nodes).
+
+    The cache is cleared if it is used with another database (see check())."""
+
+    def __init__(self):
+        self.db_id = None
+        self.entries = {}
+
+    def check(self, db_id):
+        """Clear the cache if it was filled with another database than the one
+        identified by db_id."""
+
+        if db_id != self.db_id:
+            logging.warning(f'Node cache: new database {db_id}, clearing cache')
+            self.clear()
+            self.db_id = db_id
+
+    def clear(self):
+        self.entries = {}
+
+    def get(self, label, prop_name):
+        """Return the cached ids (a NodeIDMap property value -> node ID), the
+        largest node ID seen and the number of nodes seen for the given label
+        and property, or (None, -1, 0) if nothing is cached."""
+
+        return self.entries.get((label, prop_name), (None, -1, 0))
+
+    def reset(self, label, prop_name):
+        """Forget the nodes cached for the given label and property."""
+
+        self.entries.pop((label, prop_name), None)
+
+    def update(self, label, prop_name, new_ids, max_id, count):
+        """Add new_ids to the cache, count is the number of nodes seen
+        including these ones. Return all cached ids for the given label and
+        property."""
+
+        ids, _, _ = self.get(label, prop_name)
+        if ids is None:
+            ids = new_ids
+        else:
+            ids.update(new_ids)
+
+        self.entries[(label, prop_name)] = (ids, max_id, count)
+
+        return ids
+
+
+class SqliteNodeCache(MemoryNodeCache):
+    """Node ID cache stored in a sqlite file, so that it is shared by
+    processes (e.g. the workers running crawlers in create_db.py) or persists
+    across standalone runs of crawlers. Accesses are serialized with a lock
+    file. The file is only used if it is given explicitly (see
+    get_node_cache)."""
+
+    def __init__(self, path):
+        super().__init__()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.lock_path = path + '.lock'
+        with self.locked():
+            self.con = sqlite3.connect(path, timeout=60)
+            self._init_db()
+
+    @contextmanager
+    def locked(self):
+        """Hold the lock of the cache file."""
+
+        with open(self.lock_path, 'a') as fp:
+            fcntl.flock(fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fp, fcntl.LOCK_UN)
+
+    def _init_db(self):
+        if self.con.execute('PRAGMA user_version').fetchone()[0] != SCHEMA_VERSION:
+            for table in ['info', 'entries', 'nodes']:
+                self.con.execute(f'DROP TABLE IF EXISTS {table}')
+            self.con.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+
+        self.con.execute('CREATE TABLE IF NOT EXISTS info (db_id TEXT)')
+        self.con.execute('CREATE TABLE IF NOT EXISTS entries (label TEXT, prop TEXT, max_id INTEGER, count INTEGER, PRIMARY KEY (label, prop))')
+        self.con.execute('CREATE TABLE IF NOT EXISTS nodes (label TEXT, prop TEXT, value, id INTEGER)')
+        self.con.execute('CREATE INDEX IF NOT EXISTS nodes_entry ON nodes (label, prop)')
+
+        row = self.con.execute('SELECT db_id FROM info').fetchone()
+        if row is not None:
+            self.db_id = row[0]
+
+        self.con.commit()
+
+    def clear(self):
+        super().clear()
+
+        with self.locked():
+            self.con.execute('DELETE FROM info')
+            self.con.execute('DELETE FROM entries')
+            self.con.execute('DELETE FROM nodes')
+            self.con.commit()
+
+    def check(self, db_id):
+        if db_id != self.db_id:
+            super().check(db_id)
+            with self.locked():
+                self.con.execute('INSERT INTO info VALUES (?)', (db_id,))
+                self.con.commit()
+
+    def get(self, label, prop_name):
+        if (label, prop_name) not in self.entries:
+            with self.locked():
+                self._load(label, prop_name)
+
+        return super().get(label, prop_name)
+
+    def _load(self, label, prop_name):
+        row = self.con.execute('SELECT max_id, count FROM entries WHERE label=? AND prop=?',
+                               (label, prop_name)).fetchone()
+        if row is None:
+            return
+
+        nodes = self.con.execute('SELECT value, id FROM nodes WHERE label=? AND prop=? ORDER BY value',
+                                 (label, prop_name))
+        self.entries[(label, prop_name)] = (NodeIDMap.from_items(nodes), row[0], row[1])
+
+    def reset(self, label, prop_name):
+        super().reset(label, prop_name)
+
+        with self.locked():
+            self.con.execute('DELETE FROM entries WHERE label=? AND prop=?', (label, prop_name))
+            self.con.execute('DELETE FROM nodes WHERE label=? AND prop=?', (label, prop_name))
+            self.con.commit()
+
+    def update(self, label, prop_name, new_ids, max_id, count):
+        ids = super().update(label, prop_name, new_ids, max_id, count)
+
+        with self.locked():
+            self.con.executemany('INSERT INTO nodes VALUES (?, ?, ?, ?)',
+                                 ((label, prop_name, value, id) for value, id in new_ids.items()))
+            # Another process may have fetched more nodes
+            self.con.execute("""INSERT INTO entries VALUES (?, ?, ?, ?)
+                ON CONFLICT (label, prop) DO UPDATE SET max_id = excluded.max_id, count = excluded.count
+                WHERE excluded.max_id >= max_id""",
+                (label, prop_name, max_id, count))
+            self.con.commit()
+
+        return ids
+
+
+_node_cache = None
+_node_cache_set = False
+
+def get_node_cache():
+    """Return the node ID cache of this process (None if disabled). By
+    default the cache is kept in memory, it is stored in a sqlite file if
+    the IYP_NODE_CACHE environment variable gives its path."""
+
+    global _node_cache
+
+    if not _node_cache_set and _node_cache is None:
+        path = os.environ.get('IYP_NODE_CACHE')
+        _node_cache = SqliteNodeCache(path) if path else MemoryNodeCache()
+
+    return _node_cache
+
+def set_node_cache(cache):
+    """Set the node ID cache used by all IYP clients of this process, e.g.
+    set_node_cache(MemoryNodeCache()) to keep it only in memory or None to
+    disable it."""
+
+    global _node_cache, _node_cache_set
+
+    _node_cache = cache
+    _node_cache_set = True
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+
+# Default location of checkpoint files, one per crawler
+CHECKPOINT_DIR = './tmp/checkpoints/'
+
+# Number of items hashed by fingerprint()
+FINGERPRINT_SAMPLES = 64
+
+
+def fingerprint(query, items):
+    """Identify a sequence of items pushed with the given query. Hashing all
+    items would cost as much as formatting the push, so only the number of
+    items and a sample of them (evenly spaced, including the first and last
+    ones) are hashed. A push whose items changed without changing these is
+    resumed, crawlers should produce the same items from the same input."""
+
+    digest = hashlib.sha1(query.encode())
+    step = max(1, (len(items)-1) // (FINGERPRINT_SAMPLES-1))
+    for i in sorted(set(range(0, len(items), step)) | {len(items)-1}):
+        if i >= 0:
+            digest.update(f'{i}:{items[i]!r}'.encode())
+
+    return f'{len(items)}:{digest.hexdigest()}'
+
+
+class Checkpoints(object):
+    """Record which batches of the link pushes made by a crawler have been
+    committed, so that a crawler failing in the middle of a large push can be
+    restarted without pushing committed batches again.
+
+    Pushes are numbered in the order they are made by the crawler and
+    identified by a fingerprint of their items, hence crawlers should produce
+    the same items in the same order when restarted. Checkpoints are discarded
+    if the database changes and cleared when the crawler ends successfully."""
+
+    def __init__(self, name, db_id, root=CHECKPOINT_DIR):
+        self.path = os.path.join(root, f'{name}.json')
+        self.lock = threading.Lock()
+        self.nb_pushes = 0
+
+        self.data = {'db_id': db_id, 'pushes': {}}
+        if os.path.exists(self.path):
+            with open(self.path) as fp:
+                data = json.load(fp)
+            if data.get('db_id') == db_id:
+                self.data = data
+                logging.warning(f'Checkpoints: resuming from {self.path}')
+
+    def start(self, fingerprint, nb_items):
+        """Start the next push and return its ID and the (start, end) ranges
+        of items that are not committed yet."""
+
+        push_id = str(self.nb_pushes)
+        self.nb_pushes += 1
+
+        push = self.data['pushes'].get(push_id)
+        if push is None or push['fingerprint'] != fingerprint:
+            self.data['pushes'][push_id] = {'fingerprint': fingerprint, 'done': []}
+            return push_id, [(0, nb_items)]
+
+        pending = []
+        position = 0
+        for start, end in sorted(push['done']):
+            if start > position:
+                pending.append( (position, start) )
+            position = max(position, end)
+        if position < nb_items:
+            pending.append( (position, nb_items) )
+
+        logging.warning(f'Checkpoints: push {push_id}, {nb_items-sum(e-s for s, e in pending)} items already committed')
+
+        return push_id, pending
+
+    def done(self, push_id, start, end):
+        """Record that items from start to end are committed."""
+
+        with self.lock:
+            ranges = sorted(self.data['pushes'][push_id]['done'] + [[start, end]])
+
+            # merge contiguous ranges
+            merged = [ranges[0]]
+            for start, end in ranges[1:]:
+                if start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], end)
+                else:
+                    merged.append([start, end])
+            self.data['pushes'][push_id]['done'] = merged
+
+            self._write()
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as fp:
+            json.dump(self.data, fp)
+        os.replace(tmp_path, self.path)
+
+    def clear(self):
+        """Remove checkpoints, e.g. when the crawler ended successfully."""
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
@@ -1,6 +1,6 @@
 import sys
+import json
 import logging
-import requests
 import iso3166
 from iyp import BaseCrawler
 
@@ -18,6 +18,17 @@ class Crawler(BaseCrawler):
         self.countries = iso3166.countries_by_alpha2
         super().__init__(organization, url, name)
 
+    def country_url(self, cc):
+        """URL of the eyeball ranking for the given country."""
+
+        return URL+f'{cc}/{cc}.asns.json?m={MIN_POP_PERC}'
+
+    def fetch(self):
+        """Download the eyeball rankings of all countries"""
+
+        for cc in self.countries:
+            self.fetch_url(self.country_url(cc))
+
     def run(self):
         """Fetch data from APNIC and push to IYP. """
 
@@ -32,15 +43,13 @@ class Crawler(BaseCrawler):
             statements = [ ['COUNTRY', cc_qid, self.reference] ]
             self.iyp.add_links(ranking_qid, statements)
 
-            self.url = URL+f'{cc}/{cc}.asns.json?m={MIN_POP_PERC}'
-            req = requests.get( self.url )
-            if req.status_code != 200:
-                sys.exit('Error while fetching data for '+cc)
-            
+            self.url = self.country_url(cc)
+            with open(self.fetch_url(self.url)) as fp:
+                ranking = json.load(fp)
+
             asns = set()
             names = set()
-             
-            ranking = req.json()
+
             logging.info(f'{len(ranking)} eyeball ASes')
 
             # Collect all ASNs and names
@@ -52,8 +61,8 @@ class Crawler(BaseCrawler):
                 names.add(asn['autnum'])
 
             # Get node IDs
-            self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns, all=False)
-            self.name_id = self.iyp.batch_get_nodes('Name', 'name', names, all=False)
+            self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns, upsert=True)
+            self.name_id = self.iyp.batch_get_nodes('Name', 'name', names, upsert=True)
 
             # Compute links
             country_links = []
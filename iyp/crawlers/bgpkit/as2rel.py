@@ -1,7 +1,8 @@
 import sys
 import logging
-import requests
 from iyp import BaseCrawler
+from iyp.download import file_digest
+from iyp.metrics import metrics
 import bz2
 import json
 
@@ -11,35 +12,33 @@ NAME = 'bgpkit.as2rel'
 
 class Crawler(BaseCrawler):
 
-    def run(self):
-        """Fetch the AS relationship file from BGPKIT website and process lines one by one"""
+    def fetch(self):
+        """Download the AS relationship file from BGPKIT website"""
 
-        req = requests.get(URL, stream=True)
-        if req.status_code != 200:
-            sys.exit('Error while fetching AS relationships')
+        self.fetch_url(URL)
 
-        rels = []
-        asns = set()
+    def run(self):
+        """Read the AS relationship file and process lines one by one"""
 
-        # Collect all ASNs 
-        for rel in json.load(bz2.open(req.raw)):
-            asns.add(rel['asn1'])
-            asns.add(rel['asn2'])
-            rels.append(rel)
+        path = self.fetch_url(URL)
+        if self.skip_unchanged(file_digest(path)):
+            return
 
-        # get ASNs IDs
-        self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns)
+        with metrics.phase('parse'):
+            with bz2.open(path) as fp:
+                data = json.load(fp)
 
-        # Compute links
+        # Compute links, AS nodes are resolved by neo4j
         links = []
-        for rel in rels:
-            as1_qid = self.asn_id[rel['asn1']]
-            as2_qid = self.asn_id[rel['asn2']]
-
-            links.append( { 'src_id':as1_qid, 'dst_id':as2_qid, 'props':[self.reference, rel] } ) # Set AS name
+        for rel in data:
+            links.append( {
+                'src': ('AS', 'asn', rel['asn1']),
+                'dst': ('AS', 'asn', rel['asn2']),
+                'props': [rel]
+                } )
 
         # Push all links to IYP
-        self.iyp.batch_add_links('PEERS_WITH', links)
+        self.iyp.batch_add_links_by_key('PEERS_WITH', links, reference=self.reference)
 
 if __name__ == '__main__':
 
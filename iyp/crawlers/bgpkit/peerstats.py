@@ -13,18 +13,16 @@ NAME = 'bgpkit.peerstats'
 
 class Crawler(BaseCrawler):
 
-    def run(self):
-        """Fetch peer stats for each collector"""
-
-        req = requests.get(MAIN_PAGE)
-        if req.status_code != 200:
-            logging.error(f'Cannot fetch peer-stats page {req.status_code}: req.text')
-            sys.exit('Error while fetching main page')
+    def collector_urls(self):
+        """Find all collectors and return the URL of the latest peer stats
+        of each collector."""
 
+        with open(self.fetch_url(MAIN_PAGE, 'index.html')) as fp:
+            page = fp.read()
 
         # Find all collectors
         collectors = []
-        for line in req.text.splitlines():
+        for line in page.splitlines():
             if line.startswith('<span class="name">') and line.endswith('/</span>'):
                 collectors.append( line.partition('>')[2].partition('/')[0] )
 
@@ -40,19 +38,33 @@ class Crawler(BaseCrawler):
             self.now -= timedelta(days=1)
             logging.warning("Today's data not yet available!")
 
-        for collector in collectors:
-            url = URL.format( collector=collector, year=self.now.year, 
-                            month=self.now.month, day=self.now.day, 
-                            epoch=int(self.now.timestamp()))
+        return [ (collector, URL.format( collector=collector, year=self.now.year,
+                            month=self.now.month, day=self.now.day,
+                            epoch=int(self.now.timestamp())))
+                for collector in collectors ]
+
+    def fetch(self):
+        """Download peer stats of all collectors"""
+
+        for collector, url in self.collector_urls():
+            try:
+                self.fetch_url(url)
+            except Exception:
+                logging.warning(f"Data not available for {collector}")
+
+    def run(self):
+        """Fetch peer stats for each collector"""
 
-            req = requests.get( url, stream=True )
-            if req.status_code != 200:
-                self.now -= timedelta(days=1)
+        for collector, url in self.collector_urls():
+            try:
+                path = self.fetch_url(url)
+            except Exception:
                 logging.warning(f"Data not available for {collector}")
                 continue
 
             # keep track of collector and reference url
-            stats = json.load(bz2.open(req.raw))
+            with bz2.open(path) as fp:
+                stats = json.load(fp)
             collector_qid = self.iyp.get_node(
                     'BGPCollector',
                     {'name': stats['collector'], 'project': stats['project']},
@@ -67,7 +79,7 @@ class Crawler(BaseCrawler):
                 asns.add(peer['asn'])
 
             # get ASNs' IDs
-            self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns, all=False)
+            self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns, upsert=True)
 
             # Compute links
             links = []
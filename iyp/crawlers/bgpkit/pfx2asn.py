@@ -1,7 +1,8 @@
 import sys
 import logging
-import requests
 from iyp import BaseCrawler
+from iyp.download import file_digest
+from iyp.metrics import metrics
 import bz2
 import json
 
@@ -11,40 +12,34 @@ NAME = 'bgpkit.pfx2asn'
 
 class Crawler(BaseCrawler):
 
-    def run(self):
-        """Fetch the prefix to ASN file from BGPKIT website and process lines one by one"""
-
-        req = requests.get(URL, stream=True)
-        if req.status_code != 200:
-            sys.exit('Error while fetching pfx2as relationships')
+    def fetch(self):
+        """Download the prefix to ASN file from BGPKIT website"""
 
-        entries = []
-        asns = set()
-        prefixes = set()
+        self.fetch_url(URL)
 
-        for entry in json.load(bz2.open(req.raw)):
-            prefixes.add(entry['prefix'])
-            asns.add(entry['asn'])
-            entries.append(entry)
+    def run(self):
+        """Read the prefix to ASN file and process lines one by one"""
 
-        req.close()
+        path = self.fetch_url(URL)
+        if self.skip_unchanged(file_digest(path)):
+            return
 
-        logging.info('Pushing nodes to neo4j...\n')
-        # get ASNs and prefixes IDs
-        self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns)
-        self.prefix_id = self.iyp.batch_get_nodes('Prefix', 'prefix', prefixes)
+        with metrics.phase('parse'):
+            with bz2.open(path) as fp:
+                data = json.load(fp)
 
-        # Compute links
+        # Compute links, AS and Prefix nodes are resolved by neo4j
         links = []
-        for entry in entries:
-            asn_qid = self.asn_id[entry['asn']]
-            prefix_qid = self.prefix_id[entry['prefix']]
-
-            links.append( { 'src_id':asn_qid, 'dst_id':prefix_qid, 'props':[self.reference, entry] } ) # Set AS name
+        for entry in data:
+            links.append( {
+                'src': ('AS', 'asn', entry['asn']),
+                'dst': ('Prefix', 'prefix', entry['prefix']),
+                'props': [entry]
+                } )
 
         logging.info('Pushing links to neo4j...\n')
         # Push all links to IYP
-        self.iyp.batch_add_links('ORIGINATE', links)
+        self.iyp.batch_add_links_by_key('ORIGINATE', links, reference=self.reference)
 
 
 if __name__ == '__main__':
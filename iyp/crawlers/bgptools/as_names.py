@@ -1,7 +1,8 @@
 import sys
 import logging
-import requests
 from iyp import BaseCrawler
+from iyp.download import file_digest
+from iyp.metrics import metrics
 
 #curl -s https://bgp.tools/asns.csv | head -n 5
 URL = 'https://bgp.tools/asns.csv'
@@ -17,32 +18,41 @@ class Crawler(BaseCrawler):
 
         super().__init__(organization, url, name)
 
+    def fetch(self):
+        """Download the AS name file from BGP.Tools website"""
+
+        self.fetch_url(URL, headers=self.headers)
+
     def run(self):
-        """Fetch the AS name file from BGP.Tools website and push it to IYP"""
+        """Read the AS name file and push it to IYP"""
+
+        path = self.fetch_url(URL, headers=self.headers)
+        if self.skip_unchanged(file_digest(path)):
+            return
 
-        req = requests.get(URL, headers=self.headers)
-        if req.status_code != 200:
-            sys.exit('Error while fetching AS names')
+        with metrics.phase('parse'):
+            with open(path, encoding='utf-8') as fp:
+                text = fp.read()
 
-        lines = []
-        asns = set()
-        names = set()
+            lines = []
+            asns = set()
+            names = set()
 
-        # Collect all ASNs and names
-        for line in req.text.splitlines():
-            if line.startswith('asn,'):
-                continue
+            # Collect all ASNs and names
+            for line in text.splitlines():
+                if line.startswith('asn,'):
+                    continue
 
-            asn, _, name = line.partition(',')
-            name = name.rpartition(',')[0]
-            asn = int(asn[2:])
-            asns.add(asn)
-            names.add(name)
-            lines.append( [asn, name] )
+                asn, _, name = line.partition(',')
+                name = name.rpartition(',')[0]
+                asn = int(asn[2:])
+                asns.add(asn)
+                names.add(name)
+                lines.append( [asn, name] )
 
         # get ASNs and names IDs
-        self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns)
-        self.name_id = self.iyp.batch_get_nodes('Name', 'name', names)
+        self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns, upsert=True)
+        self.name_id = self.iyp.batch_get_nodes('Name', 'name', names, upsert=True)
 
         # Compute links
         links = []
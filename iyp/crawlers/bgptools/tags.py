@@ -1,6 +1,5 @@
 import sys
 import logging
-import requests
 from datetime import datetime, time, timezone
 from iyp import BaseCrawler
 
@@ -38,8 +37,14 @@ class Crawler(BaseCrawler):
 
         super().__init__(organization, url, name)
 
+    def fetch(self):
+        """Download the tag files from BGP.Tools website"""
+
+        for tag in TAGS:
+            self.fetch_url(URL+tag+'.csv', headers=self.headers)
+
     def run(self):
-        """Fetch the AS name file from BGP.Tools website and process lines one by one"""
+        """Read the tag files and process lines one by one"""
 
         for tag, label in TAGS.items():
             url = URL+tag+'.csv'
@@ -51,25 +56,23 @@ class Crawler(BaseCrawler):
                 'reference_time': datetime.combine(datetime.utcnow(), time.min, timezone.utc)
                 }
 
-            req = requests.get(url, headers=self.headers)
-            if req.status_code != 200:
-                print(req.text)
-                sys.exit('Error while fetching AS names')
+            with open(self.fetch_url(url, headers=self.headers), encoding='utf-8') as fp:
+                text = fp.read()
 
             self.tag_qid = self.iyp.get_node('Tag', {'label': label}, create=True)
-            for line in req.text.splitlines():
+            for line in text.splitlines():
                 # skip header
                 if line.startswith('asn'):
                     continue
 
                 # Parse given line to get ASN, name, and country code 
                 asn, _, _ = line.partition(',')
-                asn_qid = self.iyp.get_node('AS', {'asn': asn[2:]}, create=True)
+                asn_qid = self.buffer.get_node('AS', {'asn': asn[2:]}, create=True)
                 statements = [ [ 'CATEGORIZED', self.tag_qid, self.reference ] ] # Set AS name
 
                 try:
                     # Update AS name and country
-                    self.iyp.add_links(asn_qid, statements)
+                    self.buffer.add_links(asn_qid, statements)
 
                 except Exception as error:
                     # print errors and continue running
@@ -1,56 +1,56 @@
 import sys
 import logging
 import flatdict
-import requests
 import json
-from iyp import BaseCrawler
+from iyp.aio import AsyncBaseCrawler
 
 # URL to ASRank API
 URL = 'https://api.asrank.caida.org/v2/restful/asns/?first=10000'
 ORG = 'CAIDA'
 NAME = 'caida.asrank'
 
-class Crawler(BaseCrawler):
+class Crawler(AsyncBaseCrawler):
 
-    def run(self):
-        """Fetch networks information from ASRank and push to IYP. """
+    def fetch_page(self, i):
+        """Fetch the i-th page of the ranking. This runs in a worker thread,
+        errors are raised when the page is awaited."""
+
+        url = URL+f'&offset={i*10000}'
+        with open(self.fetch_url(url, f'asns-{i}.json')) as fp:
+            return json.load(fp)['data']['asns']
+
+    def fetch(self):
+        """Download all pages of the ranking"""
+
+        i = 0
+        while self.fetch_page(i)['pageInfo']['hasNextPage']:
+            i += 1
+
+    async def arun(self):
+        """Fetch networks information from ASRank and push to IYP. The next
+        page is downloaded while the current one is pushed to IYP."""
 
         # get ASNs, names, and countries IDs
-        self.asn_id = self.iyp.batch_get_nodes('AS', 'asn')
-        self.country_id = self.iyp.batch_get_nodes('Country', 'country_code')
-        self.asrank_qid = self.iyp.get_node('Ranking', {'name': f'CAIDA ASRank'}, create=True)
+        self.asn_id = await self.iyp.batch_get_nodes('AS', 'asn')
+        self.country_id = await self.iyp.batch_get_nodes('Country', 'country_code')
+        self.asrank_qid = await self.iyp.get_node('Ranking', {'name': f'CAIDA ASRank'}, create=True)
 
+        next_page = self.background(self.fetch_page, 0)
         has_next = True
         i = 0
         while has_next:
-            url = URL+f'&offset={i*10000}'
-            i += 1
-            req = requests.get(url)
-            if req.status_code != 200:
-                # FIXME should raise an exception
-                sys.exit('Error while fetching data from API')
-            
-            ranking = json.loads(req.text)['data']['asns']
+            ranking = await next_page
             has_next = ranking['pageInfo']['hasNextPage']
 
-            asns = set()
-            names = set()
-            countries = set()
-
-            # Collect all ASNs and names
-            for node in ranking['edges']:
-                asn = node['node']
-                names.add(asn['asnName'])
-                asns.add(int(asn['asn']))
-                countries.add(asn['country']['iso'])
+            i += 1
+            if has_next:
+                next_page = self.background(self.fetch_page, i)
 
             # Compute links
             country_links = []
             name_links = []
             rank_links = []
-            asns = set()
             names = set()
-            countries = set()
 
             for node in ranking['edges']:
                 asn = node['node']
@@ -59,9 +59,9 @@ class Crawler(BaseCrawler):
 
                 # This may be slow if countries and ASes are not already registered
                 if int(asn['asn']) not in self.asn_id:
-                    self.asn_id[int(asn['asn'])] = self.iyp.get_node('AS', {'asn':int(asn['asn'])}, create=True)
+                    self.asn_id[int(asn['asn'])] = await self.iyp.get_node('AS', {'asn':int(asn['asn'])}, create=True)
                 if asn['country']['iso'] not in self.country_id:
-                    self.country_id[asn['country']['iso']] = self.iyp.get_node('Country', {'country_code':asn['country']['iso']}, create=True)
+                    self.country_id[asn['country']['iso']] = await self.iyp.get_node('Country', {'country_code':asn['country']['iso']}, create=True)
 
                 asn_qid = self.asn_id[int(asn['asn'])]
                 country_qid = self.country_id[asn['country']['iso']]
@@ -75,16 +75,16 @@ class Crawler(BaseCrawler):
                 rank_links.append( { 'src_id':asn_qid, 'dst_id':self.asrank_qid, 'props':[self.reference, flat_asn] } ) # Set AS name
 
             # Push nodes
-            self.names_id = self.iyp.batch_get_nodes('Name', 'name', names, all=False)
+            self.names_id = await self.iyp.batch_get_nodes('Name', 'name', names, upsert=True)
 
             # Add dst_id in name_links
             for link in name_links :
                 link['dst_id'] = self.names_id[link['dst_name']]
 
             # Push all links to IYP
-            self.iyp.batch_add_links('NAME', name_links)
-            self.iyp.batch_add_links('COUNTRY', country_links)
-            self.iyp.batch_add_links('RANK', rank_links)
+            await self.iyp.batch_add_links('NAME', name_links)
+            await self.iyp.batch_add_links('COUNTRY', country_links)
+            await self.iyp.batch_add_links('RANK', rank_links)
         
 # Main program
 if __name__ == '__main__':
@@ -29,26 +29,16 @@ class Crawler(BaseCrawler):
     # Base Crawler provides access to IYP via self.iyp
     # and setup a dictionary with the org/url/today's date in self.reference
 
-    def __init__(self, organization, url, name):
-
-        # Initialize IYP connection
-        super().__init__(organization, url, name)
-
-        # Fetch domain names registered in IYP
-        existing_dn = self.iyp.tx.run(
-                f"""MATCH (dn:DomainName)-[r:RANK]-(:Ranking) 
-                WHERE r.rank < {RANK_THRESHOLD}
-                RETURN ID(dn) AS _id, dn.name AS dname;""")
-
-
-        self.domain_names_id = { node['dname']: node['_id'] for node in existing_dn }
-        self.domain_names = list(self.domain_names_id.keys())
-
+    # Domain names to query are known once rankings are in IYP
+    prefetch = False
 
     def fetch(self):
         """Download top locations for top RANK_THRESHOLD domain names registered
         in IYP and save it on disk"""
 
+        # Fetch domain names registered in IYP
+        self.domain_names_id = self.iyp.batch_get_ranked_nodes('DomainName', 'name', RANK_THRESHOLD)
+        self.domain_names = list(self.domain_names_id.keys())
 
         # setup HTTPS session with credentials and retry
         req_session = requests.Session()
@@ -96,7 +86,8 @@ class Crawler(BaseCrawler):
     def run(self):
         """Push data to IYP. """
 
-        # FIXME this should be called before/separately 
+        # Domain names are known once rankings are in IYP, so data is
+        # fetched here rather than before running crawlers
         self.fetch()
 
         self.country_id = self.iyp.batch_get_nodes('Country', 'country_code')
@@ -17,26 +17,44 @@ API_KEY = ''
 if os.path.exists('config.json'): 
     API_KEY = json.load(open('config.json', 'r'))['cloudflare']['apikey']
 
+HEADERS = {
+        'Authorization': 'Bearer '+API_KEY,
+        'Content-Type': 'application/json'
+        }
+
 class Crawler(BaseCrawler):
     # Base Crawler provides access to IYP via self.iyp
     # and setup a dictionary with the org/url/today's date in self.reference
 
-    def run(self):
-        """Fetch data and push to IYP. """
+    def datasets(self):
+        """Return the descriptions of the rankings."""
 
-        s = requests.Session()
-        s.headers.update( {
-                'Authorization': 'Bearer '+API_KEY,
-                'Content-Type': 'application/json'
-                } )
+        with open(self.fetch_url(URL_DATASETS, 'datasets.json', headers=HEADERS)) as fp:
+            return json.load(fp)['result']['datasets']
 
-        # Fetch rankings descriptions
-        req = s.get(URL_DATASETS)
+    def fetch_dataset(self, dataset):
+        """Download the given dataset and return its URL and local path, or
+        None if its URL is not available."""
+
+        # Get the dataset url
+        req = requests.post(URL_DL, headers=HEADERS, json={'datasetId': dataset['id']})
         if req.status_code != 200:
-            logging.error(f'Cannot download data {req.status_code}: {req.text}')
-            sys.exit('Error while fetching data file')
+            logging.error(f'Cannot get url for dataset {dataset["id"]} {req.status_code}: {req.text}')
+            return None
+
+        url = req.json()['result']['dataset']['url']
+        return url, self.fetch_url(url, f'{dataset["id"]}.zip')
+
+    def fetch(self):
+        """Download all datasets"""
 
-        for dataset in req.json()['result']['datasets']:
+        for dataset in self.datasets():
+            self.fetch_dataset(dataset)
+
+    def run(self):
+        """Fetch data and push to IYP. """
+
+        for dataset in self.datasets():
             self.ranking_qid = self.iyp.get_node(
                     'Ranking',
                     {
@@ -46,22 +64,14 @@ class Crawler(BaseCrawler):
                     }, 
                     create=True)
 
-            # Get the dataset url
-            req = s.post(URL_DL, json={'datasetId': dataset['id']})
-            if req.status_code != 200:
-                logging.error(f'Cannot get url for dataset {dataset["id"]} {req.status_code}: {req.text}')
+            fetched = self.fetch_dataset(dataset)
+            if fetched is None:
                 continue
 
-            print(req.json())
-
-            self.reference['reference_url'] = req.json()['result']['dataset']['url']
-            req = requests.get(self.reference['reference_url'])
-            if req.status_code != 200:
-                logging.error(f'Cannot download dataset {dataset["id"]} {req.status_code}: {req.text}')
-                continue
+            self.reference['reference_url'], path = fetched
 
             # open zip file and read top list
-            with  ZipFile(io.BytesIO(req.content)) as z:
+            with  ZipFile(path) as z:
                 for fname in z.namelist():
                     with z.open(fname) as list:
                         for i, domain in enumerate(io.TextIOWrapper(list)):
@@ -85,8 +95,8 @@ class Crawler(BaseCrawler):
 
         # Commit to IYP
         # Get the AS's node ID (create if it is not yet registered) and commit changes
-        domain_qid = self.iyp.get_node('DomainName', {'name': domain}, create=True)
-        self.iyp.add_links( domain_qid, statements )
+        domain_qid = self.buffer.get_node('DomainName', {'name': domain}, create=True)
+        self.buffer.add_links( domain_qid, statements )
         
 # Main program
 if __name__ == '__main__':
@@ -2,8 +2,8 @@ import os
 import sys
 import json
 import logging
-import requests
 from iyp import BaseCrawler
+from iyp.download import file_digest
 
 # Organization name and URL to data
 ORG = 'Cloudflare'
@@ -18,25 +18,32 @@ class Crawler(BaseCrawler):
     # Base Crawler provides access to IYP via self.iyp
     # and setup a dictionary with the org/url/today's date in self.reference
 
-    def run(self):
-        """Fetch data and push to IYP. """
-
-        self.cf_qid = self.iyp.get_node(
-                'Ranking', {'name': f'Cloudflare top 100 domains'}, create=True)
+    def fetch(self):
+        """Download the top 100 domains from Cloudflare API"""
 
-        # Fetch data
         headers = {
                 'Authorization': 'Bearer '+API_KEY,
                 'Content-Type': 'application/json'
                 }
 
-        req = requests.get(self.reference['reference_url'], headers=headers)
-        if req.status_code != 200:
-            print(f'Cannot download data {req.status_code}: {req.text}')
-            sys.exit('Error while fetching data file')
+        return self.fetch_url(self.reference['reference_url'], 'top100.json', headers=headers)
+
+    def run(self):
+        """Read data and push to IYP. """
+
+        # Fetch data
+        path = self.fetch()
+        if self.skip_unchanged(file_digest(path)):
+            return
+
+        self.cf_qid = self.iyp.get_node(
+                'Ranking', {'name': f'Cloudflare top 100 domains'}, create=True)
+
+        with open(path) as fp:
+            top = json.load(fp)['result']['top']
 
         # Process line one after the other
-        for i, _ in enumerate(map(self.update, req.json()['result']['top'])):
+        for i, _ in enumerate(map(self.update, top)):
             sys.stderr.write(f'\rProcessed {i} lines')
         sys.stderr.write('\n')
     
@@ -49,8 +56,8 @@ class Crawler(BaseCrawler):
 
         # Commit to IYP
         # Get the AS's node ID (create if it is not yet registered) and commit changes
-        domain_qid = self.iyp.get_node('DomainName', {'name': entry['domain']}, create=True)
-        self.iyp.add_links( domain_qid, statements )
+        domain_qid = self.buffer.get_node('DomainName', {'name': entry['domain']}, create=True)
+        self.buffer.add_links( domain_qid, statements )
         
 # Main program
 if __name__ == '__main__':
@@ -9,7 +9,8 @@ URL = 'https://example.com/data.csv'
 NAME = 'example.crawler' # should reflect the directory and name of this file
 
 class Crawler(BaseCrawler):
-    # Base Crawler provides access to IYP via self.iyp
+    # Base Crawler provides access to IYP via self.iyp (or self.buffer to
+    # add nodes and links one at a time, they are pushed in batches)
     # and setup a dictionary with the org/url/today's date in self.reference
 
     def run(self):
@@ -35,7 +36,7 @@ class Crawler(BaseCrawler):
         asn, value = one_line.split(',')
 
         # create node for value
-        val_qid = self.iyp.get_node(
+        val_qid = self.buffer.get_node(
                 'EXAMPLE_NODE_LABEL', 
                 { 
                  'example_property_0': value,
@@ -49,8 +50,8 @@ class Crawler(BaseCrawler):
 
         # Commit to IYP
         # Get the AS's node ID (create if it is not yet registered) and commit changes
-        as_qid = self.iyp.get_node('AS', {'asn': asn}, create=True) 
-        self.iyp.add_links( as_qid, statements )
+        as_qid = self.buffer.get_node('AS', {'asn': asn}, create=True) 
+        self.buffer.add_links( as_qid, statements )
         
 # Main program
 if __name__ == '__main__':
@@ -1,10 +1,7 @@
 import sys
 import logging
 import arrow
-import requests
 from datetime import datetime, time, timezone
-from urllib3.util.retry import Retry
-from requests.adapters import HTTPAdapter
 import json
 from iyp import BaseCrawler
 import iso3166
@@ -23,26 +20,27 @@ class Crawler(BaseCrawler):
         # list of countries
         self.countries = iso3166.countries_by_alpha2
 
-        # Session object to fetch peeringdb data
-        retries = Retry(total=15,
-                backoff_factor=0.2,
-                status_forcelist=[ 104, 500, 502, 503, 504 ])
+        super().__init__(organization, url, name)
 
-        self.http_session = requests.Session()
-        self.http_session.mount('https://', HTTPAdapter(max_retries=retries))
+    def fetch_country(self, cc):
+        """Query IHR for the given country and return the local path of the
+        results. Requests are retried by iyp.download."""
 
-        super().__init__(organization, url, name)
+        self.url = URL.format(country=cc)
+        return self.fetch_url(self.url+'&format=json', f'{cc}.json')
+
+    def fetch(self):
+        """Download the dependencies of all countries"""
+
+        for cc in self.countries:
+            self.fetch_country(cc)
 
     def run(self):
-        """Fetch data from API and push to IYP. """
+        """Read data fetched from the API and push to IYP. """
 
         for cc, country in self.countries.items():
-            # Query IHR
-            self.url = URL.format(country=cc)
-            req = self.http_session.get( self.url+'&format=json' )
-            if req.status_code != 200:
-                sys.exit('Error while fetching data for '+cc)
-            data = json.loads(req.text)
+            with open(self.fetch_country(cc)) as fp:
+                data = json.load(fp)
             ranking = data['results']
 
             # Setup references
@@ -96,7 +94,7 @@ class Crawler(BaseCrawler):
                     asns.add(asn['asn'])
                     asn['rank']=i 
 
-                self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns, all=False)
+                self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns, upsert=True)
 
                 # Compute links 
                 for asn in selected:
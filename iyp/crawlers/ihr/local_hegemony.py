@@ -6,7 +6,6 @@ import lz4.frame
 from datetime import datetime, time, timezone
 import csv
 from iyp import BaseCrawler
-import os
 
 # URL to the API
 URL = 'https://ihr-archive.iijlab.net/ihr/hegemony/ipv4/local/{year}/{month:02d}/{day:02d}/ihr_hegemony_ipv4_local_{year}-{month:02d}-{day:02d}.csv.lz4'
@@ -35,8 +34,8 @@ class lz4Csv:
 
 class Crawler(BaseCrawler):
 
-    def run(self):
-        """Fetch data from file and push to IYP. """
+    def latest_url(self):
+        """Return the URL of the latest file and its date."""
 
         today = arrow.utcnow()
         url = URL.format(year=today.year, month=today.month, day=today.day)
@@ -48,7 +47,19 @@ class Crawler(BaseCrawler):
             if req.status_code != 200:
                 today = today.shift(days=-1)
                 url = URL.format(year=today.year, month=today.month, day=today.day)
-                req = requests.head(url)
+
+        return url, today
+
+    def fetch(self):
+        """Download the latest file from IHR archive"""
+
+        url, _ = self.latest_url()
+        self.fetch_url(url)
+
+    def run(self):
+        """Fetch data from file and push to IYP. """
+
+        url, today = self.latest_url()
 
 
         self.reference = {
@@ -58,10 +69,7 @@ class Crawler(BaseCrawler):
             'reference_time': datetime.combine(today.date(), time.min, timezone.utc)
         }
 
-        os.makedirs('tmp/', exist_ok=True)
-        os.system(f'wget {url} -P tmp/')
-        
-        local_filename = 'tmp/'+url.rpartition('/')[2]
+        local_filename = self.fetch_url(url)
         self.csv = lz4Csv(local_filename)
 
         self.timebin = None
@@ -98,9 +106,6 @@ class Crawler(BaseCrawler):
         # Push links to IYP
         self.iyp.batch_add_links('DEPENDS_ON', links)
 
-        # Remove downloaded file
-        os.remove(local_filename)
-
 # Main program
 if __name__ == '__main__':
 
@@ -1,5 +1,4 @@
 import sys
-import os
 import logging
 import arrow
 import requests
@@ -7,6 +6,7 @@ import lz4.frame
 import csv
 from datetime import datetime, time, timezone
 from iyp import BaseCrawler
+from iyp.metrics import metrics
 
 # NOTE: Assumes ASNs and Prefixes are already registered in the database. Run
 # bgpkit.pfx2asn before this one
@@ -41,8 +41,8 @@ class lz4Csv:
 
 class Crawler(BaseCrawler):
 
-    def run(self):
-        """Fetch data from file and push to IYP. """
+    def latest_url(self):
+        """Return the URL of the latest file and its date."""
 
         today = arrow.utcnow()
         url = URL.format(year=today.year, month=today.month, day=today.day)
@@ -55,6 +55,19 @@ class Crawler(BaseCrawler):
                 today = today.shift(days=-1)
                 url = URL.format(year=today.year, month=today.month, day=today.day)
 
+        return url, today
+
+    def fetch(self):
+        """Download the latest file from IHR archive"""
+
+        url, _ = self.latest_url()
+        self.fetch_url(url)
+
+    def run(self):
+        """Read data from file and push to IYP. """
+
+        url, today = self.latest_url()
+
         self.reference = {
             'reference_org': ORG,
             'reference_url': url,
@@ -62,105 +75,76 @@ class Crawler(BaseCrawler):
             'reference_time': datetime.combine(today.date(), time.min, timezone.utc)
         }
 
-        os.makedirs('tmp/', exist_ok=True)
-        os.system(f'wget {url} -P tmp/')
-        
-        local_filename = 'tmp/'+url.rpartition('/')[2]
+        local_filename = self.fetch_url(url)
         self.csv = lz4Csv(local_filename)
 
-        logging.warning('Getting node IDs from neo4j...\n')
-        asn_id = self.iyp.batch_get_nodes('AS', 'asn')
-        prefix_id = self.iyp.batch_get_nodes('Prefix', 'prefix')
-        tag_id = self.iyp.batch_get_nodes('Tag', 'label')
-        country_id = self.iyp.batch_get_nodes('Country', 'country_code')
-
-        orig_links = []
-        tag_links = []
-        dep_links = []
-        country_links = []
-
-        logging.warning('Computing links...\n')
-        for line in  csv.reader(self.csv, quotechar='"', delimiter=',', skipinitialspace=True):
-            # header
-            # id,timebin,prefix,hege,af,visibility,rpki_status,irr_status, delegated_prefix_status,
-            #delegated_asn_status,descr,moas,asn_id,country_id,originasn_id
-
-            rec = dict( zip(self.csv.fields, line) )
-            rec['hege'] = float(rec['hege'])
-            rec['visibility'] = float(rec['visibility'])
-            rec['af'] = int(rec['af'])
-
-            prefix = rec['prefix']
-            if prefix not in prefix_id:
-                prefix_id[prefix] = self.iyp.get_node('Prefix', {'prefix': prefix}, create=True)
-
-            # make status/country/origin links only for lines where asn=originasn
-            if rec['asn_id'] == rec['originasn_id']:
-                # Make sure all nodes exist
-                originasn = int(rec['originasn_id'])
-                if originasn not in asn_id:
-                    asn_id[originasn] = self.iyp.get_node('AS', {'asn': originasn}, create=True)
-
-                rpki_status = 'RPKI '+rec['rpki_status']
-                if rpki_status not in tag_id:
-                    tag_id[rpki_status] = self.iyp.get_node('Tag', {'label': rpki_status}, create=True)
-
-                irr_status = 'IRR '+rec['irr_status']
-                if irr_status not in tag_id:
-                    tag_id[irr_status] = self.iyp.get_node('Tag', {'label': irr_status}, create=True)
-
-                cc = rec['country_id']
-                if cc not in country_id:
-                    country_id[cc] = self.iyp.get_node('Country', {'country_code': cc}, create=True)
-
-                # Compute links
-                orig_links.append( {
-                    'src_id': asn_id[originasn],
-                    'dst_id': prefix_id[prefix],
-                    'props': [self.reference, rec]
-                    } )
-
-                tag_links.append( {
-                    'src_id': prefix_id[prefix],
-                    'dst_id': tag_id[rpki_status],
+        # AS, Prefix, Country and Tag nodes are resolved (or merged) by neo4j
+        # when pushing links
+        with metrics.phase('parse'):
+            orig_links = []
+            tag_links = []
+            dep_links = []
+            country_links = []
+
+            logging.warning('Computing links...\n')
+            for line in  csv.reader(self.csv, quotechar='"', delimiter=',', skipinitialspace=True):
+                # header
+                # id,timebin,prefix,hege,af,visibility,rpki_status,irr_status, delegated_prefix_status,
+                #delegated_asn_status,descr,moas,asn_id,country_id,originasn_id
+
+                rec = dict( zip(self.csv.fields, line) )
+                rec['hege'] = float(rec['hege'])
+                rec['visibility'] = float(rec['visibility'])
+                rec['af'] = int(rec['af'])
+
+                prefix = ('Prefix', 'prefix', rec['prefix'])
+
+                # make status/country/origin links only for lines where asn=originasn
+                if rec['asn_id'] == rec['originasn_id']:
+                    rpki_status = 'RPKI '+rec['rpki_status']
+                    irr_status = 'IRR '+rec['irr_status']
+
+                    # Compute links
+                    orig_links.append( {
+                        'src': ('AS', 'asn', rec['originasn_id']),
+                        'dst': prefix,
+                        'props': [self.reference, rec]
+                        } )
+
+                    tag_links.append( {
+                        'src': prefix,
+                        'dst': ('Tag', 'label', rpki_status),
+                        'props': [self.reference, rec]
+                        } )
+
+                    tag_links.append( {
+                        'src': prefix,
+                        'dst': ('Tag', 'label', irr_status),
+                        'props': [self.reference, rec]
+                        } )
+
+                    country_links.append( {
+                        'src': prefix,
+                        'dst': ('Country', 'country_code', rec['country_id']),
+                        'props': [self.reference]
+                        } )
+
+                # Dependency links
+                dep_links.append( {
+                    'src': prefix,
+                    'dst': ('AS', 'asn', rec['asn_id']),
                     'props': [self.reference, rec]
                     } )
 
-                tag_links.append( {
-                    'src_id': prefix_id[prefix],
-                    'dst_id': tag_id[irr_status],
-                    'props': [self.reference, rec]
-                    } )
-
-                country_links.append( {
-                    'src_id': prefix_id[prefix],
-                    'dst_id': country_id[cc],
-                    'props': [self.reference]
-                    } )
 
-            # Dependency links
-            asn = int(rec['asn_id'])
-            if asn not in asn_id:
-                asn_id[asn] = self.iyp.get_node('AS', {'asn': asn}, create=True)
-
-            dep_links.append( {
-                'src_id': prefix_id[prefix],
-                'dst_id': asn_id[asn],
-                'props': [self.reference, rec]
-                } )
-
-
-        self.csv.close()
+            self.csv.close()
 
         # Push links to IYP
         logging.warning('Pushing links to neo4j...\n')
-        self.iyp.batch_add_links('ORIGINATE', orig_links)
-        self.iyp.batch_add_links('CATEGORIZED', tag_links)
-        self.iyp.batch_add_links('DEPENDS_ON', dep_links)
-        self.iyp.batch_add_links('COUNTRY', country_links)
-
-        # Remove downloaded file
-        os.remove(local_filename)
+        self.iyp.batch_add_links_by_key('ORIGINATE', orig_links)
+        self.iyp.batch_add_links_by_key('CATEGORIZED', tag_links)
+        self.iyp.batch_add_links_by_key('DEPENDS_ON', dep_links)
+        self.iyp.batch_add_links_by_key('COUNTRY', country_links)
 
 
 # Main program
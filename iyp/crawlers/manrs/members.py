@@ -1,8 +1,8 @@
 import sys
 import logging
-import requests
 from datetime import datetime, time, timezone
 from iyp import BaseCrawler
+from iyp.download import file_digest
 
 # URL to MANRS csv file
 URL = 'https://www.manrs.org/wp-json/manrs/v1/csv/4'
@@ -11,17 +11,11 @@ NAME = 'manrs.members'
 
 class Crawler(BaseCrawler):
     def __init__(self, organization, url, name):
-        """Fetch nodes for MANRS actions (create them if they are not in IYP).""" 
+        """Define MANRS actions, their nodes are fetched in run() so that
+        fetch() does not connect to IYP."""
     
-        # connect to IYP database
         super().__init__(organization, url, name)
 
-        self.manrs_qid = self.iyp.get_node(
-                                        'Organization',
-                                        { 'name': 'MANRS' },
-                                        create=True
-                                        )
-        
         # Actions defined by MANRS
         self.actions = [
               {
@@ -42,17 +36,6 @@ class Crawler(BaseCrawler):
               }
             ]
 
-        # Get the ID for the four items representing MANRS actions
-        for action in self.actions:
-            action['qid'] = self.iyp.get_node(
-                                            'ManrsAction',
-                                            {
-                                                'name': action['label'],
-                                                'description': action['description']
-                                            },
-                                            create=True
-                                           )
-
         # Reference information for data pushed to IYP
         self.reference = {
             'reference_name': NAME,
@@ -63,14 +46,39 @@ class Crawler(BaseCrawler):
 
 
 
+    def fetch(self):
+        """Download the MANRS csv file"""
+
+        return self.fetch_url(URL, 'manrs.csv')
+
     def run(self):
         """Fetch networks information from MANRS and push to wikibase. """
 
-        req = requests.get(URL)
-        if req.status_code != 200:
-            sys.exit('Error while fetching MANRS csv file')
+        path = self.fetch()
+        if self.skip_unchanged(file_digest(path)):
+            return
+
+        self.manrs_qid = self.iyp.get_node(
+                                        'Organization',
+                                        { 'name': 'MANRS' },
+                                        create=True
+                                        )
+
+        # Get the ID for the four items representing MANRS actions
+        for action in self.actions:
+            action['qid'] = self.iyp.get_node(
+                                            'ManrsAction',
+                                            {
+                                                'name': action['label'],
+                                                'description': action['description']
+                                            },
+                                            create=True
+                                           )
+
+        with open(path, encoding='utf-8') as fp:
+            lines = fp.read().splitlines()
 
-        for i, row in enumerate( req.text.splitlines() ):
+        for i, row in enumerate( lines ):
             # Skip the header
             if i == 0:
                 continue
@@ -92,7 +100,7 @@ class Crawler(BaseCrawler):
 
         # set countries
         for cc in areas.split(';'):
-            country_qid = self.iyp.get_node('Country', {'country_code': cc}, create=True)
+            country_qid = self.buffer.get_node('Country', {'country_code': cc}, create=True)
             statements.append([ 'COUNTRY', country_qid, self.reference])
 
         # set actions
@@ -104,8 +112,8 @@ class Crawler(BaseCrawler):
         for asn in asns.split(';'):
             if asn:     # ignore organizations with no ASN
                 # Get the AS QID (create if AS is not yet registered) and commit changes
-                as_qid = self.iyp.get_node('AS', {'asn': str(asn)}, create=True) 
-                self.iyp.add_links( as_qid, statements )
+                as_qid = self.buffer.get_node('AS', {'asn': str(asn)}, create=True) 
+                self.buffer.add_links( as_qid, statements )
         
 # Main program
 if __name__ == '__main__':
@@ -2,8 +2,9 @@ from collections import defaultdict
 import sys
 import math
 import logging
-import requests
 from iyp import BaseCrawler
+from iyp.download import file_digest
+from iyp.metrics import metrics
 
 # NOTE: this script is not adding new ASNs. It only adds links for existing ASNs
 # Should be run after crawlers that push many ASNs (e.g. ripe.as_names)
@@ -14,61 +15,69 @@ NAME = 'nro.delegated_stats'
 
 class Crawler(BaseCrawler):
 
+    def fetch(self):
+        """Download the delegated stat file from RIPE website"""
+
+        return self.fetch_url(URL)
+
     def run(self):
-        """Fetch the delegated stat file from RIPE website and process lines one by one"""
+        """Read the delegated stat file and process lines one by one"""
 
-        req = requests.get(URL)
-        if req.status_code != 200:
-            sys.exit('Error while fetching delegated file')
+        path = self.fetch()
+        if self.skip_unchanged(file_digest(path)):
+            return
 
-        asn_id = self.iyp.batch_get_nodes('AS', 'asn')
+        with metrics.phase('parse'):
+            with open(path, encoding='utf-8') as fp:
+                lines = fp.read().splitlines()
 
-        # Read delegated-stats file. see documentation:
-        # https://www.nro.net/wp-content/uploads/nro-extended-stats-readme5.txt
-        self.fields_name = ['registry', 'cc', 'type', 'start', 'value', 'date', 'status', 'opaque-id']
+            # Read delegated-stats file. see documentation:
+            # https://www.nro.net/wp-content/uploads/nro-extended-stats-readme5.txt
+            self.fields_name = ['registry', 'cc', 'type', 'start', 'value', 'date', 'status', 'opaque-id']
 
-        # Compute nodes
-        opaqueids = set()
-        prefixes = set()
-        countries = set()
+            # Compute nodes
+            opaqueids = set()
+            prefixes = set()
+            countries = set()
 
-        for line in req.text.splitlines():
-            # skip comments
-            if line.strip().startswith('#'):
-                continue
+            for line in lines:
+                # skip comments
+                if line.strip().startswith('#'):
+                    continue
 
-            # skip version and summary lines
-            fields_value = line.split('|')
-            if len(fields_value) < 8:
-                continue
+                # skip version and summary lines
+                fields_value = line.split('|')
+                if len(fields_value) < 8:
+                    continue
 
-            # parse records
-            rec = dict( zip(self.fields_name, fields_value))
-            rec['value'] = int(rec['value'])
+                # parse records
+                rec = dict( zip(self.fields_name, fields_value))
+                rec['value'] = int(rec['value'])
 
-            countries.add( rec['cc'] )
-            opaqueids.add( rec['opaque-id'] )
+                countries.add( rec['cc'] )
+                opaqueids.add( rec['opaque-id'] )
 
-            if rec['type'] == 'ipv4' or rec['type'] == 'ipv6':
-                # compute prefix length
-                prefix_len = rec['value']
-                if rec['type'] == 'ipv4':
-                    prefix_len = int(32-math.log2(rec['value']))
+                if rec['type'] == 'ipv4' or rec['type'] == 'ipv6':
+                    # compute prefix length
+                    prefix_len = rec['value']
+                    if rec['type'] == 'ipv4':
+                        prefix_len = int(32-math.log2(rec['value']))
 
-                prefix = f"{rec['start']}/{prefix_len}"
-                prefixes.add( prefix )
+                    prefix = f"{rec['start']}/{prefix_len}"
+                    prefixes.add( prefix )
 
         # Create all nodes
         logging.warning('Pushing nodes to neo4j...\n')
-        opaqueid_id = self.iyp.batch_get_nodes('OpaqueID', 'id', opaqueids)
-        prefix_id = self.iyp.batch_get_nodes('Prefix', 'prefix', prefixes)
-        country_id = self.iyp.batch_get_nodes('Country', 'country_code', countries)
+        asn_id = self.iyp.batch_get_nodes('AS', 'asn')
+        opaqueid_id = self.iyp.batch_get_nodes('OpaqueID', 'id', opaqueids, upsert=True)
+        prefix_id = self.iyp.batch_get_nodes('Prefix', 'prefix', prefixes, upsert=True)
+        country_id = self.iyp.batch_get_nodes('Country', 'country_code', countries, upsert=True)
 
         # Compute links
         country_links = []
         status_links = defaultdict(list)
         
-        for line in req.text.splitlines():
+        for line in lines:
             # skip comments
             if line.strip().startswith('#'):
                 continue
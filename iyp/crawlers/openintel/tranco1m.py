@@ -10,7 +10,6 @@ import tarfile
 import datetime
 import boto3
 import botocore
-import tempfile
 import pandas as pd
 import fastparquet
 import argparse
@@ -20,9 +19,6 @@ from iyp import BaseCrawler
 # OpenINTEL source: Forward DNS data set to use (e.g., tranco)
 SOURCE = 'tranco'
 
-TMP_DIR = './tmp'
-os.makedirs(TMP_DIR, exist_ok=True)
-
 URL = 'https://data.openintel.nl/data/tranco1m/'
 ORG = 'OpenINTEL'
 NAME = 'openintel.tranco1m'
@@ -37,7 +33,9 @@ def valid_date(s):
 class Crawler(BaseCrawler):
 
     def get_parquet(self):
-        """Fetch the forward DNS data, populate a data frame, and process lines one by one"""
+        """Download the forward DNS data and return the paths of the Parquet
+        files. Objects are listed with boto3 and downloaded through the
+        download cache from the public endpoint of the bucket."""
 
         # Get a boto3 resource
         S3A_OPENINTEL_ENDPOINT="https://object.openintel.nl"
@@ -85,6 +83,7 @@ class Crawler(BaseCrawler):
         today = today.shift(days=-1)
 
         # Iterate objects in bucket with given (source, date)-partition prefix
+        paths = []
         for i_obj in WAREHOUSE_BUCKET.objects.filter(
             # Build a partition path for the given source and date
             Prefix=os.path.join(
@@ -96,32 +95,34 @@ class Crawler(BaseCrawler):
             )
         ):
 
-            # Open a temporary file to download the Parquet object into
-            with tempfile.NamedTemporaryFile(mode="w+b", dir=TMP_DIR, prefix="{}.".format(today.date().isoformat()), suffix=".parquet", delete=True) as tempFile:
+            url = os.path.join(S3A_OPENINTEL_ENDPOINT, WAREHOUSE_BUCKET.name, i_obj.key)
+            fname = "{}.{}".format(today.date().isoformat(), i_obj.key.rpartition('/')[2])
+            paths.append(self.fetch_url(url, fname))
+            logging.info("Downloaded '{}' [{:.2f}MiB].".format(url, os.path.getsize(paths[-1]) / (1024*1024)))
+
+        return paths
+
+    def fetch(self):
+        """Download the Parquet files of the latest available day"""
 
-                print("Opened temporary file for object download: '{}'.".format(tempFile.name))
-                WAREHOUSE_BUCKET.download_fileobj(Key=i_obj.key, Fileobj=tempFile, Config=boto3.s3.transfer.TransferConfig(multipart_chunksize = 16*1024*1024))
-                print("Downloaded '{}' [{:.2f}MiB] into '{}'.".format(
-                    os.path.join(S3A_OPENINTEL_ENDPOINT, WAREHOUSE_BUCKET.name, i_obj.key),
-                    os.path.getsize(tempFile.name) / (1024*1024),
-                    tempFile.name
-                ))
-                # Use Pandas to read file into a DF and append to list
-                self.pandas_df_list.append(
-                    pd.read_parquet(tempFile.name, 
-                        engine="fastparquet", 
-                        columns=["query_name", "response_type", "ip4_address"])
-                )
+        attempt = 5
+        paths = []
+        while len(paths) == 0 and attempt > 0:
+            paths = self.get_parquet()
+            attempt -= 1
 
+        return paths
 
     def run(self):
         """Fetch the forward DNS data, populate a data frame, and process lines one by one"""
-        attempt = 5
-        self.pandas_df_list = [] # List of Parquet file-specific Pandas DataFrames
 
-        while len(self.pandas_df_list) == 0 and attempt > 0:
-            self.get_parquet()
-            attempt -= 1
+        # List of Parquet file-specific Pandas DataFrames
+        self.pandas_df_list = [
+                pd.read_parquet(path,
+                    engine="fastparquet",
+                    columns=["query_name", "response_type", "ip4_address"])
+                for path in self.fetch()
+                ]
 
         # Concatenate Parquet file-specific DFs
         pandas_df = pd.concat(self.pandas_df_list)
@@ -141,8 +142,8 @@ class Crawler(BaseCrawler):
         #sld_a_mappings.to_csv(args.out_file, sep=",", header=True, index=False)
         #print("Written results to '{}' [{:.2f}MiB].".format(args.out_file, os.path.getsize(args.out_file) / (1024 * 1024)))
 
-        domain_id = self.iyp.batch_get_nodes('DomainName', 'name', set(df['query_name']))
-        ip_id = self.iyp.batch_get_nodes('IP', 'ip', set(df['ip4_address']))
+        domain_id = self.iyp.batch_get_nodes('DomainName', 'name', set(df['query_name']), upsert=True)
+        ip_id = self.iyp.batch_get_nodes('IP', 'ip', set(df['ip4_address']), upsert=True)
 
         links = []
         for ind in df.index:
@@ -5,7 +5,6 @@ import logging
 import json
 import iso3166
 from iyp import BaseCrawler
-import requests_cache
 
 # NOTES This script should be executed after peeringdb.org
 
@@ -28,21 +27,20 @@ class Crawler(BaseCrawler):
         """Initialisation for pushing peeringDB facilities to IYP. """
 
         self.headers = {"Authorization": "Api-Key " + API_KEY}
-        self.requests = requests_cache.CachedSession(ORG)
 
         super().__init__(organization, url, name)
 
+    def fetch(self):
+        """Download facilities information from PeeringDB"""
+
+        return self.fetch_url(URL, 'fac.json', headers=self.headers)
     
     def run(self):
-        """Fetch facilities information from PeeringDB and push to IYP"""
+        """Read facilities information from PeeringDB and push to IYP"""
 
         sys.stderr.write('Fetching PeeringDB data...\n')
-        req = self.requests.get(URL, headers=self.headers)
-        if req.status_code != 200:
-            logging.error('Error while fetching peeringDB data')
-            raise Exception(f'Cannot fetch peeringdb data, status code={req.status_code}\n{req.text}')
-
-        facilities = json.loads(req.text)['data']
+        with open(self.fetch()) as fp:
+            facilities = json.load(fp)['data']
 
         # compute nodes
         facs = set()
@@ -63,11 +61,11 @@ class Crawler(BaseCrawler):
                 countries.add( fac['country'] )
 
         # push nodes
-        self.fac_id = self.iyp.batch_get_nodes('Facility', 'name', facs)
-        self.name_id = self.iyp.batch_get_nodes('Name', 'name', names)
-        self.website_id = self.iyp.batch_get_nodes('URL', 'url', websites)
-        self.country_id = self.iyp.batch_get_nodes('Country', 'country_code', countries)
-        self.facid_id = self.iyp.batch_get_nodes(FACID_LABEL, 'id', facids)
+        self.fac_id = self.iyp.batch_get_nodes('Facility', 'name', facs, upsert=True)
+        self.name_id = self.iyp.batch_get_nodes('Name', 'name', names, upsert=True)
+        self.website_id = self.iyp.batch_get_nodes('URL', 'url', websites, upsert=True)
+        self.country_id = self.iyp.batch_get_nodes('Country', 'country_code', countries, upsert=True)
+        self.facid_id = self.iyp.batch_get_nodes(FACID_LABEL, 'id', facids, upsert=True)
 
         # get organization nodes
         self.org_id = self.iyp.batch_get_node_extid(ORGID_LABEL)
@@ -2,7 +2,6 @@ import os
 import sys
 import logging
 import flatdict
-import requests_cache
 import json
 from datetime import datetime, time, timezone
 from iyp import BaseCrawler
@@ -64,12 +63,21 @@ class Crawler(BaseCrawler):
         # keep track of added networks
         self.nets = {}
 
-        # Using cached queries
-        self.requests = requests_cache.CachedSession(ORG)
-
         # connection to IYP database
         super().__init__(organization, url, name)
 
+    def fetch(self):
+        """Download ixs, ixlans and netfacs information from PeeringDB"""
+
+        for url, fname in [(URL_PDB_IXS, 'ix.json'), (URL_PDB_LANS, 'ixlan.json'), (URL_PDB_NETFAC, 'netfac.json')]:
+            self.fetch_url(url, fname, headers=self.headers)
+
+    def fetch_data(self, url, fname):
+        """Return the data downloaded from the given PeeringDB API url."""
+
+        with open(self.fetch_url(url, fname, headers=self.headers)) as fp:
+            return json.load(fp)['data']
+
     def run(self):
         """Fetch ixs information from PeeringDB and push to IYP. 
         Using multiple threads for better performances."""
@@ -79,24 +87,14 @@ class Crawler(BaseCrawler):
         self.fac_id = self.iyp.batch_get_node_extid(FACID_LABEL)
         self.country_id = self.iyp.batch_get_nodes('Country', 'country_code')
 
-        req = self.requests.get( URL_PDB_IXS, headers=self.headers)
-        if req.status_code != 200:
-            logging.error(f'Error while fetching IXs data\n({req.status_code}) {req.text}')
-            raise Exception(f'Cannot fetch peeringdb data, status code={req.status_code}\n{req.text}')
-
-        self.ixs = json.loads(req.text)['data']
+        self.ixs = self.fetch_data(URL_PDB_IXS, 'ix.json')
 
         # Register IXPs
         logging.warning('Pushing IXP info...')
         self.register_ixs()
         self.ix_id = self.iyp.batch_get_node_extid(IXID_LABEL)
 
-        req = self.requests.get( URL_PDB_LANS, headers=self.headers)
-        if req.status_code != 200:
-            logging.error(f'Error while fetching IXLANs data\n({req.status_code}) {req.text}')
-            raise Exception(f'Cannot fetch peeringdb data, status code={req.status_code}\n{req.text}')
-
-        ixlans = json.loads(req.text)['data']
+        ixlans = self.fetch_data(URL_PDB_LANS, 'ixlan.json')
         
         # index ixlans by their id
         self.ixlans = {}
@@ -108,12 +106,7 @@ class Crawler(BaseCrawler):
         self.iyp.commit()
                 
         # Link network to facilities
-        req = self.requests.get( URL_PDB_NETFAC, headers=self.headers)
-        if req.status_code != 200:
-            logging.error(f'Error while fetching IXLANs data\n({req.status_code}) {req.text}')
-            raise Exception(f'Cannot fetch peeringdb data, status code={req.status_code}\n{req.text}')
-
-        self.netfacs = json.loads(req.text)['data']
+        self.netfacs = self.fetch_data(URL_PDB_NETFAC, 'netfac.json')
         self.register_net_fac()
 
 
@@ -177,11 +170,11 @@ class Crawler(BaseCrawler):
 
 
         # TODO add the type PEERING_LAN? may break the unique constraint
-        self.prefix_id = self.iyp.batch_get_nodes('Prefix', 'prefix', prefixes)
-        self.name_id = self.iyp.batch_get_nodes('Name', 'name', net_names)
-        self.website_id = self.iyp.batch_get_nodes('URL', 'url', net_website)
-        self.netid_id = self.iyp.batch_get_nodes(NETID_LABEL, 'id', net_extid)
-        self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', net_asn)
+        self.prefix_id = self.iyp.batch_get_nodes('Prefix', 'prefix', prefixes, upsert=True)
+        self.name_id = self.iyp.batch_get_nodes('Name', 'name', net_names, upsert=True)
+        self.website_id = self.iyp.batch_get_nodes('URL', 'url', net_website, upsert=True)
+        self.netid_id = self.iyp.batch_get_nodes(NETID_LABEL, 'id', net_extid, upsert=True)
+        self.asn_id = self.iyp.batch_get_nodes('AS', 'asn', net_asn, upsert=True)
 
         # compute links
         prefix_links = []
@@ -264,10 +257,10 @@ class Crawler(BaseCrawler):
         all_ixs_id = set([ix['id'] for ix in self.ixs])
         all_ixs_name = set([ix['name'] for ix in self.ixs])
         all_ixs_website = set([ix['website'] for ix in self.ixs if ix['website']])
-        self.ixext_id = self.iyp.batch_get_nodes(IXID_LABEL, 'id', all_ixs_id)
-        self.ix_id = self.iyp.batch_get_nodes('IXP', 'name', all_ixs_name)
-        self.website_id = self.iyp.batch_get_nodes('URL', 'url', all_ixs_website)
-        self.name_id = self.iyp.batch_get_nodes('Name', 'name', all_ixs_name)
+        self.ixext_id = self.iyp.batch_get_nodes(IXID_LABEL, 'id', all_ixs_id, upsert=True)
+        self.ix_id = self.iyp.batch_get_nodes('IXP', 'name', all_ixs_name, upsert=True)
+        self.website_id = self.iyp.batch_get_nodes('URL', 'url', all_ixs_website, upsert=True)
+        self.name_id = self.iyp.batch_get_nodes('Name', 'name', all_ixs_name, upsert=True)
 
         # Compute links
         name_links = []
@@ -5,7 +5,6 @@ import logging
 import json
 import iso3166
 from iyp import BaseCrawler
-import requests_cache
 
 ORG = 'PeeringDB'
 
@@ -25,19 +24,19 @@ class Crawler(BaseCrawler):
         """Initialisation for pushing peeringDB organizations to IYP. """
 
         self.headers = {"Authorization": "Api-Key " + API_KEY}
-        self.requests = requests_cache.CachedSession(ORG)
 
         super().__init__(organization, url, name)
+
+    def fetch(self):
+        """Download organizations information from PeeringDB"""
+
+        return self.fetch_url(URL, 'org.json', headers=self.headers)
     
     def run(self):
-        """Fetch organizations information from PeeringDB and push to IYP"""
-
-        req = self.requests.get(URL, headers=self.headers)
-        if req.status_code != 200:
-            logging.error('Error while fetching peeringDB data')
-            raise Exception(f'Cannot fetch peeringdb data, status code={req.status_code}\n{req.text}')
+        """Read organizations information from PeeringDB and push to IYP"""
 
-        organizations = json.loads(req.text)['data']
+        with open(self.fetch()) as fp:
+            organizations = json.load(fp)['data']
 
         # compute nodes
         orgs = set()
@@ -58,11 +57,11 @@ class Crawler(BaseCrawler):
                 countries.add( org['country'] )
 
         # push nodes
-        self.org_id = self.iyp.batch_get_nodes('Organization', 'name', orgs)
-        self.name_id = self.iyp.batch_get_nodes('Name', 'name', names)
-        self.website_id = self.iyp.batch_get_nodes('URL', 'url', websites)
-        self.country_id = self.iyp.batch_get_nodes('Country', 'country_code', countries)
-        self.orgid_id = self.iyp.batch_get_nodes(ORGID_LABEL, 'id', orgids)
+        self.org_id = self.iyp.batch_get_nodes('Organization', 'name', orgs, upsert=True)
+        self.name_id = self.iyp.batch_get_nodes('Name', 'name', names, upsert=True)
+        self.website_id = self.iyp.batch_get_nodes('URL', 'url', websites, upsert=True)
+        self.country_id = self.iyp.batch_get_nodes('Country', 'country_code', countries, upsert=True)
+        self.orgid_id = self.iyp.batch_get_nodes(ORGID_LABEL, 'id', orgids, upsert=True)
 
         # compute links
         name_links = []
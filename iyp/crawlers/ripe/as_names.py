@@ -1,7 +1,8 @@
 import sys
 import logging
-import requests
 from iyp import BaseCrawler
+from iyp.download import file_digest
+from iyp.metrics import metrics
 
 URL = 'https://ftp.ripe.net/ripe/asnames/asn.txt'
 ORG = 'RIPE NCC'
@@ -9,34 +10,43 @@ NAME = 'ripe.as_names'
 
 class Crawler(BaseCrawler):
 
+    def fetch(self):
+        """Download the AS name file from RIPE website"""
+
+        self.fetch_url(URL)
+
     def run(self):
-        """Fetch the AS name file from RIPE website and process lines one by one"""
-
-        req = requests.get(URL)
-        if req.status_code != 200:
-            sys.exit('Error while fetching AS names')
-
-        lines = []
-        asns = set()
-        names = set()
-        countries = set()
-
-        # Read asn file  
-        for line in req.text.splitlines():
-            asn, _, name_cc = line.partition(' ')
-            name, _, cc = name_cc.rpartition(', ')
-            asn = int(asn)
-            lines.append([ asn, name, cc ])
-
-            asns.add( asn )
-            names.add( name )
-            countries.add( cc )
+        """Read the AS name file and process lines one by one"""
+
+        path = self.fetch_url(URL)
+        if self.skip_unchanged(file_digest(path)):
+            return
+
+        with metrics.phase('parse'):
+            with open(path, encoding='utf-8') as fp:
+                text = fp.read()
+
+            lines = []
+            asns = set()
+            names = set()
+            countries = set()
+
+            # Read asn file  
+            for line in text.splitlines():
+                asn, _, name_cc = line.partition(' ')
+                name, _, cc = name_cc.rpartition(', ')
+                asn = int(asn)
+                lines.append([ asn, name, cc ])
+
+                asns.add( asn )
+                names.add( name )
+                countries.add( cc )
             
 
         # get node IDs for ASNs, names, and countries 
-        asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns)
-        name_id = self.iyp.batch_get_nodes('Name', 'name', names)
-        country_id = self.iyp.batch_get_nodes('Country', 'country_code', countries)
+        asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns, upsert=True)
+        name_id = self.iyp.batch_get_nodes('Name', 'name', names, upsert=True)
+        country_id = self.iyp.batch_get_nodes('Country', 'country_code', countries, upsert=True)
 
         # Compute links
         name_links = []
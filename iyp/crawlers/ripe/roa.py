@@ -30,22 +30,35 @@ class Crawler(BaseCrawler):
 
         super().__init__(organization, url, name)
 
+    def fetch_roas(self, tal):
+        """Download the ROA file of the given TAL and return its local
+        path."""
+
+        self.url = f'{URL}/{tal}/{self.date_path}/roas.csv'
+        logging.info(f'Fetching ROA file: {self.url}')
+
+        # All files are named roas.csv
+        return self.fetch_url(self.url, f'{tal}.roas.csv')
+
+    def fetch(self):
+        """Download ROA files of all TALs"""
+
+        for tal in TALS:
+            self.fetch_roas(tal)
+
     def run(self):
-        """Fetch data from RIPE and push to IYP. """
+        """Read ROA files and push to IYP. """
 
         for tal in TALS:
 
-            self.url = f'{URL}/{tal}/{self.date_path}/roas.csv'
-            logging.info(f'Fetching ROA file: {self.url}')
-            req = requests.get( self.url )
-            if req.status_code != 200:
-                sys.exit('Error while fetching data for '+self.url)
-            
+            with open(self.fetch_roas(tal)) as fp:
+                lines = fp.read().splitlines()
+
             # Aggregate data per prefix
             asns = set()
 
             prefix_info = defaultdict(list)
-            for line in req.text.splitlines():
+            for line in lines:
                 url, asn, prefix, max_length, start, end = line.split(',')
                 
                 # Skip header
@@ -62,8 +75,8 @@ class Crawler(BaseCrawler):
                     'end': end})
 
             # get ASNs and prefixes IDs
-            asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns)
-            prefix_id = self.iyp.batch_get_nodes('Prefix', 'prefix', set(prefix_info.keys()))
+            asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns, upsert=True)
+            prefix_id = self.iyp.batch_get_nodes('Prefix', 'prefix', set(prefix_info.keys()), upsert=True)
 
             links = []
             for prefix, attributes in prefix_info.items():
@@ -1,6 +1,6 @@
 import sys
 import logging
-import requests
+from iyp.download import fetch_url
 from iyp.wiki.wikihandy import Wikihandy
 
 # URL to spamhaus data
@@ -53,14 +53,18 @@ class Crawler(object):
 
 
 
+    def fetch(self):
+        """Download the blocklist and return its local path."""
+
+        return fetch_url(self.url)
+
     def run(self):
-        """Fetch blocklist from Spamhaus and push to wikibase. """
+        """Read blocklist from Spamhaus and push to wikibase. """
 
-        req = requests.get(self.url)
-        if req.status_code != 200:
-            sys.exit('Error while fetching the blocklist')
+        with open(self.fetch()) as fp:
+            rows = fp.read().splitlines()
 
-        for i, row in enumerate( req.text.splitlines() ):
+        for i, row in enumerate( rows ):
             # Skip the header
             if row.startswith(';'):
                 continue
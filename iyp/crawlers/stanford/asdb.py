@@ -7,6 +7,8 @@ import bs4
 from bs4 import BeautifulSoup
 from datetime import datetime
 from iyp import BaseCrawler
+from iyp.download import file_digest
+from iyp.metrics import metrics
 
 def get_latest_asdb_dataset_url(asdb_stanford_data_url: str, file_name_format: str):
     response = requests.get(asdb_stanford_data_url)
@@ -25,37 +27,46 @@ ORG = 'Stanford'
 NAME = 'stanford.asdb'
 
 class Crawler(BaseCrawler):
+    def fetch(self):
+        """Download the latest ASdb file"""
+
+        return self.fetch_url(URL)
+
     def run(self):
         """Fetch the ASdb file and push it to IYP"""
 
-        req = requests.get(URL)
-        if req.status_code != 200:
-            sys.exit('Error while fetching ASdb')
+        path = self.fetch()
+        if self.skip_unchanged(file_digest(path)):
+            return
+
+        with metrics.phase('parse'):
+            with open(path, encoding='utf-8') as fp:
+                text = fp.read()
 
-        lines = []
-        asns = set()
-        categories = set()
+            lines = []
+            asns = set()
+            categories = set()
 
-        # Collect all ASNs and names
-        for line in  csv.reader(req.text.splitlines(), quotechar='"', delimiter=',', skipinitialspace=True):
-            if not line:
-                continue
+            # Collect all ASNs and names
+            for line in  csv.reader(text.splitlines(), quotechar='"', delimiter=',', skipinitialspace=True):
+                if not line:
+                    continue
 
-            if not line[0] or line[0] == 'ASN':
-                continue
+                if not line[0] or line[0] == 'ASN':
+                    continue
 
-            asn = int(line[0][2:])
-            cats = line[1:]
-            for category in cats:
-                if category:
-                    asns.add(asn)
-                    categories.add(category)
+                asn = int(line[0][2:])
+                cats = line[1:]
+                for category in cats:
+                    if category:
+                        asns.add(asn)
+                        categories.add(category)
 
-                    lines.append( [asn, category] )
+                        lines.append( [asn, category] )
 
         # get ASNs and names IDs
-        asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns)
-        category_id = self.iyp.batch_get_nodes('Tag', 'label', categories)
+        asn_id = self.iyp.batch_get_nodes('AS', 'asn', asns, upsert=True)
+        category_id = self.iyp.batch_get_nodes('Tag', 'label', categories, upsert=True)
 
         # Compute links
         links = []
@@ -1,9 +1,10 @@
 import sys
 import logging
-import requests
 from zipfile import ZipFile
 import io
 from iyp import BaseCrawler
+from iyp.download import file_digest
+from iyp.metrics import metrics
 
 # URL to Tranco top 1M
 URL = 'https://tranco-list.eu/top-1m.csv.zip'
@@ -12,35 +13,41 @@ NAME = 'tranco.top1m'
 
 class Crawler(BaseCrawler):
 
-    def run(self):
-        """Fetch Tranco top 1M and push to IYP. """
+    def fetch(self):
+        """Download the latest Tranco top 1M"""
 
-        self.tranco_qid = self.iyp.get_node('Ranking', {'name': f'Tranco top 1M'}, create=True)
+        self.fetch_url(URL)
+
+    def run(self):
+        """Read Tranco top 1M and push to IYP. """
 
         sys.stderr.write('Downloading latest list...\n')
-        req = requests.get(URL)
-        if req.status_code != 200:
-            sys.exit('Error while fetching Tranco csv file')
+        path = self.fetch_url(URL)
+        if self.skip_unchanged(file_digest(path)):
+            return
+
+        self.tranco_qid = self.iyp.get_node('Ranking', {'name': f'Tranco top 1M'}, create=True)
 
-        links = []
-        domains = set()
-        # open zip file and read top list
-        with  ZipFile(io.BytesIO(req.content)) as z:
-            with z.open('top-1m.csv') as list:
-                for i, row in enumerate(io.TextIOWrapper(list)):
-                    row = row.rstrip()
-                    rank, domain = row.split(',')
+        with metrics.phase('parse'):
+            links = []
+            domains = set()
+            # open zip file and read top list
+            with  ZipFile(path) as z:
+                with z.open('top-1m.csv') as list:
+                    for i, row in enumerate(io.TextIOWrapper(list)):
+                        row = row.rstrip()
+                        rank, domain = row.split(',')
 
-                    domains.add( domain )
-                    links.append( { 'src_name':domain, 'dst_id':self.tranco_qid, 'props':[self.reference, {'rank': int(rank)}] } )
+                        domains.add( domain )
+                        links.append( { 'src_name':domain, 'dst_id':self.tranco_qid, 'props':[{'rank': int(rank)}] } )
 
-        name_id = self.iyp.batch_get_nodes('DomainName', 'name', domains)
+        name_id = self.iyp.batch_get_nodes('DomainName', 'name', domains, upsert=True)
 
         for link in links:
-            link['src_id'] = name_id[link['src_name']]
+            link['src_id'] = name_id[link.pop('src_name')]
 
         # Push all links to IYP
-        self.iyp.batch_add_links('RANK', links)
+        self.iyp.batch_add_links('RANK', links, reference=self.reference)
         
 # Main program
 if __name__ == '__main__':
@@ -0,0 +1,258 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+import timeit
+from contextlib import contextmanager
+from urllib.parse import urlparse
+import requests
+from requests.adapters import HTTPAdapter, Retry
+from iyp.metrics import metrics
+
+# Maximum number of concurrent requests and minimum time (in seconds) between
+# the start of two requests for each upstream host
+HOST_LIMITS = {
+        'bgp.tools': (1, 1),
+        'www.peeringdb.com': (1, 3),
+        'peeringdb.com': (1, 3),
+        'api.cloudflare.com': (4, 0.25),
+        'ihr-archive.iijlab.net': (2, 0),
+        }
+DEFAULT_LIMIT = (4, 0)
+
+# Files fetched less than MAX_AGE seconds ago are not revalidated
+MAX_AGE = 12*3600
+
+# Location of the download cache, files not fetched for CACHE_TTL seconds are
+# removed by DownloadCache.prune()
+CACHE_DIR = './tmp/download_cache/'
+CACHE_TTL = 7*24*3600
+
+CHUNK_SIZE = 1024*1024
+
+
+class HostLimit(object):
+    """Limit the number of concurrent requests and the request rate to one
+    host."""
+
+    def __init__(self, concurrency, interval):
+        self.semaphore = threading.Semaphore(concurrency)
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.next_start = 0
+
+    @contextmanager
+    def slot(self):
+        """Wait until a request can be sent to the host."""
+
+        with self.semaphore:
+            with self.lock:
+                now = timeit.default_timer()
+                start = max(now, self.next_start)
+                self.next_start = start + self.interval
+
+            if start > now:
+                time.sleep(start - now)
+
+            yield
+
+
+_limits = {}
+_limits_lock = threading.Lock()
+_local = threading.local()
+
+
+def host_limit(url):
+    """Return the HostLimit for the host of the given URL."""
+
+    host = urlparse(url).hostname
+    with _limits_lock:
+        if host not in _limits:
+            _limits[host] = HostLimit(*HOST_LIMITS.get(host, DEFAULT_LIMIT))
+
+        return _limits[host]
+
+
+def session():
+    """Return the HTTP session of this thread, requests are retried on server
+    errors and rate limiting."""
+
+    if not hasattr(_local, 'session'):
+        retries = Retry(total=5,
+                        backoff_factor=0.5,
+                        status_forcelist=[ 429, 500, 502, 503, 504 ])
+        _local.session = requests.Session()
+        _local.session.mount('http://', HTTPAdapter(max_retries=retries))
+        _local.session.mount('https://', HTTPAdapter(max_retries=retries))
+
+    return _local.session
+
+
+class DownloadCache(object):
+    """Responses stored on disk and shared by all crawlers. Files are stored
+    once per content (named by their SHA-256), with metadata per URL giving
+    the file, its ETag and Last-Modified headers and when it was fetched.
+    Files older than max_age are revalidated with a conditional request, so
+    unchanged files are not downloaded again."""
+
+    def __init__(self, root=CACHE_DIR):
+        self.root = root
+        self.blob_dir = os.path.join(root, 'blobs')
+        self.meta_dir = os.path.join(root, 'meta')
+
+    def _meta_path(self, url, params, headers=None):
+        """Metadata file for the response to url with the given request
+        parameters and headers (e.g. an API key or Accept header may change
+        the response), header names are case insensitive."""
+
+        key = url
+        if params is not None:
+            key += json.dumps(params, sort_keys=True)
+        if headers:
+            key += json.dumps({name.lower(): value for name, value in headers.items()}, sort_keys=True)
+
+        return os.path.join(self.meta_dir, hashlib.sha1(key.encode()).hexdigest()+'.json')
+
+    def blob_path(self, digest):
+        return os.path.join(self.blob_dir, digest)
+
+    def get(self, url, params=None, headers=None):
+        """Return the metadata of the cached response for url, or None."""
+
+        meta_path = self._meta_path(url, params, headers)
+        if not os.path.exists(meta_path):
+            return None
+
+        with open(meta_path) as fp:
+            meta = json.load(fp)
+
+        if not os.path.exists(self.blob_path(meta['sha256'])):
+            return None
+
+        return meta
+
+    def put(self, url, params, meta, headers=None):
+        """Store the metadata of the response for url."""
+
+        os.makedirs(self.meta_dir, exist_ok=True)
+        meta_path = self._meta_path(url, params, headers)
+        with open(meta_path+'.tmp', 'w') as fp:
+            json.dump(meta, fp)
+        os.replace(meta_path+'.tmp', meta_path)
+
+    def fetch(self, url, headers=None, params=None, max_age=MAX_AGE):
+        """Return the path of the cached file for url, the file is downloaded
+        (or revalidated) if it is older than max_age seconds. Raise an
+        Exception if the server does not return the file."""
+
+        meta = self.get(url, params, headers)
+        if meta is not None and time.time() - meta['fetched'] < max_age:
+            logging.info(f'Download: using cached {url}')
+            return self.blob_path(meta['sha256'])
+
+        # Conditional headers are not part of the cache key
+        key_headers = headers
+        headers = dict(headers or {})
+        if meta is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+
+        os.makedirs(self.blob_dir, exist_ok=True)
+        tmp_path = os.path.join(self.blob_dir, f'tmp-{os.getpid()}-{threading.get_ident()}')
+
+        with metrics.phase('download'):
+            with host_limit(url).slot():
+                with session().get(url, headers=headers, params=params, stream=True) as req:
+                    if req.status_code == 304 and meta is not None:
+                        logging.info(f'Download: {url} not modified')
+                        meta['fetched'] = time.time()
+                        self.put(url, params, meta, key_headers)
+                        return self.blob_path(meta['sha256'])
+
+                    if req.status_code != 200:
+                        raise Exception(f'Cannot fetch {url}: {req.status_code}')
+
+                    size = 0
+                    digest = hashlib.sha256()
+                    with open(tmp_path, 'wb') as fp:
+                        for chunk in req.iter_content(CHUNK_SIZE):
+                            fp.write(chunk)
+                            digest.update(chunk)
+                            size += len(chunk)
+
+                    meta = {
+                            'url': url,
+                            'sha256': digest.hexdigest(),
+                            'etag': req.headers.get('ETag'),
+                            'last_modified': req.headers.get('Last-Modified'),
+                            'fetched': time.time(),
+                            }
+
+        # Identical content is stored once
+        blob_path = self.blob_path(meta['sha256'])
+        if os.path.exists(blob_path):
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, blob_path)
+        self.put(url, params, meta, key_headers)
+
+        metrics.count('bytes', size)
+        logging.info(f'Download: {url} ({size} bytes)')
+
+        return blob_path
+
+    def prune(self, max_age=CACHE_TTL):
+        """Remove files and metadata not fetched for max_age seconds."""
+
+        now = time.time()
+        for path in glob.glob(os.path.join(self.meta_dir, '*.json')):
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+
+        for path in glob.glob(os.path.join(self.blob_dir, '*')):
+            if now - os.path.getmtime(path) > max_age:
+                os.remove(path)
+
+
+def file_digest(path):
+    """SHA-256 of the given file, e.g. to fingerprint a crawler's input."""
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for chunk in iter(lambda: fp.read(CHUNK_SIZE), b''):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+# Cache used by fetch_url
+cache = DownloadCache()
+
+
+def fetch_url(url, path=None, headers=None, params=None, max_age=MAX_AGE):
+    """Fetch url through the download cache and return the path of the
+    file, which should not be modified. If path is given the file is also
+    linked (or copied) to path and path is returned."""
+
+    cached_path = cache.fetch(url, headers, params, max_age)
+    # Keep files that are still used
+    os.utime(cached_path)
+
+    if path is None:
+        return cached_path
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if os.path.exists(path):
+        os.remove(path)
+    try:
+        os.link(cached_path, path)
+    except OSError:
+        shutil.copyfile(cached_path, path)
+
+    return path
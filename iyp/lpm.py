@@ -0,0 +1,167 @@
+import ipaddress
+import logging
+import socket
+import numpy as np
+
+# Number of IP addresses resolved at once by PrefixMatcher.match
+CHUNK_SIZE = 100000
+
+
+def encode(version, packed):
+    """Numpy array of the given packed addresses (see socket.inet_pton).
+    IPv4 addresses are unsigned integers and IPv6 addresses 16-byte big endian
+    strings, both sort in address order."""
+
+    if version == 4:
+        return np.frombuffer(b''.join(packed), dtype='>u4').astype(np.uint64)
+
+    return np.frombuffer(b''.join(packed), dtype='S16')
+
+
+class PrefixMatcher(object):
+    """Longest prefix match of many IP addresses at once.
+
+    Prefixes of each address family are turned into sorted non-overlapping
+    intervals, each interval gives the node ID of the most specific prefix
+    covering it (or -1). The interval of an address is then found by binary
+    search with numpy.searchsorted. The enclosing prefix of each prefix is
+    also kept to find prefixes enclosing other prefixes (see enclosing())."""
+
+    def __init__(self, prefixes):
+        """Build the intervals for the given (prefix, node ID) pairs."""
+
+        # node ID -> prefix length, node ID -> ID of the enclosing prefix or -1
+        self.lengths = {}
+        self.parents = {}
+
+        networks = {4: [], 6: []}
+        for prefix, id in prefixes:
+            try:
+                net = ipaddress.ip_network(prefix, strict=False)
+            except ValueError:
+                logging.warning(f'PrefixMatcher: ignoring invalid prefix {prefix}')
+                continue
+
+            networks[net.version].append(
+                    (int(net.network_address), net.prefixlen, int(net.broadcast_address), id) )
+            self.lengths[id] = net.prefixlen
+
+        self.intervals = {}
+        for version, nets in networks.items():
+            self.intervals[version] = self._intervals(version, nets, self.parents)
+
+    @staticmethod
+    def _intervals(version, nets, parents):
+        """Return the start of each interval and the node ID of its most
+        specific prefix. When several intervals start at the same address the
+        last one is valid. The enclosing prefix of each prefix is set in
+        parents."""
+
+        max_address = 2**32-1 if version == 4 else 2**128-1
+
+        starts = [0]
+        ids = [-1]
+        # Prefixes covering the current address, most specific last
+        stack = []
+
+        def close(until):
+            # End prefixes finishing before until, the enclosing prefix
+            # applies again after them
+            while stack and stack[-1][0] < until:
+                end, _ = stack.pop()
+                if end < max_address:
+                    starts.append(end+1)
+                    ids.append(stack[-1][1] if stack else -1)
+
+        # Less specific prefixes first for the same start
+        for start, _, end, id in sorted(nets, key=lambda net: net[:2]):
+            close(start)
+            parents[id] = stack[-1][1] if stack else -1
+            starts.append(start)
+            ids.append(id)
+            stack.append((end, id))
+        close(max_address+1)
+
+        if version == 4:
+            starts = np.array(starts, dtype=np.uint64)
+        else:
+            starts = np.array([start.to_bytes(16, 'big') for start in starts], dtype='S16')
+
+        return starts, np.array(ids, dtype=np.int64)
+
+    def lookup(self, version, addresses):
+        """Return the node ID of the most specific prefix for each address
+        (encoded with encode()) or -1."""
+
+        starts, ids = self.intervals[version]
+        positions = np.searchsorted(starts, addresses, side='right') - 1
+
+        return ids[positions]
+
+    def enclosing(self, prefixes):
+        """Return the node IDs of all prefixes strictly enclosing any of the
+        given prefixes, that is prefixes with a shorter length covering
+        them."""
+
+        networks = {4: [], 6: []}
+        for prefix in prefixes:
+            try:
+                net = ipaddress.ip_network(prefix, strict=False)
+            except ValueError:
+                logging.warning(f'PrefixMatcher: ignoring invalid prefix {prefix}')
+                continue
+            networks[net.version].append(net)
+
+        enclosing = set()
+        for version, nets in networks.items():
+            if not nets:
+                continue
+
+            # Most specific prefix covering the first address of each prefix
+            covering = self.lookup(version, encode(version, [net.network_address.packed for net in nets]))
+            for net, id in zip(nets, covering.tolist()):
+                # Skip prefixes inside (or equal to) the given prefix
+                while id != -1 and self.lengths[id] >= net.prefixlen:
+                    id = self.parents[id]
+
+                while id != -1 and id not in enclosing:
+                    enclosing.add(id)
+                    id = self.parents[id]
+
+        return enclosing
+
+    def match(self, ips, chunk_size=CHUNK_SIZE):
+        """Find the most specific prefix of the given (IP address, node ID)
+        pairs. Results are yielded by chunks as two arrays, the node IDs of IP
+        addresses and the node IDs of their prefix. Addresses without prefix
+        are left out."""
+
+        chunk = []
+        for ip in ips:
+            chunk.append(ip)
+            if len(chunk) == chunk_size:
+                yield from self._match_chunk(chunk)
+                chunk = []
+
+        if chunk:
+            yield from self._match_chunk(chunk)
+
+    def _match_chunk(self, chunk):
+        packed = {4: [], 6: []}
+        ip_ids = {4: [], 6: []}
+        for ip, id in chunk:
+            version = 6 if ':' in ip else 4
+            try:
+                packed[version].append(socket.inet_pton(socket.AF_INET6 if version == 6 else socket.AF_INET, ip))
+            except (OSError, TypeError):
+                logging.warning(f'PrefixMatcher: ignoring invalid IP {ip}')
+                continue
+            ip_ids[version].append(id)
+
+        for version in [4, 6]:
+            if not packed[version]:
+                continue
+
+            prefix_ids = self.lookup(version, encode(version, packed[version]))
+            found = prefix_ids >= 0
+            yield np.array(ip_ids[version], dtype=np.int64)[found], prefix_ids[found]
@@ -0,0 +1,372 @@
+import logging
+from array import array
+from collections import defaultdict
+from iyp import NODE_CONSTRAINTS, NODE_CONSTRAINTS_LABELS, NODE_INDEXES, format_properties, format_value
+from iyp.metrics import metrics, timed
+
+
+class MemoryIYP(object):
+    """Drop-in replacement for IYP keeping the graph in memory, used to
+    measure the cost of crawlers without a database (IYP_BACKEND=memory).
+
+    Node IDs are positions in the node arrays. Links are stored in adjacency
+    arrays (source, destination and type of each link) with their properties
+    in a separate list. Nodes are found with hash indexes on properties with a
+    UNIQUE constraint, other indexes are built on first use. Changes are
+    applied immediately, commit() and rollback() do nothing."""
+
+    def __init__(self, name=None):
+        self.name = name
+
+        # label sets, nodes refer to them by position
+        self.label_sets = []
+        self.label_set_ids = {}
+
+        # nodes
+        self.node_labels = array('l')
+        self.node_props = []
+
+        # links
+        self.types = []
+        self.type_ids = {}
+        self.link_src = array('q')
+        self.link_dst = array('q')
+        self.link_type = array('l')
+        self.link_props = []
+
+        # (label, property) -> value -> node ID, for UNIQUE constraints
+        self.unique = {}
+        for label, constraints in NODE_CONSTRAINTS.items():
+            for prop_name, constraint in constraints.items():
+                if 'UNIQUE' in constraint:
+                    self.unique[(label, prop_name)] = {}
+        # (label, property) -> value -> list of node IDs
+        self.indexes = {}
+        for label, prop_names in NODE_INDEXES.items():
+            for prop_name in prop_names:
+                self._index(label, prop_name)
+
+        # (src, type, dst) -> link IDs, built on first merge
+        self.link_index = None
+        # compressed adjacency (offsets, link IDs) by source node, built on
+        # first call to neighbors
+        self.adjacency = None
+
+    def _label_set(self, labels):
+        labels = tuple(sorted(set(labels)))
+        label_set = self.label_set_ids.get(labels)
+        if label_set is None:
+            label_set = len(self.label_sets)
+            self.label_sets.append(labels)
+            self.label_set_ids[labels] = label_set
+
+        return label_set
+
+    def labels(self, node):
+        """Return the labels of the given node."""
+
+        return self.label_sets[self.node_labels[node]]
+
+    def _index(self, label, prop_name):
+        """Return the index for the given label and property, build it if
+        needed."""
+
+        key = (label, prop_name)
+        if key in self.unique:
+            return self.unique[key]
+
+        if key not in self.indexes:
+            index = defaultdict(list)
+            for node, prop in enumerate(self.node_props):
+                if prop_name in prop and label in self.labels(node):
+                    index[prop[prop_name]].append(node)
+            self.indexes[key] = index
+
+        return self.indexes[key]
+
+    def _find(self, label, prop_name, value):
+        """Return the ID of a node with the given label and property value or
+        None."""
+
+        found = self._index(label, prop_name).get(value)
+        if isinstance(found, list):
+            return found[-1] if len(found) else None
+
+        return found
+
+    def _update_indexes(self, node, labels, prop):
+        for label in labels:
+            for prop_name, value in prop.items():
+                key = (label, prop_name)
+                if key in self.unique:
+                    self.unique[key][value] = node
+                elif key in self.indexes:
+                    self.indexes[key][value].append(node)
+
+    def _create_node(self, labels, prop):
+        node = len(self.node_props)
+        self.node_labels.append(self._label_set(labels))
+        self.node_props.append(dict(prop))
+        self._update_indexes(node, self.labels(node), prop)
+
+        return node
+
+    def _set_node(self, node, labels, prop):
+        """Add labels and properties to an existing node."""
+
+        labels = set(labels).union(self.labels(node))
+        self.node_labels[node] = self._label_set(labels)
+        self.node_props[node].update(prop)
+        self._update_indexes(node, labels, prop)
+
+    def commit(self):
+        metrics.count('transactions')
+
+    def rollback(self):
+        logging.warning('MemoryIYP: changes are not rolled back')
+
+    @timed('nodes')
+    def batch_get_nodes(self, type, prop_name, prop_set=set(), all=True, upsert=False):
+        """Same as IYP.batch_get_nodes for in-memory nodes."""
+
+        index = self._index(type, prop_name)
+
+        ids = {}
+        if all and not upsert:
+            for value in index:
+                node = self._find(type, prop_name, value)
+                if node is not None:
+                    ids[value] = node
+
+        for value in prop_set:
+            node = self._find(type, prop_name, value)
+            if node is None:
+                node = self._create_node([type], {prop_name: value})
+            ids[value] = node
+
+        return ids
+
+    @timed('nodes')
+    def get_node(self, type, prop, create=False):
+        """Same as IYP.get_node for in-memory nodes."""
+
+        prop = format_properties(prop)
+        labels = [type] if isinstance(type, str) else type
+
+        has_constraints = NODE_CONSTRAINTS_LABELS.intersection(labels)
+        if create and len(has_constraints):
+            # Find node on the constraints and set other values
+            label = sorted(has_constraints)[0]
+            constraint_prop = dict([ (c, prop[c]) for c in NODE_CONSTRAINTS[label].keys() ])
+            node = self._match(label, constraint_prop)
+            if node is None:
+                return self._create_node(labels, prop)
+
+            self._set_node(node, labels, prop)
+            return node
+
+        node = self._match(labels, prop)
+        if node is None and create:
+            node = self._create_node(labels, prop)
+
+        return node
+
+    def _match(self, labels, prop):
+        """Return a node with all the given labels and properties or None."""
+
+        labels = [labels] if isinstance(labels, str) else labels
+        if len(prop) == 0:
+            raise ValueError('MemoryIYP cannot match nodes without properties')
+
+        prop_name, value = sorted(prop.items())[0]
+        candidates = self._index(labels[0], prop_name).get(value)
+        if candidates is None:
+            return None
+        if isinstance(candidates, int):
+            candidates = [candidates]
+
+        for node in reversed(candidates):
+            node_prop = self.node_props[node]
+            if set(labels).issubset(self.labels(node)) and all(
+                    node_prop.get(key) == val for key, val in prop.items()):
+                return node
+
+        return None
+
+    @timed('nodes')
+    def batch_get_node_extid(self, id_type):
+        """Same as IYP.batch_get_node_extid for in-memory nodes."""
+
+        ids = {}
+        type_id = self.type_ids.get('EXTERNAL_ID')
+        for link, link_type in enumerate(self.link_type):
+            if link_type == type_id and id_type in self.labels(self.link_dst[link]):
+                ids[self.node_props[self.link_dst[link]].get('id')] = self.link_src[link]
+
+        return ids
+
+    @timed('nodes')
+    def get_node_extid(self, id_type, id):
+        """Same as IYP.get_node_extid for in-memory nodes."""
+
+        return self.batch_get_node_extid(id_type).get(id)
+
+    @timed('nodes')
+    def batch_get_ranked_nodes(self, type, prop_name, max_rank):
+        """Same as IYP.batch_get_ranked_nodes for in-memory nodes."""
+
+        ids = {}
+        type_id = self.type_ids.get('RANK')
+        for link, link_type in enumerate(self.link_type):
+            if link_type != type_id or self.link_props[link].get('rank', max_rank) >= max_rank:
+                continue
+
+            src, dst = self.link_src[link], self.link_dst[link]
+            if type in self.labels(src) and 'Ranking' in self.labels(dst) and prop_name in self.node_props[src]:
+                ids[self.node_props[src][prop_name]] = src
+
+        return ids
+
+    def get_dataset(self, name):
+        """Same as IYP.get_dataset for in-memory nodes."""
+
+        node = self._find('Dataset', 'name', name)
+        if node is None:
+            return None
+
+        return dict(self.node_props[node])
+
+    def set_dataset(self, props):
+        """Same as IYP.set_dataset for in-memory nodes."""
+
+        self.get_node('Dataset', props, create=True)
+
+    def reuse_dataset(self, name):
+        """Same as IYP.reuse_dataset, in-memory nodes are kept."""
+
+        pass
+
+    def _type_id(self, type):
+        type_id = self.type_ids.get(type)
+        if type_id is None:
+            type_id = len(self.types)
+            self.types.append(type)
+            self.type_ids[type] = type_id
+
+        return type_id
+
+    def _create_link(self, src, type_id, dst, prop):
+        link = len(self.link_props)
+        self.link_src.append(src)
+        self.link_dst.append(dst)
+        self.link_type.append(type_id)
+        self.link_props.append(prop)
+
+        if self.link_index is not None:
+            self.link_index[(src, type_id, dst)].append(link)
+        self.adjacency = None
+
+        return link
+
+    def _links_between(self, src, type_id, dst):
+        """Return the IDs of links of the given type from src to dst."""
+
+        if self.link_index is None:
+            self.link_index = defaultdict(list)
+            for link, key in enumerate(zip(self.link_src, self.link_type, self.link_dst)):
+                self.link_index[key].append(link)
+
+        return self.link_index.get((src, type_id, dst), [])
+
+    def _add_link(self, type_id, action, src, dst, prop):
+        """Create, merge or upsert one link (see IYP.batch_add_links)."""
+
+        if action == 'merge':
+            links = self._links_between(src, type_id, dst) or self._links_between(dst, type_id, src)
+        elif action == 'upsert':
+            links = [ link for link in self._links_between(src, type_id, dst)
+                     if self.link_props[link].get('reference_name') == prop.get('reference_name') ]
+        else:
+            links = []
+
+        if len(links):
+            self.link_props[links[0]].update(prop)
+        else:
+            self._create_link(src, type_id, dst, prop)
+
+    @timed('links')
+    def batch_add_links(self, type, links, action='create', reference=None):
+        """Same as IYP.batch_add_links for in-memory nodes."""
+
+        type_id = self._type_id(type)
+        for link in links:
+            prop = dict(reference) if reference is not None else {}
+            for p in link['props']:
+                prop.update(p)
+
+            if action == 'upsert' and 'reference_name' not in prop:
+                raise ValueError('reference_name is required to upsert links')
+
+            self._add_link(type_id, action, link['src_id'], link['dst_id'], prop)
+
+        metrics.count('rows', len(links))
+
+    @timed('links')
+    def batch_add_links_by_key(self, type, links, action='create', reference=None):
+        """Same as IYP.batch_add_links_by_key for in-memory nodes."""
+
+        id_links = []
+        for link in links:
+            ends = []
+            for end in [link['src'], link['dst']]:
+                if not isinstance(end, int):
+                    label, prop_name, value = end
+                    end = self.get_node(label, {prop_name: format_value(prop_name, value)}, create=True)
+                ends.append(end)
+
+            id_links.append( {'src_id': ends[0], 'dst_id': ends[1], 'props': link['props']} )
+
+        self.batch_add_links(type, id_links, action, reference)
+
+    @timed('links')
+    def add_links(self, src_node, links):
+        """Same as IYP.add_links for in-memory nodes, identical links are
+        created once."""
+
+        for (type, dst_node, prop) in links:
+
+            assert 'reference_org' in prop
+            assert 'reference_url' in prop
+            assert 'reference_name' in prop
+            assert 'reference_time' in prop
+
+            prop = format_properties(prop)
+            type_id = self._type_id(type)
+            if not any(self.link_props[link] == prop for link in self._links_between(src_node, type_id, dst_node)):
+                self._create_link(src_node, type_id, dst_node, prop)
+
+        metrics.count('rows', len(links))
+
+    def neighbors(self, node, type=None):
+        """Return (link type, destination node, properties) for links starting
+        at the given node."""
+
+        if self.adjacency is None:
+            # compressed sparse rows: links of node n are at positions
+            # offsets[n] to offsets[n+1] of link_ids
+            order = sorted(range(len(self.link_src)), key=self.link_src.__getitem__)
+            offsets = array('q', [0]*(len(self.node_props)+1))
+            for src in self.link_src:
+                offsets[src+1] += 1
+            for i in range(len(self.node_props)):
+                offsets[i+1] += offsets[i]
+            self.adjacency = (offsets, array('q', order))
+
+        offsets, link_ids = self.adjacency
+        return [ (self.types[self.link_type[link]], self.link_dst[link], self.link_props[link])
+                for link in link_ids[offsets[node]:offsets[node+1]]
+                if type is None or self.types[self.link_type[link]] == type ]
+
+    def close(self):
+        logging.warning(f'MemoryIYP: {len(self.node_props)} nodes and {len(self.link_props)} '
+                        f'links created by {self.name}')
@@ -0,0 +1,247 @@
+import functools
+import inspect
+import json
+import resource
+import threading
+import timeit
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Time (in seconds) between two samples of the resident set size
+RSS_INTERVAL = 0.5
+
+
+class Metrics(object):
+    """Timing and counters collected while building the database, grouped by
+    crawler (or post-processing script). Time is recorded per phase:
+    download, parse, nodes (node resolution), links (link push), post
+    (post-processing) and other (time of the crawler not spent in other
+    phases). Counters are rows pushed, transactions committed and bytes
+    fetched.
+
+    IYP records nodes and links phases and counters, crawlers can record
+    download and parse phases with phase() and fetched bytes with
+    count('bytes', ...). Metrics are recorded for the crawler given to
+    start(), or to crawler() in the current thread."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.current = 'unknown'
+        self.local = threading.local()
+        self.crawlers = {}
+        self.starts = {}
+        self.samplers = {}
+
+    def _crawler(self, name):
+        if name not in self.crawlers:
+            self.crawlers[name] = {
+                    'status': None,
+                    'time': defaultdict(float),
+                    'counters': defaultdict(int),
+                    }
+
+        return self.crawlers[name]
+
+    def start(self, name):
+        """Start recording metrics for the given crawler."""
+
+        with self.lock:
+            self.current = name
+            self._crawler(name)
+            self.starts[name] = timeit.default_timer()
+            self.samplers[name] = RSSSampler()
+
+    def end(self, name, status='OK'):
+        """Stop recording metrics for the given crawler."""
+
+        with self.lock:
+            crawler = self._crawler(name)
+            total = timeit.default_timer() - self.starts.pop(name, timeit.default_timer())
+            crawler['status'] = str(status)
+            crawler['total_time'] = total
+            crawler['time']['other'] = max(total - sum(crawler['time'].values()), 0)
+            crawler['rows_per_second'] = crawler['counters']['rows'] / total if total else 0
+            # Worker processes run several crawlers and keep part of the
+            # memory of previous crawlers, peak_rss is the peak of the
+            # process during the crawler and rss_growth its increase over
+            # the size of the process when the crawler started
+            sampler = self.samplers.pop(name, None)
+            if sampler is not None:
+                crawler['peak_rss'] = sampler.stop()
+                crawler['rss_growth'] = crawler['peak_rss'] - sampler.start
+            else:
+                crawler['peak_rss'] = peak_rss()
+            self.current = 'unknown'
+
+    def _current(self):
+        return getattr(self.local, 'name', None) or self.current
+
+    @contextmanager
+    def crawler(self, name):
+        """Record metrics of the current thread for the given crawler in the
+        with block, e.g. when fetching data of several crawlers in
+        threads."""
+
+        self.local.name = name
+        try:
+            yield
+        finally:
+            self.local.name = None
+
+    @contextmanager
+    def phase(self, phase):
+        """Record the time spent in the with block for the given phase."""
+
+        start = timeit.default_timer()
+        try:
+            yield
+        finally:
+            self.add_time(phase, timeit.default_timer() - start)
+
+    def add_time(self, phase, seconds):
+        with self.lock:
+            self._crawler(self._current())['time'][phase] += seconds
+
+    def count(self, counter, value=1):
+        with self.lock:
+            self._crawler(self._current())['counters'][counter] += value
+
+    def merge(self, name, crawler):
+        """Add metrics of a crawler recorded in another process, crawler is
+        its entry in that process's summary(). Time and counters already
+        recorded in this process for the crawler (e.g. by prefetching its
+        data) are added up."""
+
+        with self.lock:
+            entry = dict(crawler,
+                         time=defaultdict(float, crawler['time']),
+                         counters=defaultdict(int, crawler['counters']))
+
+            if name in self.crawlers:
+                for phase, seconds in self.crawlers[name]['time'].items():
+                    entry['time'][phase] += seconds
+                for counter, value in self.crawlers[name]['counters'].items():
+                    entry['counters'][counter] += value
+
+            self.crawlers[name] = entry
+
+    def summary(self):
+        """Return all metrics in a dictionary."""
+
+        with self.lock:
+            return {
+                    'peak_rss': peak_rss(),
+                    'crawlers': json.loads(json.dumps(self.crawlers)),
+                    }
+
+    def write_json(self, fname):
+        with open(fname, 'w') as fp:
+            json.dump(self.summary(), fp, indent=4)
+
+    def write_prometheus(self, fname):
+        """Write metrics in the Prometheus textfile format."""
+
+        summary = self.summary()
+        lines = []
+
+        def metric(name, help, samples):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} gauge')
+            for labels, value in samples:
+                labels = ','.join([ f'{key}="{val}"' for key, val in labels.items() ])
+                lines.append(f'{name}{{{labels}}} {value}')
+
+        crawlers = summary['crawlers']
+        metric('iyp_phase_seconds', 'Time spent per crawler and phase',
+               [ ({'crawler': name, 'phase': phase}, seconds)
+                for name, crawler in crawlers.items()
+                for phase, seconds in crawler['time'].items() ])
+        metric('iyp_crawler_seconds', 'Total time per crawler',
+               [ ({'crawler': name}, crawler.get('total_time', 0)) for name, crawler in crawlers.items() ])
+        metric('iyp_crawler_ok', 'Whether the crawler ended without error',
+               [ ({'crawler': name}, int(crawler['status'] == 'OK')) for name, crawler in crawlers.items() ])
+        for counter, help in [('rows', 'Rows pushed'), ('transactions', 'Transactions committed'), ('bytes', 'Bytes fetched')]:
+            metric(f'iyp_{counter}_total', f'{help} per crawler',
+                   [ ({'crawler': name}, crawler['counters'].get(counter, 0)) for name, crawler in crawlers.items() ])
+        metric('iyp_rows_per_second', 'Rows pushed per second per crawler',
+               [ ({'crawler': name}, crawler.get('rows_per_second', 0)) for name, crawler in crawlers.items() ])
+        metric('iyp_peak_rss_bytes', 'Peak resident set size of the worker process during each crawler',
+               [ ({'crawler': name}, crawler.get('peak_rss', 0)) for name, crawler in crawlers.items() ])
+        metric('iyp_rss_growth_bytes', 'Peak resident set size during each crawler minus the size when it started',
+               [ ({'crawler': name}, crawler.get('rss_growth', 0)) for name, crawler in crawlers.items() ])
+
+        with open(fname, 'w') as fp:
+            fp.write('\n'.join(lines)+'\n')
+
+
+def peak_rss():
+    """Peak resident set size (in bytes) of this process and its children."""
+
+    # ru_maxrss is given in kilobytes on Linux
+    return 1024 * max(
+            resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            )
+
+
+def current_rss():
+    """Resident set size (in bytes) of this process, or its peak if the
+    current size is not available."""
+
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        return peak_rss()
+
+
+class RSSSampler(object):
+    """Sample the resident set size of this process in a thread and keep the
+    largest value, until stop() is called. start is the size when sampling
+    started."""
+
+    def __init__(self, interval=RSS_INTERVAL):
+        self.start = current_rss()
+        self.peak = self.start
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._sample, args=(interval,), daemon=True)
+        self.thread.start()
+
+    def _sample(self, interval):
+        while not self.stopped.wait(interval):
+            self.peak = max(self.peak, current_rss())
+
+    def stop(self):
+        """Stop sampling and return the peak resident set size in bytes."""
+
+        self.stopped.set()
+        self.thread.join()
+
+        return max(self.peak, current_rss())
+
+
+def timed(phase):
+    """Decorator recording the time spent in a function (or coroutine) for
+    the given phase."""
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with metrics.phase(phase):
+                    return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with metrics.phase(phase):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+# Metrics of this process
+metrics = Metrics()
@@ -0,0 +1,174 @@
+from array import array
+from bisect import bisect_left
+from collections.abc import Mapping
+
+
+class NodeIDMap(Mapping):
+    """Compact mapping from property values to node IDs, used for the results
+    of IYP.batch_get_nodes. Integer values (e.g. ASNs) are stored in a sorted
+    array('q') and string values (e.g. prefixes or domain names) in a single
+    UTF-8 buffer with an array of offsets. Node IDs are stored in an
+    array('q'). Lookups are binary searches.
+
+    Values of another type, or added with [] after finish(), are kept in a
+    regular dictionary."""
+
+    def __init__(self):
+        self.kind = None
+        self.keys_int = array('q')
+        self.keys_str = bytearray()
+        self.offsets = array('q', [0])
+        self.ids = array('q')
+        self.is_sorted = True
+        self.extra = {}
+
+    @classmethod
+    def from_items(cls, items):
+        """Build a NodeIDMap from an iterable of (value, node ID)."""
+
+        ids = cls()
+        for key, id in items:
+            ids.append(key, id)
+        ids.finish()
+
+        return ids
+
+    def _kind(self, key):
+        if isinstance(key, int) and not isinstance(key, bool):
+            return int
+        if isinstance(key, str):
+            return str
+        return None
+
+    def append(self, key, id):
+        """Add a value, values should be appended (preferably in increasing
+        order) before calling finish()."""
+
+        kind = self._kind(key)
+        if kind is None or (self.kind is not None and kind != self.kind):
+            self.extra[key] = id
+            return
+
+        self.kind = kind
+        if kind is int:
+            if self.is_sorted and len(self.keys_int) and key <= self.keys_int[-1]:
+                self.is_sorted = False
+            self.keys_int.append(key)
+        else:
+            encoded = key.encode()
+            if self.is_sorted and len(self.ids) and encoded <= self.keys_str[self.offsets[-2]:]:
+                self.is_sorted = False
+            self.keys_str += encoded
+            self.offsets.append(len(self.keys_str))
+
+        self.ids.append(id)
+
+    def _key_str(self, i):
+        return self.keys_str[self.offsets[i]:self.offsets[i+1]]
+
+    def finish(self):
+        """Sort values appended in a different order."""
+
+        if self.is_sorted:
+            return
+
+        if self.kind is int:
+            order = sorted(range(len(self.ids)), key=self.keys_int.__getitem__)
+            self.keys_int = array('q', (self.keys_int[i] for i in order))
+        else:
+            order = sorted(range(len(self.ids)), key=self._key_str)
+            keys_str = bytearray()
+            offsets = array('q', [0])
+            for i in order:
+                keys_str += self._key_str(i)
+                offsets.append(len(keys_str))
+            self.keys_str = keys_str
+            self.offsets = offsets
+
+        self.ids = array('q', (self.ids[i] for i in order))
+        self.is_sorted = True
+
+    def _find(self, key):
+        """Return the position of the given value in the arrays or -1."""
+
+        kind = self._kind(key)
+        if kind is None or kind != self.kind:
+            return -1
+
+        if kind is int:
+            pos = bisect_left(self.keys_int, key)
+            if pos < len(self.keys_int) and self.keys_int[pos] == key:
+                return pos
+            return -1
+
+        encoded = key.encode()
+        lo, hi = 0, len(self.ids)
+        while lo < hi:
+            mid = (lo+hi)//2
+            if self._key_str(mid) < encoded:
+                lo = mid+1
+            else:
+                hi = mid
+
+        if lo < len(self.ids) and self._key_str(lo) == encoded:
+            return lo
+        return -1
+
+    def __getitem__(self, key):
+        pos = self._find(key)
+        if pos >= 0:
+            return self.ids[pos]
+
+        return self.extra[key]
+
+    def __setitem__(self, key, id):
+        pos = self._find(key)
+        if pos >= 0:
+            self.ids[pos] = id
+        else:
+            self.extra[key] = id
+
+    def __contains__(self, key):
+        return self._find(key) >= 0 or key in self.extra
+
+    def __len__(self):
+        return len(self.ids) + len(self.extra)
+
+    def __iter__(self):
+        for key, _ in self.items():
+            yield key
+
+    def items(self):
+        """Iterate over (value, node ID) pairs."""
+
+        if self.kind is int:
+            yield from zip(self.keys_int, self.ids)
+        elif self.kind is str:
+            for i, id in enumerate(self.ids):
+                yield self._key_str(i).decode(), id
+
+        yield from self.extra.items()
+
+    def values(self):
+        yield from self.ids
+        yield from self.extra.values()
+
+    def copy(self):
+        """Return a copy that can be modified independently."""
+
+        ids = NodeIDMap()
+        ids.kind = self.kind
+        ids.keys_int = array('q', self.keys_int)
+        ids.keys_str = bytearray(self.keys_str)
+        ids.offsets = array('q', self.offsets)
+        ids.ids = array('q', self.ids)
+        ids.is_sorted = self.is_sorted
+        ids.extra = dict(self.extra)
+
+        return ids
+
+    def update(self, other):
+        """Add all (value, node ID) pairs of other."""
+
+        for key, id in other.items():
+            self[key] = id
@@ -1,38 +1,81 @@
 import sys
 import logging
 from iyp import BasePostProcess
-import radix
+from iyp.lpm import PrefixMatcher
+from iyp.nodeids import NodeIDMap
+
+# Property set on prefixes once IPs have been linked to them
+MARK = 'lpm_processed'
 
 class PostProcess(BasePostProcess):
     def run(self):
-        """Fetch all IP and Prefix nodes, then link IPs to their most specific prefix."""
-
-        # Get all prefixes in a radix trie
-        prefix_id = self.iyp.batch_get_nodes('Prefix', 'prefix')
-
-        rtree = radix.Radix()
-        for prefix, prefix_qid in prefix_id.items():
-            rnode = rtree.add(prefix,)
-            rnode.data['id'] = prefix_qid
-
-        # Get all IP nodes
-        ip_id = self.iyp.batch_get_nodes('IP', 'ip')
-
-        # Compute links
-        links = []
-        for ip, ip_qid in  ip_id.items():
-            if ip:
-                rnode = rtree.search_best(ip)
-
-                if rnode:
-                    links.append( {
-                        'src_id': ip_qid,
-                        'dst_id': rnode.data['id'],
-                        'props': [self.reference]
-                        })
-
-        # push links to IYP
-        self.iyp.batch_add_links('PART_OF', links)
+        """Link IPs to their most specific prefix. Only IPs without prefix and
+        IPs whose best prefix may have changed are processed: prefixes are
+        marked once processed, and IPs linked to a prefix that encloses a new
+        (unmarked) prefix are linked again."""
+
+        # Get all prefixes as intervals for longest prefix match
+        old_prefixes = []
+        new_prefixes = []
+        for node in self.iyp._run(f"""MATCH (pfx:Prefix) WHERE pfx.prefix IS NOT NULL
+                RETURN pfx.prefix AS prefix, ID(pfx) AS _id, pfx.{MARK} IS NOT NULL AS processed"""):
+            if node['processed']:
+                old_prefixes.append( (node['prefix'], node['_id']) )
+            else:
+                new_prefixes.append( (node['prefix'], node['_id']) )
+        matcher = PrefixMatcher(old_prefixes + new_prefixes)
+
+        # Old prefixes enclosing new prefixes, their IPs may now belong to a
+        # new prefix
+        enclosing = set()
+        if old_prefixes and new_prefixes:
+            old_matcher = PrefixMatcher(old_prefixes)
+            enclosing = old_matcher.enclosing( prefix for prefix, _ in new_prefixes )
+        logging.info(f'{len(new_prefixes)} new prefixes, {len(enclosing)} enclosing prefixes')
+
+        # IPs without prefix
+        ip_id = NodeIDMap.from_items( (node['ip'], node['_id']) for node in self.iyp._run(
+            "MATCH (ip:IP) WHERE NOT (ip)-[:PART_OF]->(:Prefix) RETURN ip.ip AS ip, ID(ip) AS _id") )
+
+        # IPs linked to an enclosing prefix, with their current link
+        current = {}
+        for node in self.iyp._run("""MATCH (ip:IP)-[l:PART_OF]->(pfx:Prefix) WHERE ID(pfx) IN $ids
+                RETURN ip.ip AS ip, ID(ip) AS _id, ID(pfx) AS prefix_id, ID(l) AS link_id""", ids=list(enclosing)):
+            ip_id[node['ip']] = node['_id']
+            current[node['_id']] = (node['prefix_id'], node['link_id'])
+
+        # Compute and push links by chunks of IPs
+        nb_links = 0
+        stale_links = []
+        for ip_qids, prefix_qids in matcher.match( (ip, qid) for ip, qid in ip_id.items() if ip ):
+            links = []
+            for ip_qid, prefix_qid in zip(ip_qids.tolist(), prefix_qids.tolist()):
+                if ip_qid in current:
+                    current_prefix_qid, link_id = current[ip_qid]
+                    if current_prefix_qid == prefix_qid:
+                        continue
+                    stale_links.append(link_id)
+
+                links.append( {'src_id': ip_qid, 'dst_id': prefix_qid, 'props': []} )
+
+            self.iyp.batch_add_links('PART_OF', links, action='upsert', reference=self.reference)
+            nb_links += len(links)
+
+        # Remove links to prefixes that are not the most specific anymore
+        self.iyp._push_batches("""WITH $batch AS batch
+            UNWIND batch AS link_id
+            MATCH ()-[l:PART_OF]->()
+            WHERE ID(l) = link_id
+            DELETE l""", stale_links)
+
+        logging.info(f'Linked {nb_links} IPs to their prefix, {len(stale_links)} links removed')
+
+        # Mark new prefixes as processed
+        self.iyp._push_batches(f"""WITH $batch AS batch
+            UNWIND batch AS prefix_id
+            MATCH (pfx:Prefix)
+            WHERE ID(pfx) = prefix_id
+            SET pfx.{MARK} = true""", [ qid for _, qid in new_prefixes ])
 
 
 if __name__ == '__main__':
@@ -0,0 +1,180 @@
+import importlib
+import logging
+import timeit
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from iyp.metrics import metrics
+
+
+def check_dependencies(names, dependencies):
+    """Check that dependencies (name -> list of names that should run before)
+    only refer to the given names and have no cycle. Raise an Exception
+    otherwise."""
+
+    for name, deps in dependencies.items():
+        for dep in [name] + list(deps):
+            if dep not in names:
+                raise Exception(f'Unknown crawler in dependencies: {dep}')
+
+    # Depth-first search for cycles
+    state = {}
+
+    def visit(name, path):
+        if state.get(name) == 'done':
+            return
+        if state.get(name) == 'visiting':
+            raise Exception(f"Dependency cycle: {' -> '.join(path + [name])}")
+
+        state[name] = 'visiting'
+        for dep in dependencies.get(name, []):
+            visit(dep, path + [name])
+        state[name] = 'done'
+
+    for name in names:
+        visit(name, [])
+
+
+def critical_path(durations, dependencies):
+    """Return the chain of dependent tasks with the longest total duration
+    and this duration."""
+
+    longest = {}
+
+    def path(name):
+        if name not in longest:
+            best = ([], 0)
+            for dep in dependencies.get(name, []):
+                if dep in durations and path(dep)[1] > best[1]:
+                    best = path(dep)
+            longest[name] = (best[0] + [name], best[1] + durations[name])
+
+        return longest[name]
+
+    return max((path(name) for name in durations), key=lambda item: item[1], default=([], 0))
+
+
+def run_crawler(module_name):
+    """Run the crawler of the given module (in a worker process) and return
+    its status and metrics."""
+
+    name = module_name.replace('iyp.crawlers.', '')
+    metrics.start(name)
+    try:
+        module = importlib.import_module(module_name)
+        logging.warning(f'start {module}')
+        crawler = module.Crawler(module.ORG, module.URL, name)
+        crawler.run()
+        crawler.close()
+        status = 'OK'
+        logging.warning(f'end {module}')
+
+    except Exception as e:
+        logging.exception('crawler crashed!!')
+        status = repr(e)
+
+    metrics.end(name, status)
+
+    return status, metrics.summary()['crawlers'][name]
+
+
+def fetch_crawler(module_name):
+    """Call fetch() of the crawler of the given module, unless its data
+    depends on other crawlers (see BaseCrawler.prefetch). Metrics are recorded
+    for the crawler."""
+
+    name = module_name.replace('iyp.crawlers.', '')
+    module = importlib.import_module(module_name)
+    if not module.Crawler.prefetch:
+        return
+
+    with metrics.crawler(name):
+        crawler = module.Crawler(module.ORG, module.URL, name)
+        try:
+            crawler.fetch()
+        finally:
+            crawler.close()
+
+
+def prefetch(names, workers):
+    """Call fetch() of all crawlers concurrently, requests to each host are
+    limited by iyp.download. Failures are logged only, crawlers fetch missing
+    files again in run()."""
+
+    start = timeit.default_timer()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(fetch_crawler, name): name for name in names}
+        for future, name in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logging.warning(f'cannot prefetch {name}: {e}')
+
+    logging.warning(f'Prefetched data in {timeit.default_timer()-start:.0f}s')
+
+
+class Scheduler(object):
+    """Run tasks in a process pool, a task starts once all the tasks it
+    depends on are done. Tasks are started in the given order when several are
+    ready. A task is not run if one of its dependencies failed, its result is
+    then an Exception. failed(result) tells if a task failed, by default if it
+    raised an exception."""
+
+    def __init__(self, dependencies={}, parallelism=1, failed=None):
+        self.dependencies = dependencies
+        self.parallelism = parallelism
+        self.failed = failed if failed is not None else lambda result: isinstance(result, Exception)
+        self.durations = {}
+
+    def run(self, names, func, on_done=None):
+        """Run func(name) for all names and return their results. on_done is
+        called in this process with the name and result of each task when it
+        ends."""
+
+        check_dependencies(names, self.dependencies)
+
+        results = {}
+        pending = list(names)
+        running = {}
+        starts = {}
+
+        with ProcessPoolExecutor(max_workers=self.parallelism) as pool:
+            while pending or running:
+                # Start tasks whose dependencies are done, skip tasks whose
+                # dependencies failed
+                for name in list(pending):
+                    deps = self.dependencies.get(name, [])
+                    failed = [ dep for dep in deps if dep in results and self.failed(results[dep]) ]
+                    if failed:
+                        pending.remove(name)
+                        logging.error(f'{name} skipped, {failed[0]} failed')
+                        results[name] = Exception(f'dependency {failed[0]} failed')
+                        if on_done is not None:
+                            on_done(name, results[name])
+                        continue
+
+                    if len(running) >= self.parallelism:
+                        continue
+                    if all(dep in results for dep in deps):
+                        pending.remove(name)
+                        starts[name] = timeit.default_timer()
+                        running[pool.submit(func, name)] = name
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    self.durations[name] = timeit.default_timer() - starts[name]
+                    try:
+                        results[name] = future.result()
+                    except Exception as e:
+                        logging.error(f'{name} failed: {e}')
+                        results[name] = e
+
+                    if on_done is not None:
+                        on_done(name, results[name])
+
+        path, duration = critical_path(self.durations, self.dependencies)
+        logging.warning(f"Critical path ({duration:.0f}s): {' -> '.join(path)}")
+
+        return results
@@ -0,0 +1,709 @@
+import glob
+import logging
+import os
+import shutil
+import sys
+from collections import defaultdict
+from datetime import datetime, timezone
+import fastparquet
+import pandas as pd
+from iyp import IYP, NODE_CONSTRAINTS, NODE_CONSTRAINTS_LABELS, format_properties, format_value, params2str
+from iyp.staging import decode_props, encode_props
+
+# Files written by each crawler in its spool directory. The nodes file is
+# written last, a spool is complete once it exists.
+NODES_FNAME = 'nodes.parquet'
+LINKS_FNAME = 'links.parquet'
+# State of the crawler's dataset (see BaseCrawler.skip_unchanged), written
+# before the nodes file
+DATASET_FNAME = 'dataset.json'
+
+# Number of links per row group, links are written and loaded by row group
+ROW_GROUP_SIZE = 500000
+
+COMPRESSION = 'ZSTD'
+
+# Link properties that change every day without the data changing, they are
+# ignored when comparing spools
+IGNORED_PROPS = ['reference_time', 'reference_url']
+
+
+def spool_path(root, name, date=None):
+    """Return the spool directory for the given crawler and day (today by
+    default)."""
+
+    if date is None:
+        date = datetime.now(timezone.utc).strftime('%Y-%m-%d')
+
+    return os.path.join(root, date, name)
+
+
+class SpoolNodeMap(dict):
+    """Node handles returned by SpoolIYP.batch_get_nodes(all=True). Nodes in
+    the database are unknown when spooling, existing nodes are the ones
+    spooled by this crawler or by complete spools of other crawlers of the
+    same day (see SpoolIYP.spooled_values). These nodes are found, not
+    created, when the spool is loaded."""
+
+    def __init__(self, spool, type, prop_name):
+        super().__init__()
+        self.spool = spool
+        self.type = type
+        self.prop_name = prop_name
+        self.known = None
+
+    def _known(self):
+        if self.known is None:
+            self.known = self.spool.spooled_values(self.type, self.prop_name)
+
+        return self.known
+
+    def __missing__(self, value):
+        if value not in self._known():
+            raise KeyError(value)
+
+        handle = self.spool._handle(self.type, {self.prop_name: value}, create=False)
+        self[value] = handle
+
+        return handle
+
+    def __contains__(self, value):
+        return super().__contains__(value) or value in self._known()
+
+    def get(self, value, default=None):
+        try:
+            return self[value]
+        except KeyError:
+            return default
+
+
+class SpoolIYP(object):
+    """Drop-in replacement for IYP that records nodes and links in parquet
+    files (one directory per crawler and day) instead of writing to neo4j.
+    Spools are loaded into neo4j with load(), possibly in another process
+    while the next crawlers are running, and can be loaded again without
+    fetching data.
+
+    Nodes are referenced by handles (integers) in crawlers."""
+
+    def __init__(self, root, name):
+
+        self.root = root
+        self.path = spool_path(root, name)
+        logging.debug(f'SpoolIYP: spooling data in {self.path}')
+
+        # Remove data spooled by a previous run of this crawler
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+
+        self.handles = {}
+        self.nodes = []
+
+        # links not written yet
+        self.links = []
+        # identical links given to add_links are written once
+        self.seen_links = set()
+        # external IDs spooled by this crawler: id_type -> id -> handle
+        self.extids = defaultdict(dict)
+        # previous spool used instead of this one (see reuse_dataset)
+        self.reused = None
+
+    def _handle(self, type, prop, create=True):
+        """Return the handle for the given node."""
+
+        labels = type if isinstance(type, str) else ';'.join(type)
+        key = (labels, encode_props(prop))
+
+        handle = self.handles.get(key)
+        if handle is None:
+            handle = len(self.nodes)
+            self.nodes.append([labels, key[1], create])
+            self.handles[key] = handle
+        elif create:
+            self.nodes[handle][2] = True
+
+        return handle
+
+    def _add_link(self, type, action, src, dst, ref, prop):
+        """Record one link, ref and prop are encoded properties."""
+
+        self.links.append((type, action, src, dst, ref, prop))
+
+        if type == 'EXTERNAL_ID':
+            labels, dst_prop, _ = self.nodes[dst]
+            dst_prop = decode_props(dst_prop)
+            if 'id' in dst_prop:
+                self.extids[labels][dst_prop['id']] = src
+
+        if len(self.links) >= ROW_GROUP_SIZE:
+            self._write_links()
+
+    def _write_links(self):
+        """Append pending links to the links file."""
+
+        if len(self.links) == 0:
+            return
+
+        df = pd.DataFrame(self.links, columns=['type', 'action', 'src', 'dst', 'ref', 'props'])
+        fname = os.path.join(self.path, LINKS_FNAME)
+        fastparquet.write(fname, df, compression=COMPRESSION, write_index=False,
+                          append=os.path.exists(fname))
+
+        self.links = []
+
+    def commit(self):
+        """Write pending links."""
+
+        self._write_links()
+
+    def rollback(self):
+        """Discard links not written yet."""
+
+        self.links = []
+
+    def batch_get_nodes(self, type, prop_name, prop_set=set(), all=True, upsert=False):
+        """Same as IYP.batch_get_nodes but returns handles of spooled nodes.
+        With all=True any value has a handle (see SpoolNodeMap)."""
+
+        if all and not upsert:
+            ids = SpoolNodeMap(self, type, prop_name)
+        else:
+            ids = {}
+
+        for val in prop_set:
+            ids[val] = self._handle(type, {prop_name: val})
+
+        return ids
+
+    def get_node(self, type, prop, create=False):
+        """Same as IYP.get_node but returns handles of spooled nodes. Nodes
+        that are not created are looked up when the spool is loaded."""
+
+        return self._handle(type, format_properties(prop), create)
+
+    def _other_spools(self):
+        """Iterate over complete spools of other crawlers of the same day."""
+
+        for path in glob.glob(os.path.join(os.path.dirname(self.path), '*')):
+            if path != self.path and os.path.exists(os.path.join(path, NODES_FNAME)):
+                yield path
+
+    def _previous_spools(self, name):
+        """Return complete spools of the given crawler from previous days,
+        latest first."""
+
+        paths = [ path for path in glob.glob(os.path.join(self.root, '*', name))
+                 if path != self.path and os.path.exists(os.path.join(path, NODES_FNAME)) ]
+
+        return sorted(paths, reverse=True)
+
+    def spooled_values(self, type, prop_name):
+        """Return the values of the given property for nodes of the given type
+        spooled by this crawler or by complete spools of other crawlers of the
+        same day."""
+
+        values = set()
+        node_keys = [ key for key in self.handles ]
+        for path in self._other_spools():
+            nodes = fastparquet.ParquetFile(os.path.join(path, NODES_FNAME)).to_pandas()
+            node_keys.extend(zip(nodes['labels'], nodes['props']))
+
+        for labels, prop in node_keys:
+            if labels == type:
+                prop = decode_props(prop)
+                if prop_name in prop:
+                    values.add(prop[prop_name])
+
+        return values
+
+    def batch_get_node_extid(self, id_type):
+        """Same as IYP.batch_get_node_extid for external IDs spooled by this
+        crawler or by complete spools of other crawlers of the same day."""
+
+        ids = {}
+        for path in self._other_spools():
+            nodes = fastparquet.ParquetFile(os.path.join(path, NODES_FNAME)).to_pandas()
+            for df in iter_links(path):
+                for src, dst in zip(df['src'][df['type'] == 'EXTERNAL_ID'], df['dst'][df['type'] == 'EXTERNAL_ID']):
+                    if nodes['labels'][dst] != id_type:
+                        continue
+
+                    # Copy the node to this spool
+                    labels, prop, create = nodes.iloc[src]
+                    handle = self._handle(labels.split(';'), decode_props(prop), create)
+                    ids[decode_props(nodes['props'][dst])['id']] = handle
+
+        ids.update(self.extids[id_type])
+
+        return ids
+
+    def get_node_extid(self, id_type, id):
+        """Same as IYP.get_node_extid but for spooled nodes."""
+
+        return self.batch_get_node_extid(id_type).get(id)
+
+    def batch_get_ranked_nodes(self, type, prop_name, max_rank):
+        """Same as IYP.batch_get_ranked_nodes for RANK links spooled by
+        complete spools of other crawlers of the same day."""
+
+        ids = {}
+        for path in self._other_spools():
+            nodes = fastparquet.ParquetFile(os.path.join(path, NODES_FNAME)).to_pandas()
+            for df in iter_links(path):
+                ranks = df[df['type'] == 'RANK']
+                for src, dst, ref, prop in zip(ranks['src'], ranks['dst'], ranks['ref'], ranks['props']):
+                    if nodes['labels'][src] != type or nodes['labels'][dst] != 'Ranking':
+                        continue
+
+                    rank = dict(decode_props(ref), **decode_props(prop)).get('rank')
+                    if rank is None or rank >= max_rank:
+                        continue
+
+                    value = decode_props(nodes['props'][src]).get(prop_name)
+                    if value is not None:
+                        ids[value] = self._handle(type, {prop_name: value}, create=False)
+
+        return ids
+
+    def get_dataset(self, name):
+        """Spools may be loaded in any database, return the properties of the
+        Dataset node written in the state file of the latest complete spool of
+        the given crawler instead, or None."""
+
+        for path in self._previous_spools(name)[:1]:
+            fname = os.path.join(path, DATASET_FNAME)
+            if os.path.exists(fname):
+                with open(fname) as fp:
+                    return decode_props(fp.read())
+
+        return None
+
+    def set_dataset(self, props):
+        """Write the state file of the spool, and spool the Dataset node
+        unless the previous spool is reused."""
+
+        with open(os.path.join(self.path, DATASET_FNAME), 'w') as fp:
+            fp.write(encode_props(format_properties(props)))
+
+        if self.reused is None:
+            self.get_node('Dataset', props, create=True)
+
+    def reuse_dataset(self, name):
+        """Use the latest spool of the given crawler (see get_dataset) as
+        today's spool. Its files are linked to this spool when it is
+        closed."""
+
+        self.reused = self._previous_spools(name)[0]
+        logging.warning(f'SpoolIYP: reusing {self.reused}')
+
+        # Discard links already spooled today
+        self.links = []
+        if os.path.exists(os.path.join(self.path, LINKS_FNAME)):
+            os.remove(os.path.join(self.path, LINKS_FNAME))
+
+    def batch_add_links(self, type, links, action='create', reference=None):
+        """Same as IYP.batch_add_links but links are spooled."""
+
+        ref, links = IYP._split_shared_props(links, reference)
+        ref = encode_props(ref)
+
+        for link in links:
+            prop = {}
+            for p in link['props']:
+                prop.update(p)
+
+            self._add_link(type, action, link['src_id'], link['dst_id'], ref, encode_props(prop))
+
+    def batch_add_links_by_key(self, type, links, action='create', reference=None):
+        """Same as IYP.batch_add_links_by_key but links are spooled."""
+
+        id_links = []
+        for link in links:
+            ends = []
+            for end in [link['src'], link['dst']]:
+                if not isinstance(end, int):
+                    label, prop_name, value = end
+                    end = self._handle(label, {prop_name: format_value(prop_name, value)})
+                ends.append(end)
+
+            id_links.append( {'src_id': ends[0], 'dst_id': ends[1], 'props': link['props']} )
+
+        self.batch_add_links(type, id_links, action, reference)
+
+    def add_links(self, src_node, links):
+        """Same as IYP.add_links but links are spooled."""
+
+        empty = encode_props({})
+        for (type, dst_node, prop) in links:
+
+            assert 'reference_org' in prop
+            assert 'reference_url' in prop
+            assert 'reference_name' in prop
+            assert 'reference_time' in prop
+
+            prop = encode_props(format_properties(prop))
+            if (type, src_node, dst_node, prop) in self.seen_links:
+                continue
+
+            self.seen_links.add( (type, src_node, dst_node, prop) )
+            # IYP.add_links merges links on all their properties, these
+            # links are written the same way when the spool is loaded
+            self._add_link(type, 'add', src_node, dst_node, empty, prop)
+
+    def close(self):
+        """Write pending links and nodes, the spool is then complete."""
+
+        if self.reused is not None:
+            # Nodes file last
+            for fname in [LINKS_FNAME, NODES_FNAME]:
+                if os.path.exists(os.path.join(self.reused, fname)):
+                    _link_file(os.path.join(self.reused, fname), os.path.join(self.path, fname))
+            return
+
+        self._write_links()
+
+        df = pd.DataFrame(self.nodes, columns=['labels', 'props', 'create'])
+        fastparquet.write(os.path.join(self.path, NODES_FNAME), df,
+                          compression=COMPRESSION, write_index=False)
+
+
+def _link_file(src, dst):
+    """Hard link src to dst, or copy it if links are not supported."""
+
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
+
+
+def iter_links(path):
+    """Iterate over row groups (DataFrames) of links spooled in path."""
+
+    fname = os.path.join(path, LINKS_FNAME)
+    if not os.path.exists(fname):
+        return
+
+    yield from fastparquet.ParquetFile(fname).iter_row_groups()
+
+
+def _resolve_query(labels, keys, create):
+    """Query finding, or merging if create is True, a batch of nodes with
+    the given labels and property keys. Nodes are merged as in IYP.get_node,
+    on the constrained properties if one of the labels has constraints."""
+
+    type_str = ':'.join(labels)
+    constrained = sorted(NODE_CONSTRAINTS_LABELS.intersection(labels))
+
+    if create and len(constrained):
+        label = constrained[0]
+        clause = f"""MERGE (a:{label} {params2str(NODE_CONSTRAINTS[label].keys(), 'item.prop')})
+            SET a += item.prop, a:{type_str}"""
+    elif create:
+        clause = f"MERGE (a:{type_str} {params2str(keys, 'item.prop')})"
+    else:
+        clause = f"MATCH (a:{type_str} {params2str(keys, 'item.prop')})"
+
+    return f"""WITH $batch AS batch
+        UNWIND batch AS item
+            {clause}
+            RETURN item.handle AS handle, ID(a) AS _id"""
+
+
+def _resolve_nodes(iyp, nodes):
+    """Find or create spooled nodes and return their IDs indexed by
+    handle."""
+
+    ids = [None] * len(nodes)
+
+    # Nodes identified by a unique property are upserted, or found if they
+    # are not created, in batches. Other nodes are found or merged in
+    # batches of nodes with the same labels and property keys.
+    keyed = defaultdict(list)
+    lookups = defaultdict(list)
+    others = defaultdict(list)
+    for handle, (labels, prop, create) in enumerate(zip(nodes['labels'], nodes['props'], nodes['create'])):
+        prop = decode_props(prop)
+
+        if ';' not in labels and len(prop) == 1:
+            prop_name, value = next(iter(prop.items()))
+            if 'UNIQUE' in NODE_CONSTRAINTS.get(labels, {}).get(prop_name, set()):
+                (keyed if create else lookups)[(labels, prop_name)].append( (handle, value) )
+                continue
+
+        others[(labels, tuple(sorted(prop)), bool(create))].append( {'handle': handle, 'prop': prop} )
+
+    for (label, prop_name), values in keyed.items():
+        node_ids = iyp.batch_get_nodes(label, prop_name, set(value for _, value in values), upsert=True)
+        for handle, value in values:
+            ids[handle] = node_ids[value]
+
+    for (label, prop_name), values in lookups.items():
+        match_query, _ = IYP._nodes_queries(label, prop_name, all=False)
+        node_ids = { node[prop_name]: node['_id'] for node in
+                    iyp._run(match_query, list_prop=list(set(value for _, value in values))) }
+        for handle, value in values:
+            ids[handle] = node_ids.get(value)
+
+    def add_ids(records):
+        for record in records:
+            ids[record['handle']] = record['_id']
+
+    for (labels, keys, create), items in others.items():
+        iyp._push_batches(_resolve_query(labels.split(';'), keys, create), items, add_ids)
+
+    return ids
+
+
+def _push_links(iyp, groups):
+    """Write links grouped by (type, action, ref). Links spooled by add_links
+    (action 'add') are merged on all their properties with IYP.add_links, as
+    they were when spooled, other links with IYP.batch_add_links."""
+
+    for (type, action, ref), links in groups.items():
+        if action != 'add':
+            iyp.batch_add_links(type, links, action, reference=decode_props(ref))
+            continue
+
+        by_src = defaultdict(list)
+        for link in links:
+            by_src[link['src_id']].append( [type, link['dst_id'], link['props'][0]] )
+
+        for src_id, src_links in by_src.items():
+            iyp.add_links(src_id, src_links)
+
+
+def load(path, iyp=None):
+    """Load the spool of one crawler into IYP. A new IYP client is used (and
+    closed) if iyp is not given."""
+
+    if not os.path.exists(os.path.join(path, NODES_FNAME)):
+        raise Exception(f'Incomplete spool {path}')
+
+    close = iyp is None
+    if iyp is None:
+        iyp = IYP()
+
+    logging.warning(f'Spool: loading {path}')
+    nodes = fastparquet.ParquetFile(os.path.join(path, NODES_FNAME)).to_pandas()
+    ids = _resolve_nodes(iyp, nodes)
+
+    for df in iter_links(path):
+        # Links sharing the same reference are pushed together
+        groups = defaultdict(list)
+        for type, action, src, dst, ref, prop in zip(df['type'], df['action'],
+                df['src'], df['dst'], df['ref'], df['props']):
+
+            if ids[src] is None or ids[dst] is None:
+                logging.error(f'Spool: missing node for {type} link in {path}')
+                continue
+
+            groups[(type, action, ref)].append(
+                    {'src_id': ids[src], 'dst_id': ids[dst], 'props': [decode_props(prop)]} )
+
+        _push_links(iyp, groups)
+
+    if close:
+        iyp.close()
+
+
+def _spooled_links(path):
+    """Return the nodes of the spool in path and its links indexed by
+    (type, source node, destination node), where nodes are given by their
+    labels and encoded properties."""
+
+    nodes = fastparquet.ParquetFile(os.path.join(path, NODES_FNAME)).to_pandas()
+    node_keys = list(zip(nodes['labels'], nodes['props']))
+
+    links = defaultdict(list)
+    for df in iter_links(path):
+        for type, action, src, dst, ref, prop in zip(df['type'], df['action'],
+                df['src'], df['dst'], df['ref'], df['props']):
+            links[(type, node_keys[src], node_keys[dst])].append( (action, ref, prop, src, dst) )
+
+    return nodes, node_keys, links
+
+
+def _link_signature(rows):
+    """Properties of the links between two nodes, without IGNORED_PROPS, in
+    a form that can be compared between days."""
+
+    signature = []
+    for _, ref, prop, _, _ in rows:
+        prop = dict(decode_props(ref), **decode_props(prop))
+        for ignored in IGNORED_PROPS:
+            prop.pop(ignored, None)
+        signature.append(encode_props(prop))
+
+    return sorted(signature)
+
+
+def diff(path, previous_path):
+    """Compare the spool in path with the spool of a previous day of the same
+    crawler. Links are identified by their type and end nodes. Return the
+    keys of added, removed and changed links, and the spooled nodes and links
+    of both spools."""
+
+    nodes, node_keys, links = _spooled_links(path)
+    prev_nodes, prev_node_keys, prev_links = _spooled_links(previous_path)
+
+    added = [ key for key in links if key not in prev_links ]
+    removed = [ key for key in prev_links if key not in links ]
+    changed = [ key for key in links if key in prev_links
+               and _link_signature(links[key]) != _link_signature(prev_links[key]) ]
+
+    return added, removed, changed, (nodes, node_keys, links), (prev_nodes, prev_node_keys, prev_links)
+
+
+def _link_props(rows):
+    """Return the properties of the links written to the database for the
+    given spool rows (links between the same nodes), without IGNORED_PROPS.
+    Rows written with 'create' or 'add' are distinct links, rows written with
+    'upsert' are merged on their reference_name and rows written with
+    'merge' into a single link."""
+
+    merged = {}
+    links = []
+    for action, ref, prop, _, _ in rows:
+        prop = dict(decode_props(ref), **decode_props(prop))
+        if action == 'upsert':
+            merged.setdefault(('upsert', prop.get('reference_name')), {}).update(prop)
+        elif action == 'merge':
+            merged.setdefault(('merge',), {}).update(prop)
+        else:
+            links.append(prop)
+    links.extend(merged.values())
+
+    return [ { key: value for key, value in prop.items()
+              if key not in IGNORED_PROPS and value is not None }
+            for prop in links ]
+
+
+def _delete_links(iyp, keys, links, ids, keep=()):
+    """Delete links of the given keys written by the spool, links are
+    matched on all their properties but IGNORED_PROPS, so that links written
+    by other crawlers (or merged with them) are kept. Links merged with an
+    existing link may be stored in the other direction, so links are matched
+    in both directions unless the reverse link is in keep."""
+
+    groups = defaultdict(dict)
+    for key in keys:
+        type, src_key, dst_key = key
+        undirected = (type, dst_key, src_key) not in keep
+        _, _, _, src, dst = links[key][0]
+        if ids[src] is None or ids[dst] is None:
+            continue
+
+        for prop in _link_props(links[key]):
+            # Identical links are deleted at once
+            groups[type][(ids[src], ids[dst], encode_props(prop))] = {
+                    'src_id': ids[src], 'dst_id': ids[dst], 'props': prop, 'undirected': undirected }
+
+    for type, batch in groups.items():
+        iyp._push_batches(f"""WITH $batch AS batch
+            UNWIND batch AS link
+            MATCH (x)-[l:{type}]-(y)
+            WHERE ID(x) = link.src_id AND ID(y) = link.dst_id
+                AND (link.undirected OR startNode(l) = x)
+                AND size([k IN keys(l) WHERE NOT k IN $ignored]) = size(keys(link.props))
+                AND all(k IN keys(link.props) WHERE l[k] = link.props[k])
+            DELETE l""", list(batch.values()), params={'ignored': IGNORED_PROPS})
+
+
+def apply_diff(path, previous_path, iyp=None):
+    """Update IYP, which contains the data of the spool in previous_path, with
+    the spool in path. Only links that are added, removed or changed (whose
+    properties other than IGNORED_PROPS changed) are written, as well as
+    nodes that are new or whose properties changed. Unchanged links keep the
+    reference_time and reference_url of the day they were written. Nodes are
+    never removed, they may be shared with other crawlers.
+
+    A new IYP client is used (and closed) if iyp is not given."""
+
+    for spool in [path, previous_path]:
+        if not os.path.exists(os.path.join(spool, NODES_FNAME)):
+            raise Exception(f'Incomplete spool {spool}')
+
+    close = iyp is None
+    if iyp is None:
+        iyp = IYP()
+
+    logging.warning(f'Spool: applying {path} over {previous_path}')
+    added, removed, changed, today, previous = diff(path, previous_path)
+    nodes, node_keys, links = today
+    prev_nodes, prev_node_keys, prev_links = previous
+
+    # Old versions of removed and changed links are deleted, links of today
+    # that are not written again are kept
+    stale = removed + changed
+    fresh = added + changed
+    handles = set( handle for key in stale for row in prev_links[key] for handle in row[3:] )
+    prev_ids = _resolve_subset(iyp, prev_nodes, handles)
+    _delete_links(iyp, stale, prev_links, prev_ids, keep=set(links) - set(fresh))
+
+    # New nodes and ends of new links are written
+    prev_node_set = set(prev_node_keys)
+    handles = set( handle for key in fresh for row in links[key] for handle in row[3:] )
+    handles.update( handle for handle, key in enumerate(node_keys) if key not in prev_node_set )
+    ids = _resolve_subset(iyp, nodes, handles)
+
+    groups = defaultdict(list)
+    for key in fresh:
+        for action, ref, prop, src, dst in links[key]:
+            if ids[src] is None or ids[dst] is None:
+                logging.error(f'Spool: missing node for {key[0]} link in {path}')
+                continue
+
+            groups[(key[0], action, ref)].append(
+                    {'src_id': ids[src], 'dst_id': ids[dst], 'props': [decode_props(prop)]} )
+
+    _push_links(iyp, groups)
+
+    logging.warning(f'Spool: {path}: {len(added)} added, {len(removed)} removed, '
+                    f'{len(changed)} changed out of {len(links)} links')
+
+    if close:
+        iyp.close()
+
+
+def _resolve_subset(iyp, nodes, handles):
+    """Same as _resolve_nodes for the given handles only."""
+
+    ids = [None] * len(nodes)
+    if len(handles) == 0:
+        return ids
+
+    handles = sorted(handles)
+    subset = nodes.iloc[handles].reset_index(drop=True)
+    for handle, node_id in zip(handles, _resolve_nodes(iyp, subset)):
+        ids[handle] = node_id
+
+    return ids
+
+
+def update(path, previous_path=None, iyp=None):
+    """Load the spool in path, only its differences with previous_path if it
+    is given (see apply_diff)."""
+
+    if previous_path is None:
+        load(path, iyp)
+    else:
+        apply_diff(path, previous_path, iyp)
+
+
+# Load spools given on the command line
+if __name__ == '__main__':
+
+    FORMAT = '%(asctime)s %(processName)s %(message)s'
+    logging.basicConfig(
+            format=FORMAT,
+            level=logging.WARNING,
+            datefmt='%Y-%m-%d %H:%M:%S'
+            )
+
+    if len(sys.argv) < 2:
+        sys.exit(f'usage: {sys.argv[0]} SPOOL_DIR [SPOOL_DIR ...]')
+
+    iyp = IYP()
+    for path in sys.argv[1:]:
+        load(path, iyp)
+    iyp.close()
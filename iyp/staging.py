@@ -0,0 +1,527 @@
+import csv
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import zlib
+from collections import defaultdict
+from datetime import datetime
+from iyp import NODE_CONSTRAINTS, NODE_CONSTRAINTS_LABELS, format_properties, format_value
+
+# Files written by each crawler in its staging directory
+NODES_FNAME = 'nodes.csv.gz'
+RELS_FNAME = 'rels-{type}-{seq}.csv.gz'
+# Written when the crawler is closed, files of other crawlers are read only
+# once they are complete
+DONE_FNAME = 'done'
+
+# Directory (in the staging root) where the finalizer writes the files given to
+# neo4j-admin
+IMPORT_DIR = 'import'
+
+
+def _encode_value(value):
+    if isinstance(value, datetime):
+        return {'$datetime': value.isoformat()}
+
+    return str(value)
+
+
+def _decode_value(obj):
+    if len(obj) == 1 and '$datetime' in obj:
+        return datetime.fromisoformat(obj['$datetime'])
+
+    return obj
+
+
+def encode_props(prop):
+    """Serialize properties to JSON, datetimes are preserved."""
+
+    return json.dumps(prop, sort_keys=True, default=_encode_value)
+
+
+def decode_props(data):
+    """Deserialize properties encoded with encode_props."""
+
+    return json.loads(data, object_hook=_decode_value)
+
+
+def node_space(type):
+    """Return the label used as ID space for a node with the given label(s),
+    that is the label with constraints if any, the first label otherwise."""
+
+    if isinstance(type, str):
+        return type
+
+    has_constraints = NODE_CONSTRAINTS_LABELS.intersection(type)
+    if len(has_constraints):
+        return sorted(has_constraints)[0]
+
+    return type[0]
+
+
+def node_key(space, prop):
+    """Return the identifier of a node within its ID space. Nodes are
+    identified by their constrained properties if any, or by all their
+    properties otherwise (same as IYP.get_node). Keys are encoded with
+    encode_props, decode_props(key) gives back the identifying properties."""
+
+    if space in NODE_CONSTRAINTS:
+        prop = dict([ (c, prop[c]) for c in NODE_CONSTRAINTS[space].keys() ])
+
+    return encode_props(prop)
+
+
+def value_type(value):
+    """Find the neo4j-admin type of a value, None for None."""
+
+    if value is None:
+        return None
+    elif isinstance(value, bool):
+        return 'boolean'
+    elif isinstance(value, int):
+        return 'long'
+    elif isinstance(value, float):
+        return 'double'
+    elif isinstance(value, datetime):
+        return 'datetime'
+
+    return 'string'
+
+
+def neo4j_type(values):
+    """Find the neo4j-admin type for a column with the given values."""
+
+    return column_type(set( value_type(value) for value in values ))
+
+
+def column_type(types):
+    """Find the neo4j-admin type for a column given the types of its
+    values."""
+
+    types = types - {None}
+    if types == {'long', 'double'}:
+        return 'double'
+    if len(types) == 1:
+        return types.pop()
+
+    return 'string'
+
+
+def neo4j_value(value):
+    """Format a property value for neo4j-admin CSV files."""
+
+    if value is None:
+        return ''
+    elif isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, datetime):
+        return value.isoformat()
+    elif isinstance(value, (list, dict)):
+        return json.dumps(value, default=str)
+
+    return value
+
+
+def write_csv(fname, header_prefix, rows, props):
+    """Write rows in a neo4j-admin CSV file. rows are lists of values for the
+    header_prefix columns followed by a dictionary of properties (one per row
+    in props)."""
+
+    write_csv_stream(fname, header_prefix, lambda: zip(rows, props))
+
+
+def write_csv_stream(fname, header_prefix, rows):
+    """Same as write_csv but rows() returns an iterator over (row, prop)
+    pairs, it is called twice: to find the columns and their types, and to
+    write the file."""
+
+    value_types = defaultdict(set)
+    for _, prop in rows():
+        for key, value in prop.items():
+            value_types[key].add(value_type(value))
+
+    keys = sorted(value_types.keys())
+    types = {key: column_type(value_types[key]) for key in keys}
+
+    with gzip.open(fname, 'wt', newline='') as fp:
+        writer = csv.writer(fp)
+        writer.writerow( header_prefix + [f'{key}:{types[key]}' for key in keys] )
+        for row, prop in rows():
+            writer.writerow( row + [neo4j_value(prop.get(key)) for key in keys] )
+
+
+class StagingIYP(object):
+    """Drop-in replacement for IYP that writes nodes and links to files instead
+    of a live database. The staged files of all crawlers are then merged by
+    finalize() and imported with neo4j-admin."""
+
+    def __init__(self, root, name):
+
+        logging.debug(f'StagingIYP: staging data in {root}')
+
+        self.root = root
+        self.path = os.path.join(root, name)
+
+        # Remove data staged by a previous run of this crawler
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+
+        # Nodes are referenced by handles (integers) in crawlers
+        self.handles = {}
+        self.nodes = []
+
+        self.nodes_fp = gzip.open(os.path.join(self.path, NODES_FNAME), 'wt', newline='')
+        self.nodes_writer = csv.writer(self.nodes_fp)
+
+        # links given to add_links are written on commit
+        self.pending_links = defaultdict(list)
+        self.nb_files = 0
+
+        # Nodes staged by crawlers that are done, see _staged_index
+        self.indexes = {}
+        self.scanned = defaultdict(set)
+
+    def _handle(self, space, key):
+        """Return the handle for the given node."""
+
+        handle = self.handles.get((space, key))
+        if handle is None:
+            handle = len(self.nodes)
+            self.nodes.append( (space, key) )
+            self.handles[(space, key)] = handle
+
+        return handle
+
+    def _stage_node(self, space, prop, labels=None):
+        """Write the node to the staging file (if it is new or comes with
+        labels) and return its handle."""
+
+        key = node_key(space, prop)
+        is_new = (space, key) not in self.handles
+        handle = self._handle(space, key)
+
+        if is_new or labels is not None:
+            labels = [space] if labels is None else labels
+            self.nodes_writer.writerow([space, key, ';'.join(labels), encode_props(prop)])
+
+        if is_new:
+            for (index_space, prop_name), index in self.indexes.items():
+                if index_space == space:
+                    self._index_node(index, prop_name, key, prop)
+
+        return handle
+
+    @staticmethod
+    def _index_node(index, prop_name, key, prop):
+        """Add a node to an index returned by _staged_index."""
+
+        if prop_name is None:
+            index[key] = key
+        elif prop_name in prop:
+            index.setdefault(prop[prop_name], key)
+
+    def _finished(self, fname):
+        """Return True if fname was written by a crawler that is done."""
+
+        return os.path.exists(os.path.join(os.path.dirname(fname), DONE_FNAME))
+
+    def _staged_index(self, space, prop_name):
+        """Return the keys of nodes staged by all crawlers in the given ID
+        space indexed by the value of the property prop_name, or by themselves
+        if prop_name is None. Crawlers that are still running are ignored.
+
+        Indexes are kept and updated with files of crawlers done since the
+        last call and with nodes staged by this crawler, so that files are
+        read only once."""
+
+        index = self.indexes.get((space, prop_name))
+        if index is None:
+            index = {}
+            self.indexes[(space, prop_name)] = index
+
+            # Nodes staged by this crawler, their key gives the identifying
+            # properties
+            for staged_space, key in self.nodes:
+                if staged_space == space:
+                    self._index_node(index, prop_name, key, decode_props(key))
+
+        scanned = self.scanned[(space, prop_name)]
+        for fname in glob.glob(os.path.join(self.root, '*', NODES_FNAME)):
+            # the file for this crawler is still open
+            if (fname in scanned or os.path.dirname(fname) == self.path
+                    or not self._finished(fname)):
+                continue
+
+            scanned.add(fname)
+            with gzip.open(fname, 'rt', newline='') as fp:
+                try:
+                    for row_space, key, _, prop in csv.reader(fp):
+                        if row_space == space:
+                            self._index_node(index, prop_name, key, decode_props(prop))
+                except (EOFError, ValueError, zlib.error, csv.Error):
+                    logging.error(f'Staging: incomplete file {fname}')
+
+        return index
+
+    def _staged_links(self, type):
+        """Iterate over the header and rows of links of the given type staged
+        by all crawlers."""
+
+        for fname in glob.glob(os.path.join(self.root, '*', RELS_FNAME.format(type=type, seq='*'))):
+            if os.path.dirname(fname) != self.path and not self._finished(fname):
+                continue
+
+            with gzip.open(fname, 'rt', newline='') as fp:
+                reader = csv.reader(fp)
+                header = next(reader)
+                for row in reader:
+                    yield header, row
+
+    def commit(self):
+        """Write links given to add_links."""
+
+        for type, links in self.pending_links.items():
+            self.batch_add_links(type, links)
+
+        self.pending_links = defaultdict(list)
+
+    def rollback(self):
+        """Discard links given to add_links since the last commit."""
+
+        self.pending_links = defaultdict(list)
+
+    def batch_get_nodes(self, type, prop_name, prop_set=set(), all=True, upsert=False):
+        """Same as IYP.batch_get_nodes but returns handles of staged nodes.
+        Values of prop_set already staged are found, not staged again."""
+
+        index = self._staged_index(type, prop_name)
+
+        ids = {}
+        if all and not upsert:
+            for value, key in index.items():
+                ids[value] = self._handle(type, key)
+
+        for val in prop_set:
+            if val in index:
+                ids[val] = self._handle(type, index[val])
+            else:
+                ids[val] = self._stage_node(type, {prop_name: val})
+
+        return ids
+
+    def get_node(self, type, prop, create=False):
+        """Same as IYP.get_node but returns handles of staged nodes."""
+
+        prop = format_properties(prop)
+        space = node_space(type)
+        labels = [type] if isinstance(type, str) else type
+
+        if not create:
+            key = node_key(space, prop)
+            if (space, key) not in self.handles:
+                if key not in self._staged_index(space, None):
+                    return None
+
+            return self._handle(space, key)
+
+        return self._stage_node(space, prop, labels)
+
+    def batch_get_node_extid(self, id_type):
+        """Same as IYP.batch_get_node_extid but for staged nodes."""
+
+        self.commit()
+
+        ids = {}
+        for header, row in self._staged_links('EXTERNAL_ID'):
+            if header[1] != f':END_ID({id_type})':
+                continue
+
+            src_space = header[0][len(':START_ID('):-1]
+            ids[decode_props(row[1])['id']] = self._handle(src_space, row[0])
+
+        return ids
+
+    def get_node_extid(self, id_type, id):
+        """Same as IYP.get_node_extid but for staged nodes."""
+
+        return self.batch_get_node_extid(id_type).get(id)
+
+    def batch_get_ranked_nodes(self, type, prop_name, max_rank):
+        """Same as IYP.batch_get_ranked_nodes for RANK links staged by
+        crawlers that are done."""
+
+        self.commit()
+
+        ids = {}
+        for header, row in self._staged_links('RANK'):
+            if header[0] != f':START_ID({type})' or header[1] != ':END_ID(Ranking)':
+                continue
+
+            columns = [ column.split(':')[0] for column in header ]
+            if 'rank' not in columns:
+                continue
+
+            rank = row[columns.index('rank')]
+            if rank == '' or float(rank) >= max_rank:
+                continue
+
+            value = decode_props(row[0]).get(prop_name)
+            if value is not None:
+                ids[value] = self._handle(type, row[0])
+
+        return ids
+
+    def get_dataset(self, name):
+        """Staged data is imported in a new database, the Dataset node is
+        unknown."""
+
+        return None
+
+    def set_dataset(self, props):
+        """Stage the Dataset node of the crawler."""
+
+        self.get_node('Dataset', props, create=True)
+
+    def reuse_dataset(self, name):
+        """Never called, as get_dataset returns None."""
+
+        pass
+
+    def batch_add_links(self, type, links, action='create', reference=None):
+        """Same as IYP.batch_add_links but write links to a CSV file per pair
+        of ID spaces. The action parameter is ignored as links are written only
+        once."""
+
+        # neo4j-admin needs the ID space of each end in the header
+        groups = defaultdict(list)
+        for link in links:
+            src_space, src_key = self.nodes[link['src_id']]
+            dst_space, dst_key = self.nodes[link['dst_id']]
+
+            prop = dict(reference) if reference is not None else {}
+            for p in link['props']:
+                prop.update(p)
+
+            groups[(src_space, dst_space)].append( ([src_key, dst_key, type], prop) )
+
+        for (src_space, dst_space), rows in groups.items():
+            fname = os.path.join(self.path, RELS_FNAME.format(type=type, seq=self.nb_files))
+            self.nb_files += 1
+
+            write_csv(
+                    fname,
+                    [f':START_ID({src_space})', f':END_ID({dst_space})', ':TYPE'],
+                    [row for row, _ in rows],
+                    [prop for _, prop in rows]
+                    )
+
+    def batch_add_links_by_key(self, type, links, action='create', reference=None):
+        """Same as IYP.batch_add_links_by_key but for staged nodes."""
+
+        id_links = []
+        for link in links:
+            ends = []
+            for end in [link['src'], link['dst']]:
+                if not isinstance(end, int):
+                    label, prop_name, value = end
+                    end = self._stage_node(label, {prop_name: format_value(prop_name, value)})
+                ends.append(end)
+
+            id_links.append( {'src_id': ends[0], 'dst_id': ends[1], 'props': link['props']} )
+
+        self.batch_add_links(type, id_links, action, reference)
+
+    def add_links(self, src_node, links):
+        """Same as IYP.add_links, links are written on commit."""
+
+        for (type, dst_node, prop) in links:
+
+            assert 'reference_org' in prop
+            assert 'reference_url' in prop
+            assert 'reference_name' in prop
+            assert 'reference_time' in prop
+
+            self.pending_links[type].append(
+                    {'src_id': src_node, 'dst_id': dst_node, 'props': [format_properties(prop)]} )
+
+    def close(self):
+        """Write pending links and close staging files"""
+
+        self.commit()
+        self.nodes_fp.close()
+
+        with open(os.path.join(self.path, DONE_FNAME), 'w'):
+            pass
+
+
+def _merged_nodes(db, space):
+    """Iterate over ([key, labels], properties) of nodes of the given ID space
+    in the database written by finalize. Rows with the same key are merged
+    into a single node with the union of their labels and properties, later
+    rows overriding earlier ones."""
+
+    key, labels, prop = None, set(), {}
+    for row_key, row_labels, row_prop in db.execute(
+            'SELECT key, labels, props FROM nodes WHERE space = ? ORDER BY key, rowid', (space,)):
+        if row_key != key:
+            if key is not None:
+                yield [key, ';'.join(sorted(labels))], prop
+            key, labels, prop = row_key, set(), {}
+
+        labels.update(row_labels.split(';'))
+        prop.update(decode_props(row_prop))
+
+    if key is not None:
+        yield [key, ';'.join(sorted(labels))], prop
+
+
+def finalize(root):
+    """Merge nodes staged by all crawlers and write the files given to
+    neo4j-admin in the import directory. Nodes with the same ID in an ID space
+    are merged into a single node with the union of their labels and
+    properties. Staged nodes are first copied to an SQLite database in the
+    import directory, nodes are then merged and written one ID space at a
+    time so that they are never all in memory.
+
+    return: the neo4j-admin arguments, with paths relative to the staging
+    directory"""
+
+    import_dir = os.path.join(root, IMPORT_DIR)
+    shutil.rmtree(import_dir, ignore_errors=True)
+    os.makedirs(import_dir)
+
+    db_fname = os.path.join(import_dir, 'nodes.sqlite')
+    db = sqlite3.connect(db_fname)
+    db.execute('CREATE TABLE nodes (space TEXT, key TEXT, labels TEXT, props TEXT)')
+    for fname in glob.glob(os.path.join(root, '*', NODES_FNAME)):
+        with gzip.open(fname, 'rt', newline='') as fp:
+            db.executemany('INSERT INTO nodes VALUES (?, ?, ?, ?)', csv.reader(fp))
+    db.execute('CREATE INDEX nodes_key ON nodes (space, key)')
+    db.commit()
+
+    args = []
+    spaces = [ space for space, in db.execute('SELECT DISTINCT space FROM nodes') ]
+    for space in spaces:
+        fname = f'nodes-{space}.csv.gz'
+        nb_nodes, = db.execute('SELECT count(DISTINCT key) FROM nodes WHERE space = ?', (space,)).fetchone()
+        logging.warning(f'Staging: {nb_nodes} {space} nodes')
+
+        write_csv_stream(
+                os.path.join(import_dir, fname),
+                [f':ID({space})', ':LABEL'],
+                lambda: _merged_nodes(db, space)
+                )
+        args.append(f'--nodes={IMPORT_DIR}/{fname}')
+
+    db.close()
+    os.remove(db_fname)
+
+    # Links files are ready for import
+    for fname in sorted(glob.glob(os.path.join(root, '*', RELS_FNAME.format(type='*', seq='*')))):
+        args.append(f'--relationships={os.path.relpath(fname, root)}')
+
+    return args
@@ -0,0 +1,159 @@
+import logging
+import os
+import random
+import re
+import threading
+import timeit
+from collections import defaultdict
+
+# Directory where slow-statement reports are written
+TRACE_DIR = './tmp/trace/'
+
+# Number of statements listed in reports
+REPORT_SIZE = 20
+
+
+def query_shape(query):
+    """Query text with whitespace collapsed."""
+
+    return re.sub(r'\s+', ' ', query).strip()
+
+
+def nb_params(params):
+    """Number of parameter values, items of lists (e.g. batches) are counted
+    individually."""
+
+    return sum( len(value) if isinstance(value, (list, dict)) else 1 for value in params.values() )
+
+
+def db_hits(plan):
+    """Total number of db hits in a profiled plan."""
+
+    if plan is None:
+        return 0
+
+    return plan.get('dbHits', 0) + sum( db_hits(child) for child in plan.get('children', []) )
+
+
+class TracedResult(list):
+    """Records of a traced statement, with the methods of neo4j results used
+    by IYP."""
+
+    def __init__(self, records, summary):
+        super().__init__(records)
+        self.summary = summary
+
+    def single(self):
+        return self[0] if len(self) else None
+
+    def consume(self):
+        return self.summary
+
+
+class Tracer(object):
+    """Record the shape, number of parameters, number of rows and elapsed
+    time of statements sent by an IYP client, and a sample of profiled plans.
+    Transactions are tagged with metadata (crawler name, transaction or batch
+    number) that appears in neo4j's query log and in SHOW TRANSACTIONS.
+
+    Tracing is enabled by the IYP_TRACE environment variable,
+    IYP_TRACE_PROFILE gives the fraction of statements run with PROFILE."""
+
+    def __init__(self, name, keep_times=False):
+        self.name = name if name is not None else 'iyp'
+        # keep elapsed times of all statements (see times)
+        self.keep_times = keep_times
+        self.times = []
+        self.profile_rate = float(os.environ.get('IYP_TRACE_PROFILE', 0))
+        self.lock = threading.Lock()
+
+        # query shape -> aggregated statistics
+        self.shapes = defaultdict(lambda: {
+            'count': 0, 'time': 0, 'max_time': 0, 'rows': 0, 'max_params': 0,
+            'profiled': 0, 'db_hits': 0})
+        # slowest statements
+        self.slowest = []
+        self.nb_tx = 0
+
+    def metadata(self, **kwargs):
+        """Transaction metadata for the given transaction or batch."""
+
+        return dict(crawler=self.name, **kwargs)
+
+    def next_tx(self):
+        """Return the number of the next transaction."""
+
+        with self.lock:
+            self.nb_tx += 1
+            return self.nb_tx
+
+    def run(self, tx, query, params, tag=None):
+        """Run the query in transaction tx and record its statistics. Results
+        are fetched before returning."""
+
+        profile = self.profile_rate > 0 and random.random() < self.profile_rate
+
+        start = timeit.default_timer()
+        result = tx.run('PROFILE '+query if profile else query, **params)
+        records = list(result)
+        summary = result.consume()
+        elapsed = timeit.default_timer() - start
+
+        hits = db_hits(summary.profile) if profile else None
+        self.record(query, params, len(records), elapsed, hits, tag)
+
+        return TracedResult(records, summary)
+
+    def record(self, query, params, rows, elapsed, hits=None, tag=None):
+        """Add statistics for one statement."""
+
+        shape = query_shape(query)
+        count = nb_params(params)
+
+        with self.lock:
+            stats = self.shapes[shape]
+            stats['count'] += 1
+            stats['time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+            stats['rows'] += rows
+            stats['max_params'] = max(stats['max_params'], count)
+            if hits is not None:
+                stats['profiled'] += 1
+                stats['db_hits'] += hits
+
+            if self.keep_times:
+                self.times.append(elapsed)
+
+            self.slowest.append( (elapsed, shape, count, rows, tag) )
+            self.slowest = sorted(self.slowest, key=lambda stmt: stmt[0], reverse=True)[:REPORT_SIZE]
+
+    def report(self, root=TRACE_DIR):
+        """Write the slow-statement report of this client and return its
+        path."""
+
+        os.makedirs(root, exist_ok=True)
+        fname = os.path.join(root, f'{self.name}.txt')
+
+        with self.lock:
+            shapes = sorted(self.shapes.items(), key=lambda item: item[1]['time'], reverse=True)
+            slowest = list(self.slowest)
+
+        with open(fname, 'w') as fp:
+            fp.write(f'# Statements by total time ({self.name})\n')
+            fp.write('total_s\tcount\tmean_s\tmax_s\trows\tmax_params\tdb_hits/stmt\tquery\n')
+            for shape, stats in shapes[:REPORT_SIZE]:
+                hits = stats['db_hits'] / stats['profiled'] if stats['profiled'] else '-'
+                fp.write(f"{stats['time']:.3f}\t{stats['count']}\t{stats['time']/stats['count']:.4f}\t"
+                         f"{stats['max_time']:.3f}\t{stats['rows']}\t{stats['max_params']}\t{hits}\t{shape}\n")
+
+            fp.write(f'\n# Slowest statements ({self.name})\n')
+            fp.write('time_s\tparams\trows\ttag\tquery\n')
+            for elapsed, shape, count, rows, tag in slowest:
+                fp.write(f'{elapsed:.3f}\t{count}\t{rows}\t{tag}\t{shape}\n')
+
+        if len(shapes):
+            shape, stats = shapes[0]
+            logging.warning(f"Trace: {self.name} spent {stats['time']:.1f}s in {stats['count']} "
+                            f"statements: {shape[:200]} (report: {fname})")
+
+        return fname
@@ -0,0 +1,88 @@
+import asyncio
+import pytest
+from iyp.aio import AsyncIYP
+
+
+class FakeResult(object):
+
+    def __init__(self, records):
+        self.records = records
+
+    def __aiter__(self):
+        return self._iter()
+
+    async def _iter(self):
+        for record in self.records:
+            yield record
+
+
+class FakeTransaction(object):
+
+    def __init__(self, db):
+        self.db = db
+
+    async def run(self, query, batch, **params):
+        if 'fail' in batch:
+            raise ValueError('failed batch')
+
+        # Other batches are slow
+        self.db.started += 1
+        await asyncio.sleep(1)
+        self.db.pushed += 1
+
+        return FakeResult([])
+
+    async def commit(self):
+        pass
+
+    def closed(self):
+        return True
+
+
+class FakeSession(object):
+
+    def __init__(self, db):
+        self.db = db
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        self.db.closed += 1
+
+    async def begin_transaction(self, metadata=None):
+        return FakeTransaction(self.db)
+
+
+class FakeDriver(object):
+
+    def __init__(self):
+        self.started = 0
+        self.pushed = 0
+        self.closed = 0
+
+    def session(self):
+        return FakeSession(self)
+
+
+def test_failed_batch_cancels_workers():
+    iyp = AsyncIYP()
+    iyp.db = FakeDriver()
+    iyp.tx = None
+    iyp.batch_sizers['query'].size = 1
+
+    async def begin():
+        return None
+    iyp._begin = begin
+
+    async def push():
+        await iyp._push_batches('query', ['ok', 'ok', 'fail', 'ok', 'ok'], workers=3)
+
+    with pytest.raises(ValueError):
+        asyncio.run(push())
+
+    # Batches started before the failure are cancelled, no other batch is
+    # started and all sessions are closed
+    assert iyp.db.started == 2
+    assert iyp.db.pushed == 0
+    assert iyp.db.closed == 3
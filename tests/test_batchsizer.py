@@ -0,0 +1,42 @@
+from iyp import MAX_BATCH_PAYLOAD, MIN_BATCH_SIZE, TARGET_COMMIT_TIME, BatchSizer
+
+
+def test_update_moves_toward_target_time():
+    sizer = BatchSizer(1000)
+
+    # Fast transactions at most double the size
+    sizer.update(1000, 0.1, 1000)
+    assert sizer.size == 2000
+
+    # Slow transactions move half way to the size lasting TARGET_COMMIT_TIME
+    sizer.update(2000, 4*TARGET_COMMIT_TIME, 1000)
+    assert sizer.size == (2000 + 500) // 2
+
+    # Never below MIN_BATCH_SIZE
+    sizer = BatchSizer(MIN_BATCH_SIZE)
+    sizer.update(MIN_BATCH_SIZE, 1000*TARGET_COMMIT_TIME, 1000)
+    assert sizer.size == MIN_BATCH_SIZE
+
+
+def test_update_limits_payload():
+    sizer = BatchSizer(1000)
+
+    # Parameters twice as large as allowed
+    sizer.update(1000, 0.1, 2*MAX_BATCH_PAYLOAD)
+    assert sizer.size == (1000 + 500) // 2
+
+
+def test_shrink_bisects_failed_batches():
+    sizer = BatchSizer(1000)
+
+    sizer.shrink(1000)
+    assert sizer.size == 500
+    sizer.shrink(500)
+    assert sizer.size == 250
+
+    # A smaller failed batch doesn't increase the size
+    sizer.shrink(1000)
+    assert sizer.size == 250
+
+    sizer.shrink(1)
+    assert sizer.size == 1
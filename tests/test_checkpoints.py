@@ -0,0 +1,30 @@
+from iyp.checkpoints import Checkpoints, fingerprint
+
+
+def test_fingerprint():
+    items = [ {'src_id': i, 'dst_id': i+1} for i in range(100000) ]
+
+    assert fingerprint('query', items) == fingerprint('query', list(items))
+    assert fingerprint('query', items) != fingerprint('other query', items)
+    assert fingerprint('query', items) != fingerprint('query', items[:-1])
+    assert fingerprint('query', items) != fingerprint('query', items[:-1] + [{'src_id': 0, 'dst_id': 0}])
+    assert fingerprint('query', items) != fingerprint('query', [{'src_id': 0, 'dst_id': 0}] + items[1:])
+    assert fingerprint('query', []) != fingerprint('query', [1])
+
+
+def test_resume(tmp_path):
+    checkpoints = Checkpoints('crawler', 'db', root=str(tmp_path))
+    push_id, segments = checkpoints.start('fp', 100)
+    assert segments == [(0, 100)]
+    checkpoints.done(push_id, 0, 10)
+    checkpoints.done(push_id, 20, 30)
+    checkpoints.done(push_id, 10, 20)
+
+    # Restarted crawler
+    checkpoints = Checkpoints('crawler', 'db', root=str(tmp_path))
+    assert checkpoints.start('fp', 100) == ('0', [(30, 100)])
+    assert checkpoints.start('other', 50) == ('1', [(0, 50)])
+
+    # Other database
+    checkpoints = Checkpoints('crawler', 'other db', root=str(tmp_path))
+    assert checkpoints.start('fp', 100) == ('0', [(0, 100)])
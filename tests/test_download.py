@@ -0,0 +1,14 @@
+from iyp.download import DownloadCache
+
+
+def test_cache_key_includes_headers(tmp_path):
+    cache = DownloadCache(str(tmp_path))
+    url = 'https://api.example.org/datasets'
+
+    assert cache._meta_path(url, None) == cache._meta_path(url, None, {})
+    assert cache._meta_path(url, None) != cache._meta_path(url, None, {'Authorization': 'Bearer a'})
+    assert (cache._meta_path(url, None, {'Authorization': 'Bearer a'})
+            != cache._meta_path(url, None, {'Authorization': 'Bearer b'}))
+    assert (cache._meta_path(url, None, {'Accept': 'text/csv'})
+            == cache._meta_path(url, None, {'accept': 'text/csv'}))
+    assert cache._meta_path(url, {'page': 1}) != cache._meta_path(url, {'page': 2})
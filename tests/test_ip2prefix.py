@@ -0,0 +1,125 @@
+import ipaddress
+from iyp.lpm import PrefixMatcher
+from iyp.post import ip2prefix
+
+
+class FakeIYP(object):
+    """Answers the queries of the ip2prefix post-process on a small graph."""
+
+    def __init__(self):
+        self.prefixes = {}
+        self.ips = {}
+        self.links = {}
+        self.next_id = 0
+
+    def _new_id(self):
+        self.next_id += 1
+        return self.next_id
+
+    def add_prefix(self, prefix):
+        id = self._new_id()
+        self.prefixes[id] = {'prefix': prefix, ip2prefix.MARK: None}
+        return id
+
+    def add_ip(self, ip):
+        id = self._new_id()
+        self.ips[id] = ip
+        return id
+
+    def prefix_of(self, ip_id):
+        prefixes = [ pfx for src, pfx in self.links.values() if src == ip_id ]
+        assert len(prefixes) <= 1
+        return self.prefixes[prefixes[0]]['prefix'] if prefixes else None
+
+    def _run(self, query, **params):
+        if 'MATCH (pfx:Prefix)' in query:
+            return [ {'prefix': node['prefix'], '_id': id, 'processed': node[ip2prefix.MARK] is not None}
+                    for id, node in self.prefixes.items() ]
+
+        linked = { src: (pfx, link_id) for link_id, (src, pfx) in self.links.items() }
+        if 'NOT (ip)-[:PART_OF]' in query:
+            return [ {'ip': ip, '_id': id} for id, ip in self.ips.items() if id not in linked ]
+
+        assert 'ID(pfx) IN $ids' in query
+        return [ {'ip': self.ips[id], '_id': id, 'prefix_id': pfx, 'link_id': link_id}
+                for id, (pfx, link_id) in linked.items() if pfx in params['ids'] ]
+
+    def batch_add_links(self, type, links, action='create', reference=None):
+        for link in links:
+            if (link['src_id'], link['dst_id']) not in self.links.values():
+                self.links[self._new_id()] = (link['src_id'], link['dst_id'])
+
+    def _push_batches(self, query, items):
+        for id in items:
+            if 'DELETE l' in query:
+                del self.links[id]
+            else:
+                self.prefixes[id][ip2prefix.MARK] = True
+
+
+def run(iyp):
+    post = ip2prefix.PostProcess.__new__(ip2prefix.PostProcess)
+    post.iyp = iyp
+    post.reference = {'reference_name': 'iyp'}
+    post.run()
+
+
+def best_prefix(ip, prefixes):
+    nets = [ ipaddress.ip_network(prefix) for prefix in prefixes ]
+    covering = [ net for net in nets if ipaddress.ip_address(ip) in net ]
+    return str(max(covering, key=lambda net: net.prefixlen)) if covering else None
+
+
+def test_new_prefix_inside_old_prefixes():
+    iyp = FakeIYP()
+    iyp.add_prefix('10.0.0.0/8')
+    iyp.add_prefix('10.1.0.0/24')
+    ips = { ip: iyp.add_ip(ip) for ip in ['10.1.5.5', '10.1.0.7', '10.2.0.1', '11.0.0.1'] }
+    run(iyp)
+
+    assert iyp.prefix_of(ips['10.1.5.5']) == '10.0.0.0/8'
+    assert iyp.prefix_of(ips['10.1.0.7']) == '10.1.0.0/24'
+    assert iyp.prefix_of(ips['11.0.0.1']) is None
+
+    # The new /16 encloses the old /24 and is enclosed by the old /8
+    iyp.add_prefix('10.1.0.0/16')
+    run(iyp)
+
+    assert iyp.prefix_of(ips['10.1.5.5']) == '10.1.0.0/16'
+    assert iyp.prefix_of(ips['10.1.0.7']) == '10.1.0.0/24'
+    assert iyp.prefix_of(ips['10.2.0.1']) == '10.0.0.0/8'
+    assert iyp.prefix_of(ips['11.0.0.1']) is None
+
+
+def test_incremental_matches_full_run():
+    prefixes = ['10.0.0.0/8', '10.1.0.0/24', '10.0.0.0/12', '2001:db8::/32', '2001:db8:1::/48']
+    new_prefixes = ['10.1.0.0/16', '10.0.0.0/9', '2001:db8:1:2::/64', '10.1.0.128/25', '11.0.0.0/8']
+    ips = ['10.1.5.5', '10.1.0.7', '10.1.0.200', '10.2.0.1', '10.200.0.1', '11.0.0.1',
+           '2001:db8:1:2::1', '2001:db8:1:3::1', '2001:db8:2::1', '12.0.0.1']
+
+    iyp = FakeIYP()
+    for prefix in prefixes:
+        iyp.add_prefix(prefix)
+    ip_ids = { ip: iyp.add_ip(ip) for ip in ips }
+    run(iyp)
+
+    for prefix in new_prefixes:
+        iyp.add_prefix(prefix)
+    run(iyp)
+
+    for ip, id in ip_ids.items():
+        assert iyp.prefix_of(id) == best_prefix(ip, prefixes + new_prefixes), ip
+
+    # Nothing left to do
+    nb_links = len(iyp.links)
+    run(iyp)
+    assert len(iyp.links) == nb_links
+
+
+def test_enclosing():
+    matcher = PrefixMatcher([('10.0.0.0/8', 1), ('10.1.0.0/24', 2), ('10.0.0.0/12', 3), ('2001:db8::/32', 4)])
+
+    assert matcher.enclosing(['10.1.0.0/16']) == {1, 3}
+    assert matcher.enclosing(['10.1.0.0/24']) == {1, 3}
+    assert matcher.enclosing(['10.0.0.0/8', '11.0.0.0/16']) == set()
+    assert matcher.enclosing(['2001:db8:1::/48']) == {4}
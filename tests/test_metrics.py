@@ -0,0 +1,22 @@
+from iyp.metrics import Metrics
+
+
+def test_crawler_metrics(tmp_path):
+    metrics = Metrics()
+    metrics.start('first')
+    with metrics.phase('parse'):
+        data = b'x' * (64*1024*1024)
+    metrics.count('rows', 10)
+    metrics.end('first')
+    del data
+
+    crawler = metrics.summary()['crawlers']['first']
+    assert crawler['status'] == 'OK'
+    assert crawler['counters']['rows'] == 10
+    assert crawler['time']['parse'] > 0
+    assert crawler['rss_growth'] >= 32*1024*1024
+    assert crawler['peak_rss'] >= crawler['rss_growth']
+
+    fname = tmp_path / 'metrics.prom'
+    metrics.write_prometheus(str(fname))
+    assert 'iyp_rss_growth_bytes{crawler="first"}' in fname.read_text()
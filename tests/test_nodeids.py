@@ -0,0 +1,43 @@
+from iyp.nodeids import NodeIDMap
+
+
+def test_unsorted_int_values():
+    ids = NodeIDMap.from_items([(2497, 1), (15169, 2), (13335, 3), (1, 4)])
+
+    assert ids[13335] == 3
+    assert ids[1] == 4
+    assert 2498 not in ids
+    assert len(ids) == 4
+    assert list(ids) == [1, 2497, 13335, 15169]
+    assert dict(ids) == {2497: 1, 15169: 2, 13335: 3, 1: 4}
+
+
+def test_unsorted_str_values():
+    ids = NodeIDMap.from_items([('10.0.0.0/8', 1), ('2001:db8::/32', 2), ('1.1.1.0/24', 3), ('été.jp', 4)])
+
+    assert ids['1.1.1.0/24'] == 3
+    assert ids['été.jp'] == 4
+    assert '10.0.0.0/9' not in ids
+    assert sorted(ids) == ['1.1.1.0/24', '10.0.0.0/8', '2001:db8::/32', 'été.jp']
+
+
+def test_mixed_values_and_copy():
+    ids = NodeIDMap.from_items([(1, 10), (2, 20)])
+    ids.append('AS3', 30)
+    ids[(4, 'x')] = 40
+
+    assert ids['AS3'] == 30
+    assert ids[(4, 'x')] == 40
+    assert True not in ids
+    assert len(ids) == 4
+
+    copy = ids.copy()
+    copy[1] = 11
+    copy[5] = 50
+
+    assert ids[1] == 10 and 5 not in ids
+    assert copy[1] == 11 and copy[5] == 50
+    assert sorted(copy.values()) == [11, 20, 30, 40, 50]
+
+    ids.update(copy)
+    assert dict(ids) == dict(copy)
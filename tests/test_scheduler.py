@@ -0,0 +1,74 @@
+import os
+import time
+import pytest
+from iyp.scheduler import Scheduler, check_dependencies, critical_path
+
+
+def record_task(name):
+    """Append the task name to the log file when it starts and ends."""
+
+    log, name = name.split(':')
+    with open(log, 'a') as fp:
+        fp.write(f'start {name}\n')
+    time.sleep(0.1)
+    if name == 'fail':
+        raise ValueError('task failed')
+    with open(log, 'a') as fp:
+        fp.write(f'end {name}\n')
+
+    return name
+
+
+def read_log(log):
+    with open(log) as fp:
+        return fp.read().split('\n')[:-1]
+
+
+def test_dependencies_run_first(tmp_path):
+    log = os.path.join(str(tmp_path), 'log')
+    names = [ f'{log}:{name}' for name in ['c', 'b', 'a', 'd'] ]
+    a, b, c, d = sorted(names)
+    dependencies = {c: [a, b], b: [a]}
+
+    results = Scheduler(dependencies, parallelism=2).run(names, record_task)
+
+    assert results == {a: 'a', b: 'b', c: 'c', d: 'd'}
+    events = read_log(log)
+    assert events.index('end a') < events.index('start b')
+    assert events.index('end b') < events.index('start c')
+    # d doesn't wait for the others
+    assert events.index('start d') < events.index('start b')
+
+
+def test_dependents_of_failed_tasks_are_skipped(tmp_path):
+    log = os.path.join(str(tmp_path), 'log')
+    fail, after, last, other = [ f'{log}:{name}' for name in ['fail', 'after', 'last', 'other'] ]
+    dependencies = {after: [fail], last: [after]}
+
+    done = []
+    results = Scheduler(dependencies, parallelism=2).run(
+            [fail, after, last, other], record_task, lambda name, result: done.append(name))
+
+    assert isinstance(results[fail], ValueError)
+    assert str(results[after]) == f'dependency {fail} failed'
+    assert str(results[last]) == f'dependency {after} failed'
+    assert results[other] == 'other'
+    assert sorted(done) == sorted([fail, after, last, other])
+    assert 'start after' not in read_log(log)
+
+
+def test_check_dependencies():
+    check_dependencies(['a', 'b', 'c'], {'c': ['a', 'b'], 'b': ['a']})
+
+    with pytest.raises(Exception, match='Unknown crawler'):
+        check_dependencies(['a', 'b'], {'b': ['x']})
+    with pytest.raises(Exception, match='Dependency cycle'):
+        check_dependencies(['a', 'b', 'c'], {'a': ['c'], 'b': ['a'], 'c': ['b']})
+
+
+def test_critical_path():
+    durations = {'a': 10, 'b': 5, 'c': 1, 'd': 12}
+    dependencies = {'c': ['a', 'b'], 'b': ['a']}
+
+    assert critical_path(durations, dependencies) == (['a', 'b', 'c'], 16)
+    assert critical_path({}, dependencies) == ([], 0)
@@ -0,0 +1,64 @@
+import pandas as pd
+from iyp.spool import _push_links, _resolve_nodes
+from iyp.staging import encode_props
+
+
+class FakeIYP(object):
+    """Records the queries and links written when loading a spool."""
+
+    def __init__(self):
+        self.queries = []
+        self.added = []
+        self.batch_added = []
+
+    def batch_get_nodes(self, label, prop_name, prop_set, upsert=False):
+        return { value: 1000+i for i, value in enumerate(sorted(prop_set)) }
+
+    def _push_batches(self, query, items, on_records=None, params=None):
+        self.queries.append(query)
+        on_records([ {'handle': item['handle'], '_id': 2000+item['handle']} for item in items ])
+
+    def add_links(self, src_node, links):
+        self.added.append( (src_node, links) )
+
+    def batch_add_links(self, type, links, action='create', reference=None):
+        self.batch_added.append( (type, action, links) )
+
+
+def test_resolve_nodes_in_batches():
+    nodes = pd.DataFrame([
+        ['AS', encode_props({'asn': 2497}), True],
+        ['Organization', encode_props({'name': 'IIJ'}), True],
+        ['Organization', encode_props({'name': 'WIDE'}), True],
+        ['Ranking', encode_props({'name': 'Tranco'}), False],
+        ], columns=['labels', 'props', 'create'])
+
+    iyp = FakeIYP()
+    ids = _resolve_nodes(iyp, nodes)
+
+    assert ids == [1000, 2001, 2002, 2003]
+    # One query for both organizations, one for the ranking
+    assert len(iyp.queries) == 2
+    assert 'MERGE (a:Organization {name: item.prop.name})' in iyp.queries[0]
+    assert 'MATCH (a:Ranking {name: item.prop.name})' in iyp.queries[1]
+
+
+def test_push_links_replays_action():
+    ref = encode_props({'reference_name': 'test'})
+    prop = {'reference_name': 'test', 'reference_org': 'IIJ'}
+    groups = {
+        ('NAME', 'add', encode_props({})): [
+            {'src_id': 1, 'dst_id': 2, 'props': [prop]},
+            {'src_id': 1, 'dst_id': 3, 'props': [prop]},
+            {'src_id': 4, 'dst_id': 2, 'props': [prop]},
+            ],
+        ('ORIGINATE', 'upsert', ref): [
+            {'src_id': 1, 'dst_id': 5, 'props': [{}]},
+            ],
+        }
+
+    iyp = FakeIYP()
+    _push_links(iyp, groups)
+
+    assert iyp.added == [ (1, [['NAME', 2, prop], ['NAME', 3, prop]]), (4, [['NAME', 2, prop]]) ]
+    assert [ (type, action) for type, action, _ in iyp.batch_added ] == [('ORIGINATE', 'upsert')]
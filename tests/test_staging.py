@@ -0,0 +1,53 @@
+import csv
+import gzip
+import os
+from iyp.staging import StagingIYP, finalize
+
+
+def read_nodes(root, space):
+    with gzip.open(os.path.join(root, 'import', f'nodes-{space}.csv.gz'), 'rt', newline='') as fp:
+        return list(csv.reader(fp))
+
+
+def test_staged_nodes_are_found(tmp_path):
+    root = str(tmp_path)
+
+    first = StagingIYP(root, 'first')
+    first.get_node('Ranking', {'name': 'Tranco', 'size': 10}, create=True)
+    first.batch_get_nodes('AS', 'asn', {1, 2})
+    first.close()
+
+    second = StagingIYP(root, 'second')
+    assert set(second.batch_get_nodes('AS', 'asn', {2, 3}, all=False)) == {2, 3}
+    assert set(second.batch_get_nodes('AS', 'asn')) == {1, 2, 3}
+    assert second.get_node('Ranking', {'name': 'Tranco', 'size': 10}) is not None
+    assert second.get_node('Ranking', {'name': 'Tranco'}) is None
+    second.close()
+
+    # AS 2 is found, not staged again
+    with gzip.open(os.path.join(root, 'second', 'nodes.csv.gz'), 'rt', newline='') as fp:
+        assert [ row[1] for row in csv.reader(fp) ] == ['{"asn": 3}']
+
+    finalize(root)
+    assert [ row[0] for row in read_nodes(root, 'AS')[1:] ] == ['{"asn": 1}', '{"asn": 2}', '{"asn": 3}']
+
+
+def test_finalize_merges_nodes(tmp_path):
+    root = str(tmp_path)
+
+    first = StagingIYP(root, 'first')
+    first.get_node('AS', {'asn': 2497, 'name': 'IIJ'}, create=True)
+    first.close()
+
+    second = StagingIYP(root, 'second')
+    second.get_node(['AS', 'Tagged'], {'asn': 2497, 'country': 'JP'}, create=True)
+    second.close()
+
+    args = finalize(root)
+
+    assert '--nodes=import/nodes-AS.csv.gz' in args
+    assert not os.path.exists(os.path.join(root, 'import', 'nodes.sqlite'))
+    assert read_nodes(root, 'AS') == [
+            [':ID(AS)', ':LABEL', 'asn:long', 'country:string', 'name:string'],
+            ['{"asn": 2497}', 'AS;Tagged', '2497', 'JP', 'IIJ'],
+            ]